@@ -1,54 +1,243 @@
+import shutil
 import typing
 from pathlib import Path
 
 import boto3
+from boto3.exceptions import S3UploadFailedError
+from boto3.s3.transfer import TransferConfig
+from botocore.exceptions import ClientError, ConnectionError as BotocoreConnectionError, HTTPClientError
 
 from deploifai.cli.api import DeploifaiAPI
-from deploifai.cli.clouds.utilities.data_storage.handler import DataStorageHandler
+from deploifai.cli.clouds.utilities.data_storage.handler import DataStorageHandler, DataStorageHandlerDeleteException
+from deploifai.cli.clouds.utilities.data_storage.manifest import normalise_etag
+from deploifai.cli.clouds.utilities.data_storage.remote_file import RemoteFile
+
+throttling_error_codes = ("SlowDown", "Throttling", "ThrottlingException", "RequestLimitExceeded")
+
+transient_error_codes = ("InternalError", "RequestTimeout", "ServiceUnavailable")
+
+transient_status_codes = (500, 502, 503, 504)
+
+# the error codes of a conditional write to an object that another writer has changed
+conditional_error_codes = ("PreconditionFailed", "ConditionalRequestConflict")
+
+conditional_put_handler_id = "deploifai-conditional-put"
+
+# a single CopyObject request copies objects of up to 5 GB, larger objects are copied in parts
+copy_transfer_config = TransferConfig(multipart_threshold=5 * 1024 ** 3)
+
+# downloads are streamed to the file in chunks of this size
+stream_chunk_size = 1024 * 1024
 
 
 class AWSDataStorageHandler(DataStorageHandler):
-    def __init__(self, api: DeploifaiAPI, dataset_id: str):
-        data = api.get_data_storage_info(dataset_id)
+    def __init__(self, api: typing.Optional[DeploifaiAPI], dataset_id: str, data: dict = None):
+        if data is None:
+            data = api.get_data_storage_info(dataset_id)
 
         container_cloud_name = data["containers"][0]['cloudName']
 
-        aws_config_info = data["cloudProviderYodaConfig"]["awsConfig"]
+        self.aws_config_info = data["cloudProviderYodaConfig"]["awsConfig"]
+
+        client = self.create_resource()
 
-        client = boto3.resource("s3",
-                                region_name=aws_config_info["awsRegion"],
-                                aws_access_key_id=aws_config_info["awsAccessKey"],
-                                aws_secret_access_key=aws_config_info["awsSecretAccessKey"]
-                                )
+        super().__init__(dataset_id, container_cloud_name, client, data)
 
-        super().__init__(dataset_id, container_cloud_name, client)
+    def create_resource(self):
+        # boto3 resources are not thread safe, so each one is created from its own session
+        session = boto3.session.Session(
+            region_name=self.aws_config_info["awsRegion"],
+            aws_access_key_id=self.aws_config_info["awsAccessKey"],
+            aws_secret_access_key=self.aws_config_info["awsSecretAccessKey"],
+        )
+        return session.resource("s3")
+
+    def create_container(self):
+        return self.create_resource().Bucket(self.container_cloud_name)
+
+    @staticmethod
+    def is_throttling_error(err: Exception) -> bool:
+        if isinstance(err, ClientError):
+            return (
+                err.response.get("Error", {}).get("Code") in throttling_error_codes
+                or err.response.get("ResponseMetadata", {}).get("HTTPStatusCode") == 503
+            )
+        if isinstance(err, S3UploadFailedError):
+            # the upload manager only keeps the message of the underlying error
+            return any(code in str(err) for code in throttling_error_codes)
+        return False
 
     @staticmethod
-    def upload_file(client, file_path: Path, object_key: str, container_cloud_name: str):
-        bucket = client.Bucket(container_cloud_name)
-        obj = bucket.Object(object_key)
+    def is_retryable_error(err: Exception) -> bool:
+        if isinstance(err, (BotocoreConnectionError, HTTPClientError)):
+            return True
+        if isinstance(err, ClientError):
+            return (
+                err.response.get("Error", {}).get("Code") in transient_error_codes
+                or err.response.get("ResponseMetadata", {}).get("HTTPStatusCode") in transient_status_codes
+            )
+        if isinstance(err, S3UploadFailedError):
+            return any(code in str(err) for code in transient_error_codes)
+        return DataStorageHandler.is_retryable_error(err)
+
+    def upload_file(self, file_path: Path, object_key: str, metadata: typing.Optional[dict] = None):
+        obj = self.container().Object(object_key)
 
+        # files above the multipart threshold go through upload_large_file, so a single request is enough here
         with open(str(file_path), 'rb') as data:
-            obj.upload_fileobj(data)
+            response = obj.put(Body=data, Metadata=metadata or {})
+
+        return response["ETag"]
+
+    def get_object_bytes(self, object_key: str) -> typing.Optional[bytes]:
+        try:
+            response = self.container().meta.client.get_object(Bucket=self.container_cloud_name, Key=object_key)
+        except ClientError as err:
+            if err.response.get("Error", {}).get("Code") in ("NoSuchKey", "404"):
+                return None
+            raise
+        return response["Body"].read()
+
+    def put_object_bytes(self, object_key: str, data: bytes) -> str:
+        return self.container().Object(object_key).put(Body=data)["ETag"]
+
+    def get_versioned_object_bytes(self, object_key: str) -> typing.Tuple[typing.Optional[bytes], typing.Optional[str]]:
+        try:
+            response = self.container().meta.client.get_object(Bucket=self.container_cloud_name, Key=object_key)
+        except ClientError as err:
+            if err.response.get("Error", {}).get("Code") in ("NoSuchKey", "404"):
+                return None, None
+            raise
+        return response["Body"].read(), response["ETag"]
+
+    def put_object_bytes_if_unchanged(self, object_key: str, data: bytes, version: typing.Optional[str]) -> bool:
+        client = self.container().meta.client
+        headers = {"If-Match": version} if version is not None else {"If-None-Match": "*"}
+
+        # the conditional headers are added to the request directly, because older versions of botocore have no
+        # parameters for them, and the client of each thread is only used by that thread
+        def add_conditional_headers(request, **kwargs):
+            for name, value in headers.items():
+                request.headers[name] = value
+
+        client.meta.events.register(
+            "before-sign.s3.PutObject", add_conditional_headers, unique_id=conditional_put_handler_id
+        )
+        try:
+            client.put_object(Bucket=self.container_cloud_name, Key=object_key, Body=data)
+        except ClientError as err:
+            if (
+                err.response.get("Error", {}).get("Code") in conditional_error_codes
+                or err.response.get("ResponseMetadata", {}).get("HTTPStatusCode") in (409, 412)
+            ):
+                return False
+            raise
+        finally:
+            client.meta.events.unregister("before-sign.s3.PutObject", unique_id=conditional_put_handler_id)
+        return True
+
+    def copy_object(self, source: RemoteFile, destination_key: str):
+        metadata = source.metadata
+        if metadata is None:
+            metadata = self.get_object_metadata(source.key)
+        # a copy made in parts does not keep the metadata of the source, so it is always set on the copy
+        extra_args = {"Metadata": metadata, "MetadataDirective": "REPLACE"}
+        if source.etag is not None:
+            extra_args["CopySourceIfMatch"] = '"{}"'.format(source.etag)
+        self.container().meta.client.copy(
+            {"Bucket": self.container_cloud_name, "Key": source.key},
+            self.container_cloud_name,
+            destination_key,
+            ExtraArgs=extra_args,
+            Config=copy_transfer_config,
+        )
+
+    def begin_multipart_upload(self, object_key: str, metadata: typing.Optional[dict] = None) -> str:
+        response = self.container().meta.client.create_multipart_upload(
+            Bucket=self.container_cloud_name, Key=object_key, Metadata=metadata or {}
+        )
+        return response["UploadId"]
+
+    def upload_part(self, object_key: str, upload_id: str, part_number: int, data: bytes):
+        response = self.container().meta.client.upload_part(
+            Bucket=self.container_cloud_name,
+            Key=object_key,
+            UploadId=upload_id,
+            PartNumber=part_number,
+            Body=data,
+        )
+        return {"ETag": response["ETag"], "PartNumber": part_number}
+
+    def complete_multipart_upload(
+        self, object_key: str, upload_id: str, parts: list, metadata: typing.Optional[dict] = None
+    ) -> str:
+        response = self.container().meta.client.complete_multipart_upload(
+            Bucket=self.container_cloud_name,
+            Key=object_key,
+            UploadId=upload_id,
+            MultipartUpload={"Parts": parts},
+        )
+        return response["ETag"]
+
+    def abort_multipart_upload(self, object_key: str, upload_id: str):
+        self.container().meta.client.abort_multipart_upload(
+            Bucket=self.container_cloud_name, Key=object_key, UploadId=upload_id
+        )
+
+    def delete_objects(self, object_keys: typing.List[str]):
+        response = self.container().meta.client.delete_objects(
+            Bucket=self.container_cloud_name,
+            Delete={"Objects": [{"Key": object_key} for object_key in object_keys], "Quiet": True},
+        )
+        # in quiet mode, only the objects that could not be deleted are reported
+        errors = response.get("Errors", [])
+        if len(errors) > 0:
+            raise DataStorageHandlerDeleteException([error["Key"] for error in errors])
 
     def list_files(self, prefix: str = None) -> typing.Generator:
         if prefix is None:
-            return self.client.Bucket(self.container_cloud_name).objects.all()
-        return self.client.Bucket(self.container_cloud_name).objects.filter(Prefix=prefix)
+            return self.container().objects.all()
+        return self.container().objects.filter(Prefix=prefix)
+
+    def list_directory(self, prefix: str) -> typing.Generator:
+        paginator = self.container().meta.client.get_paginator("list_objects_v2")
+        for page in paginator.paginate(Bucket=self.container_cloud_name, Prefix=prefix, Delimiter="/"):
+            yield (
+                [self.make_remote_file(obj["Key"], obj["Size"], obj["ETag"]) for obj in page.get("Contents", [])],
+                [common_prefix["Prefix"] for common_prefix in page.get("CommonPrefixes", [])],
+            )
 
     @staticmethod
-    def download_file(
-            client, file, dataset_directory: Path, container_cloud_name: str
-    ):
-        # getting the name(key) for each file and creating the folders as required
-        key = file.key
+    def describe_file(file) -> RemoteFile:
+        return AWSDataStorageHandler.make_remote_file(file.key, file.size, file.e_tag)
 
-        if '/' in key:
-            DataStorageHandler.make_dirs(key, dataset_directory)
+    @staticmethod
+    def make_remote_file(object_key: str, size: int, etag: typing.Optional[str]) -> RemoteFile:
+        etag = normalise_etag(etag)
+        # the ETag of an object uploaded in one part is the md5 of its content, multipart ETags contain a "-"
+        md5 = etag if etag is not None and "-" not in etag else None
+        return RemoteFile(object_key, size, md5, etag)
+
+    def download_range(self, object_key: str, start: int, length: int) -> bytes:
+        response = self.container().meta.client.get_object(
+            Bucket=self.container_cloud_name,
+            Key=object_key,
+            Range="bytes={}-{}".format(start, start + length - 1),
+        )
+        return response["Body"].read()
 
-        file_path = str(dataset_directory.joinpath(key))
-        bucket = client.Bucket(container_cloud_name)
-        obj = bucket.Object(key)
+    def download_file(self, remote_file: RemoteFile) -> typing.Optional[dict]:
+        file_path = str(self.dataset_directory.joinpath(remote_file.key))
 
+        # files above the multipart threshold go through download_large_file, so a single request is enough here,
+        # and its response has the metadata that listings leave out
+        response = self.container().meta.client.get_object(
+            Bucket=self.container_cloud_name, Key=remote_file.content_key
+        )
         with open(file_path, 'wb') as file:
-            obj.download_fileobj(file)
+            shutil.copyfileobj(response["Body"], file, stream_chunk_size)
+        return response.get("Metadata", {})
+
+    def get_object_metadata(self, object_key: str) -> dict:
+        response = self.container().meta.client.head_object(Bucket=self.container_cloud_name, Key=object_key)
+        return response.get("Metadata", {})
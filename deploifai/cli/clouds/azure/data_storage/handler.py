@@ -1,55 +1,205 @@
+import base64
+import time
 import typing
+import uuid
 from pathlib import Path
 
-from azure.storage.blob import ContainerClient, BlobServiceClient, BlobProperties
+from azure.core import MatchConditions
+from azure.core.exceptions import (
+    HttpResponseError,
+    ResourceExistsError,
+    ResourceModifiedError,
+    ResourceNotFoundError,
+    ServiceRequestError,
+    ServiceResponseError,
+)
+from azure.storage.blob import ContainerClient, BlobServiceClient, BlobPrefix, BlobProperties, BlobBlock
 
 from deploifai.cli.api import DeploifaiAPI
-from deploifai.cli.clouds.utilities.data_storage.handler import DataStorageHandler
+from deploifai.cli.clouds.utilities.data_storage.handler import DataStorageHandler, DataStorageHandlerDeleteException
+from deploifai.cli.clouds.utilities.data_storage.manifest import normalise_etag
+from deploifai.cli.clouds.utilities.data_storage.remote_file import RemoteFile, base64_md5_to_hex
+
+# uploads are streamed from the file in blocks of this size, so each upload holds at most one block in memory
+stream_block_size = 4 * 1024 * 1024
+
+# the interval in seconds at which a copy that Azure runs in the background is checked on
+copy_poll_interval = 0.5
 
 
 class AzureDataStorageHandler(DataStorageHandler):
-    def __init__(self, api: DeploifaiAPI, dataset_id: str):
-        data = api.get_data_storage_info(dataset_id)
+    # the maximum number of blocks in a block blob
+    max_part_count = 50000
+    # the maximum number of subrequests in a blob batch request
+    max_delete_batch_size = 256
+
+    def __init__(self, api: typing.Optional[DeploifaiAPI], dataset_id: str, data: dict = None):
+        if data is None:
+            data = api.get_data_storage_info(dataset_id)
 
         self.storage_account_name = data["cloudProviderYodaConfig"]["azureConfig"]["storageAccount"]
         self.storage_access_key = data["cloudProviderYodaConfig"]["azureConfig"]['storageAccessKey']
         container_cloud_name = data["containers"][0]['cloudName']
 
+        client = self.create_container_client(container_cloud_name)
+
+        super().__init__(dataset_id, container_cloud_name, client, data)
+
+    def create_container_client(self, container_cloud_name: str) -> ContainerClient:
         account_url = "{account_name}.blob.core.windows.net".format(
             account_name=self.storage_account_name
         )
         blob_service_client = BlobServiceClient(
             account_url=account_url,
             credential=self.storage_access_key,
+            max_single_put_size=stream_block_size,
+            max_block_size=stream_block_size,
         )
-        client = blob_service_client.get_container_client(container_cloud_name)
+        return blob_service_client.get_container_client(container_cloud_name)
 
-        super().__init__(dataset_id, container_cloud_name, client)
+    def create_container(self):
+        # each client has its own connection pool, so threads do not wait for connections held by other threads
+        return self.create_container_client(self.container_cloud_name)
 
     @staticmethod
-    def upload_file(
-            client: ContainerClient, file_path: Path, object_key: str, container_cloud_name: str
-    ):
-        blob_client = client.get_blob_client(object_key)
-        blob_bytes = file_path.read_bytes()
-        blob_client.upload_blob(
-            data=blob_bytes, length=file_path.stat().st_size, overwrite=True
-        )
+    def is_throttling_error(err: Exception) -> bool:
+        # Azure storage reports throttling as 503 Server Busy, or 500 Operation Timeout
+        return isinstance(err, HttpResponseError) and err.status_code in (500, 503)
+
+    @staticmethod
+    def is_retryable_error(err: Exception) -> bool:
+        if isinstance(err, (ServiceRequestError, ServiceResponseError)):
+            return True
+        if isinstance(err, HttpResponseError):
+            return err.status_code in (408, 500, 502, 503, 504)
+        return DataStorageHandler.is_retryable_error(err)
+
+    def upload_file(self, file_path: Path, object_key: str, metadata: typing.Optional[dict] = None):
+        blob_client = self.container().get_blob_client(object_key)
+        with open(str(file_path), "rb") as data:
+            # one connection per file, the files themselves are already uploaded concurrently
+            response = blob_client.upload_blob(
+                data=data, length=file_path.stat().st_size, overwrite=True, max_concurrency=1, metadata=metadata
+            )
+        return response["etag"]
+
+    def get_object_bytes(self, object_key: str) -> typing.Optional[bytes]:
+        try:
+            return self.container().get_blob_client(object_key).download_blob().readall()
+        except ResourceNotFoundError:
+            return None
+
+    def put_object_bytes(self, object_key: str, data: bytes) -> str:
+        response = self.container().get_blob_client(object_key).upload_blob(data, overwrite=True)
+        return response["etag"]
+
+    def get_versioned_object_bytes(self, object_key: str) -> typing.Tuple[typing.Optional[bytes], typing.Optional[str]]:
+        try:
+            downloader = self.container().get_blob_client(object_key).download_blob()
+        except ResourceNotFoundError:
+            return None, None
+        return downloader.readall(), downloader.properties.etag
+
+    def put_object_bytes_if_unchanged(self, object_key: str, data: bytes, version: typing.Optional[str]) -> bool:
+        blob_client = self.container().get_blob_client(object_key)
+        try:
+            if version is None:
+                # fails if the blob exists
+                blob_client.upload_blob(data, overwrite=False)
+            else:
+                blob_client.upload_blob(
+                    data, overwrite=True, etag=version, match_condition=MatchConditions.IfNotModified
+                )
+        except (ResourceExistsError, ResourceModifiedError):
+            return False
+        return True
+
+    def copy_object(self, source: RemoteFile, destination_key: str):
+        source_client = self.container().get_blob_client(source.key)
+        destination = self.container().get_blob_client(destination_key)
+        kwargs = {}
+        if source.etag is not None:
+            kwargs = {
+                "source_etag": '"{}"'.format(source.etag),
+                "source_match_condition": MatchConditions.IfNotModified,
+            }
+        # a copy within the storage account is authorised by the account key, and may finish in the background
+        status = destination.start_copy_from_url(source_client.url, **kwargs)["copy_status"]
+        while status == "pending":
+            time.sleep(copy_poll_interval)
+            status = destination.get_blob_properties().copy.status
+        if status != "success":
+            raise HttpResponseError(message="Copy of {} to {} {}".format(source.key, destination_key, status))
+
+    @staticmethod
+    def make_block_id(upload_id: str, part_number: int) -> str:
+        # block ids of a blob must all have the same length, and be base64 encoded
+        return base64.b64encode("{}-{:06d}".format(upload_id, part_number).encode()).decode()
+
+    def begin_multipart_upload(self, object_key: str, metadata: typing.Optional[dict] = None) -> str:
+        # blocks are staged on the blob itself, so the id only needs to keep the block ids of this upload apart
+        return uuid.uuid4().hex
+
+    def upload_part(self, object_key: str, upload_id: str, part_number: int, data: bytes):
+        block_id = self.make_block_id(upload_id, part_number)
+        self.container().get_blob_client(object_key).stage_block(block_id=block_id, data=data, length=len(data))
+        return block_id
+
+    def complete_multipart_upload(
+        self, object_key: str, upload_id: str, parts: list, metadata: typing.Optional[dict] = None
+    ) -> str:
+        blocks = [BlobBlock(block_id=block_id) for block_id in parts]
+        response = self.container().get_blob_client(object_key).commit_block_list(blocks, metadata=metadata)
+        return response["etag"]
+
+    def abort_multipart_upload(self, object_key: str, upload_id: str):
+        # uncommitted blocks are discarded by Azure after a week
+        pass
+
+    def delete_objects(self, object_keys: typing.List[str]):
+        responses = self.container().delete_blobs(*object_keys, raise_on_any_failure=False)
+        # 202 when the blob is deleted, 404 when it did not exist
+        failed = [
+            object_key for object_key, response in zip(object_keys, responses)
+            if response.status_code not in (202, 404)
+        ]
+        if len(failed) > 0:
+            raise DataStorageHandlerDeleteException(failed)
 
     def list_files(self, prefix: str = None) -> typing.Generator:
+        # the metadata tells which blobs are compressed
         if prefix is None:
-            return self.client.list_blobs()
-        return self.client.list_blobs(name_starts_with=prefix)
+            return self.container().list_blobs(include=["metadata"])
+        return self.container().list_blobs(name_starts_with=prefix, include=["metadata"])
+
+    def list_directory(self, prefix: str) -> typing.Generator:
+        items = self.container().walk_blobs(name_starts_with=prefix or None, include=["metadata"], delimiter="/")
+        for page in items.by_page():
+            files = []
+            subprefixes = []
+            for item in page:
+                if isinstance(item, BlobPrefix):
+                    subprefixes.append(item.name)
+                else:
+                    files.append(self.describe_file(item))
+            yield files, subprefixes
 
     @staticmethod
-    def download_file(
-            client: ContainerClient, file: BlobProperties, dataset_directory: Path, container_cloud_name: str
-    ):
-        file_name = file.name
-        blob_client = client.get_blob_client(file_name)
-        if "/" in file_name:
-            DataStorageHandler.make_dirs(file_name, dataset_directory)
-
-        download_file_path = dataset_directory.joinpath(file_name)
+    def describe_file(file: BlobProperties) -> RemoteFile:
+        md5 = base64_md5_to_hex(file.content_settings.content_md5)
+        return RemoteFile(file.name, file.size, md5, normalise_etag(file.etag), file.metadata or {})
+
+    def download_range(self, object_key: str, start: int, length: int) -> bytes:
+        return self.container().get_blob_client(object_key).download_blob(offset=start, length=length).readall()
+
+    def download_file(self, remote_file: RemoteFile) -> typing.Optional[dict]:
+        blob_client = self.container().get_blob_client(remote_file.content_key)
+
+        download_file_path = self.dataset_directory.joinpath(remote_file.key)
         with open(download_file_path, "wb") as download_file:
-            blob_client.download_blob().readinto(download_file)
+            downloader = blob_client.download_blob()
+            downloader.readinto(download_file)
+        return downloader.properties.metadata
+
+    def get_object_metadata(self, object_key: str) -> dict:
+        return self.container().get_blob_client(object_key).get_blob_properties().metadata or {}
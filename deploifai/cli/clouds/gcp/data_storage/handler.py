@@ -1,17 +1,43 @@
 import json
 import typing
+import uuid
 from pathlib import Path
 
+import requests
+from google.api_core.exceptions import (
+    BadGateway,
+    GatewayTimeout,
+    GoogleAPICallError,
+    InternalServerError,
+    NotFound,
+    PreconditionFailed,
+    ServiceUnavailable,
+    TooManyRequests,
+)
+from google.auth.exceptions import TransportError
 from google.cloud import storage
 from google.oauth2.service_account import Credentials
 
 from deploifai.cli.api import DeploifaiAPI
-from deploifai.cli.clouds.utilities.data_storage.handler import DataStorageHandler
+from deploifai.cli.clouds.utilities.data_storage.handler import DataStorageHandler, DataStorageHandlerDeleteException
+from deploifai.cli.clouds.utilities.data_storage.manifest import normalise_etag
+from deploifai.cli.clouds.utilities.data_storage.remote_file import RemoteFile, base64_md5_to_hex, internal_key_prefix
+
+# the maximum number of objects that can be composed into one in a single request
+max_compose_sources = 32
+
+# the maximum number of calls in a batch request
+max_batch_size = 100
 
 
 class GCPDataStorageHandler(DataStorageHandler):
-    def __init__(self, api: DeploifaiAPI, dataset_id: str):
-        data = api.get_data_storage_info(dataset_id)
+    # parts are composed in a tree of compose requests, two levels of which are enough for 1024 parts
+    max_part_count = max_compose_sources * max_compose_sources
+    max_delete_batch_size = max_batch_size
+
+    def __init__(self, api: typing.Optional[DeploifaiAPI], dataset_id: str, data: dict = None):
+        if data is None:
+            data = api.get_data_storage_info(dataset_id)
 
         container_cloud_name = data["containers"][0]['cloudName']
 
@@ -19,35 +45,187 @@ class GCPDataStorageHandler(DataStorageHandler):
 
         service_account_key_json = json.loads(gcp_config_info["gcpServiceAccountKey"])
 
-        credentials = Credentials.from_service_account_info(service_account_key_json)
+        self.credentials = Credentials.from_service_account_info(service_account_key_json)
 
-        client = storage.Client(credentials=credentials)
+        client = storage.Client(credentials=self.credentials)
 
-        super().__init__(dataset_id, container_cloud_name, client)
+        super().__init__(dataset_id, container_cloud_name, client, data)
+
+    def create_container(self):
+        # the requests session of a client is not thread safe, and getting a bucket by name does not send a request
+        return storage.Client(credentials=self.credentials).bucket(self.container_cloud_name)
 
     @staticmethod
-    def upload_file(client, file_path: Path, object_key: str, container_cloud_name: str):
-        bucket_client = client.get_bucket(container_cloud_name)
-        blob_client = bucket_client.blob(object_key)
+    def is_throttling_error(err: Exception) -> bool:
+        return isinstance(err, (TooManyRequests, ServiceUnavailable))
+
+    @staticmethod
+    def is_retryable_error(err: Exception) -> bool:
+        if isinstance(err, (InternalServerError, BadGateway, ServiceUnavailable, GatewayTimeout, TransportError)):
+            return True
+        # the storage client makes its requests with the requests library
+        if isinstance(err, (requests.ConnectionError, requests.Timeout)):
+            return True
+        return DataStorageHandler.is_retryable_error(err)
+
+    def upload_file(self, file_path: Path, object_key: str, metadata: typing.Optional[dict] = None):
+        blob_client = self.container().blob(object_key)
+        blob_client.metadata = metadata
         blob_client.upload_from_filename(str(file_path))
+        return blob_client.etag
+
+    def get_object_bytes(self, object_key: str) -> typing.Optional[bytes]:
+        try:
+            return self.container().blob(object_key).download_as_bytes()
+        except NotFound:
+            return None
+
+    def put_object_bytes(self, object_key: str, data: bytes) -> str:
+        blob_client = self.container().blob(object_key)
+        blob_client.upload_from_string(data)
+        return blob_client.etag
+
+    def get_versioned_object_bytes(self, object_key: str) -> typing.Tuple[typing.Optional[bytes], typing.Optional[str]]:
+        blob = self.container().blob(object_key)
+        try:
+            data = blob.download_as_bytes()
+        except NotFound:
+            return None, None
+        # the generation of the downloaded content is read from the headers of the response
+        return data, str(blob.generation)
+
+    def put_object_bytes_if_unchanged(self, object_key: str, data: bytes, version: typing.Optional[str]) -> bool:
+        try:
+            # a generation of 0 only matches an object that does not exist
+            self.container().blob(object_key).upload_from_string(
+                data, if_generation_match=int(version) if version is not None else 0
+            )
+        except PreconditionFailed:
+            return False
+        return True
+
+    def copy_object(self, source: RemoteFile, destination_key: str):
+        bucket = self.container()
+        # Cloud Storage checks preconditions on the generation of an object, not on its ETag
+        generation = source.generation
+        if generation is None and source.etag is not None:
+            # the remote manifest keeps the ETag of an object but not its generation, which is read with the ETag
+            blob = bucket.get_blob(source.key)
+            if blob is None or normalise_etag(blob.etag) != source.etag:
+                raise PreconditionFailed("{} has changed since it was listed".format(source.key))
+            generation = blob.generation
+
+        source_blob = bucket.blob(source.key)
+        destination = bucket.blob(destination_key)
+        # a large object is rewritten in several calls, each continuing from the token of the last one
+        token, _, _ = destination.rewrite(source_blob, if_source_generation_match=generation)
+        while token is not None:
+            token, _, _ = destination.rewrite(source_blob, token=token, if_source_generation_match=generation)
+
+    def make_part_key(self, upload_id: str, part_number: int) -> str:
+        return "{}uploads/{}/{:06d}".format(internal_key_prefix, upload_id, part_number)
+
+    def begin_multipart_upload(self, object_key: str, metadata: typing.Optional[dict] = None) -> str:
+        # parallel composite upload: parts are uploaded as temporary objects and composed into the final object
+        return uuid.uuid4().hex
+
+    def upload_part(self, object_key: str, upload_id: str, part_number: int, data: bytes):
+        part_blob = self.container().blob(self.make_part_key(upload_id, part_number))
+        part_blob.upload_from_string(data)
+        return part_blob.name
+
+    def complete_multipart_upload(
+        self, object_key: str, upload_id: str, parts: list, metadata: typing.Optional[dict] = None
+    ) -> str:
+        bucket = self.container()
+        part_blobs = [bucket.blob(part_key) for part_key in parts]
+        temporary_blobs = list(part_blobs)
+
+        # compose at most 32 objects at a time, until few enough are left to compose into the final object
+        sources = part_blobs
+        level = 0
+        while len(sources) > max_compose_sources:
+            level += 1
+            composed = []
+            for i in range(0, len(sources), max_compose_sources):
+                intermediate = bucket.blob(
+                    "{}uploads/{}/compose-{}-{:06d}".format(internal_key_prefix, upload_id, level, i)
+                )
+                intermediate.compose(sources[i:i + max_compose_sources])
+                composed.append(intermediate)
+            temporary_blobs.extend(composed)
+            sources = composed
+
+        blob = bucket.blob(object_key)
+        # the properties of the destination, including its metadata, are sent with the compose request
+        blob.metadata = metadata
+        blob.compose(sources)
+
+        bucket.delete_blobs(temporary_blobs, on_error=lambda b: None)
+        return blob.etag
+
+    def abort_multipart_upload(self, object_key: str, upload_id: str):
+        bucket = self.container()
+        part_blobs = list(bucket.list_blobs(prefix="{}uploads/{}/".format(internal_key_prefix, upload_id)))
+        bucket.delete_blobs(part_blobs, on_error=lambda b: None)
+
+    def delete_objects(self, object_keys: typing.List[str]):
+        bucket = self.container()
+        try:
+            with bucket.client.batch():
+                for object_key in object_keys:
+                    bucket.delete_blob(object_key)
+            return
+        except GoogleAPICallError:
+            # the batch raises only the first error once every call has completed, so which of the other calls failed
+            # is not known, and every object is deleted again on its own
+            pass
+
+        failed = []
+        for object_key in object_keys:
+            try:
+                bucket.delete_blob(object_key)
+            except NotFound:
+                # objects that are gone already are deleted either way
+                pass
+            except GoogleAPICallError:
+                failed.append(object_key)
+        if len(failed) > 0:
+            raise DataStorageHandlerDeleteException(failed)
 
     def list_files(self, prefix: str = None) -> typing.Generator:
         if prefix is None:
-            return self.client.list_blobs(self.container_cloud_name)
-        return self.client.list_blobs(self.container_cloud_name, prefix=prefix)
+            return self.container().list_blobs()
+        return self.container().list_blobs(prefix=prefix)
+
+    def list_directory(self, prefix: str) -> typing.Generator:
+        iterator = self.container().list_blobs(prefix=prefix, delimiter="/")
+        for page in iterator.pages:
+            # the prefixes of a page are set when it is read, before its blobs are iterated
+            yield [self.describe_file(blob) for blob in page], sorted(page.prefixes)
 
     @staticmethod
-    def download_file(
-            client, file, dataset_directory: Path, container_cloud_name: str
-    ):
-        # getting the name for each file and creating the folders as required
-        name = file.name
-        if '/' in name:
-            DataStorageHandler.make_dirs(name, dataset_directory)
+    def describe_file(file) -> RemoteFile:
+        # composite objects have no md5 hash, only a crc32c checksum
+        md5 = base64_md5_to_hex(file.md5_hash)
+        return RemoteFile(
+            file.name, file.size, md5, normalise_etag(file.etag), file.metadata or {}, generation=file.generation
+        )
 
-        bucket_client = client.get_bucket(container_cloud_name)
-        blob_client = bucket_client.blob(name)
+    def download_range(self, object_key: str, start: int, length: int) -> bytes:
+        blob = self.container().blob(object_key)
+        # the end of the range is inclusive
+        return blob.download_as_bytes(start=start, end=start + length - 1)
 
-        file_path = str(dataset_directory.joinpath(name))
+    def download_file(self, remote_file: RemoteFile) -> typing.Optional[dict]:
+        blob_client = self.container().blob(remote_file.content_key)
+
+        file_path = str(self.dataset_directory.joinpath(remote_file.key))
 
         blob_client.download_to_filename(file_path)
+        # the listing includes the metadata
+        return None
+
+    def get_object_metadata(self, object_key: str) -> dict:
+        blob = self.container().get_blob(object_key)
+        return (blob.metadata if blob is not None else None) or {}
@@ -0,0 +1,102 @@
+import gzip
+import os
+import shutil
+import tempfile
+import typing
+from pathlib import Path
+
+"""
+Compresses files on push and decompresses them on pull, so that text datasets cost less bandwidth and storage.
+
+A compressed object holds the gzip stream of the file, and its metadata records the encoding, and the md5 and size of
+the original file, so that a pull can restore the file without the user doing anything. Files are compressed into a
+temporary file in chunks, and decompressed the same way, so a whole file is never held in memory.
+
+Files with the extension of an already compressed format are stored as they are, and so is any other file that does
+not get meaningfully smaller.
+"""
+
+encoding_metadata_key = "deploifai_encoding"
+
+md5_metadata_key = "deploifai_md5"
+
+size_metadata_key = "deploifai_size"
+
+gzip_encoding = "gzip"
+
+# the fastest level, which already gets most of the reduction on text
+default_compression_level = 1
+
+# a file is stored as it is, unless it compresses to at most this fraction of its size
+min_compression_ratio = 0.9
+
+chunk_size = 1024 * 1024
+
+compressed_extensions = {
+    ".7z", ".avi", ".avif", ".br", ".bz2", ".flac", ".gif", ".gz", ".h5", ".heic", ".jpeg", ".jpg", ".lz4", ".mkv",
+    ".mov", ".mp3", ".mp4", ".npz", ".ogg", ".parquet", ".png", ".rar", ".tfrecord", ".tgz", ".webm", ".webp", ".xz",
+    ".zip", ".zst",
+}
+
+
+def is_compressible(object_key: str) -> bool:
+    """
+    Check whether a file may be worth compressing, which it is not if it is already in a compressed format.
+    :param object_key: The key of the file object, which ends with the name of the file.
+    """
+    return os.path.splitext(object_key)[1].lower() not in compressed_extensions
+
+
+def compress_file(file_path: Path, level: int = default_compression_level) -> typing.Optional[Path]:
+    """
+    Write a gzip compressed copy of a file to a temporary file. The copy only depends on the content of the file, so
+    that compressing the same content always gives the same bytes.
+    :param file_path: The absolute path to the file.
+    :param level: The gzip compression level.
+    :return: The path to the temporary file, which the caller removes, or None if the file does not get smaller enough.
+    """
+    size = file_path.stat().st_size
+    fd, temp_name = tempfile.mkstemp(suffix=".gz", prefix="deploifai-")
+    temp_path = Path(temp_name)
+    try:
+        with open(fd, "wb") as out, open(str(file_path), "rb") as f:
+            # without a file name and modification time in the header, the output is deterministic
+            with gzip.GzipFile(filename="", fileobj=out, mode="wb", compresslevel=level, mtime=0) as gz:
+                shutil.copyfileobj(f, gz, chunk_size)
+    except BaseException:
+        os.remove(temp_name)
+        raise
+
+    if temp_path.stat().st_size > size * min_compression_ratio:
+        os.remove(temp_name)
+        return None
+    return temp_path
+
+
+def decompress_file(file_path: Path, temp_path: Path):
+    """
+    Replace a gzip compressed file with its decompressed content.
+    :param file_path: The absolute path to the compressed file.
+    :param temp_path: The path that the content is decompressed to before it replaces the file.
+    """
+    try:
+        with gzip.open(str(file_path), "rb") as gz, open(str(temp_path), "wb") as out:
+            shutil.copyfileobj(gz, out, chunk_size)
+    except BaseException:
+        if temp_path.exists():
+            os.remove(str(temp_path))
+        raise
+    os.replace(str(temp_path), str(file_path))
+
+
+def encoding_metadata(md5: str, size: int) -> typing.Dict[str, str]:
+    """
+    The metadata of a compressed object.
+    :param md5: The md5 hex digest of the original file.
+    :param size: The size in bytes of the original file.
+    """
+    return {encoding_metadata_key: gzip_encoding, md5_metadata_key: md5, size_metadata_key: str(size)}
+
+
+def is_compressed(metadata: typing.Optional[dict]) -> bool:
+    return metadata is not None and metadata.get(encoding_metadata_key) == gzip_encoding
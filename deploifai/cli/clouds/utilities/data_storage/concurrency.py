@@ -0,0 +1,115 @@
+import threading
+import time
+
+default_concurrency = 5
+
+default_max_concurrency = 32
+
+
+class ConcurrencyController:
+    """
+    Decides how many transfers run at the same time.
+    Worker threads acquire a slot before each transfer. When adaptive, the number of slots is tuned by hill climbing:
+    it is raised while throughput keeps improving, lowered again when an increase made throughput worse, and halved
+    when the cloud provider throttles requests.
+    """
+
+    def __init__(
+        self,
+        initial: int = default_concurrency,
+        maximum: int = default_max_concurrency,
+        adaptive: bool = True,
+        interval: float = 2.0,
+    ):
+        """
+        :param initial: The number of concurrent transfers to start with.
+        :param maximum: The upper limit of concurrent transfers.
+        :param adaptive: Whether to tune the number of concurrent transfers, or keep it at the initial level.
+        :param interval: The number of seconds over which throughput is measured between adjustments.
+        """
+        self.maximum = max(1, maximum)
+        self.level = max(1, min(initial, self.maximum))
+        self.peak = self.level
+        self.adaptive = adaptive
+        self.interval = interval
+
+        self._condition = threading.Condition()
+        self._active = 0
+
+        self._window_start = time.monotonic()
+        self._window_bytes = 0
+        self._window_throttled = False
+        self._last_throughput = None
+        self._last_change = 0
+
+    def acquire(self, timeout: float = None) -> bool:
+        """
+        Wait for a free transfer slot.
+        :param timeout: The maximum number of seconds to wait.
+        :return: True if a slot was acquired.
+        """
+        with self._condition:
+            acquired = self._condition.wait_for(lambda: self._active < self.level, timeout=timeout)
+            if acquired:
+                self._active += 1
+            return acquired
+
+    def release(self):
+        with self._condition:
+            self._active -= 1
+            self._condition.notify()
+
+    def record_transfer(self, size: int):
+        """
+        Record the number of bytes moved by a finished transfer.
+        """
+        with self._condition:
+            self._window_bytes += size
+            self._adjust()
+
+    def record_throttle(self):
+        """
+        Record that the cloud provider throttled a request.
+        """
+        with self._condition:
+            self._window_throttled = True
+            self._adjust()
+
+    def _adjust(self):
+        if not self.adaptive:
+            return
+
+        now = time.monotonic()
+        elapsed = now - self._window_start
+
+        if self._window_throttled:
+            # back off immediately, and forget the throughput measured at the higher level
+            self._set_level(self.level // 2)
+            self._last_change = 0
+            self._last_throughput = None
+        elif elapsed >= self.interval:
+            throughput = self._window_bytes / elapsed
+
+            if self._last_throughput is None or throughput > self._last_throughput * 1.05:
+                # still improving, keep climbing
+                self._last_throughput = throughput
+                self._set_level(self.level + max(1, self.level // 4))
+            elif self._last_change > 0 and throughput < self._last_throughput * 0.95:
+                # the last increase made things worse, step back down and keep the better measurement to beat
+                self._set_level(self.level - self._last_change)
+            else:
+                self._last_throughput = throughput
+                self._last_change = 0
+        else:
+            return
+
+        self._window_start = now
+        self._window_bytes = 0
+        self._window_throttled = False
+
+    def _set_level(self, level: int):
+        level = max(1, min(level, self.maximum))
+        self._last_change = level - self.level
+        self.level = level
+        self.peak = max(self.peak, level)
+        self._condition.notify_all()
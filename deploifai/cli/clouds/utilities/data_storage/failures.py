@@ -0,0 +1,68 @@
+import json
+import os
+import typing
+from pathlib import Path
+
+from deploifai.cli.clouds.utilities.data_storage.sharding import Shard, state_filename
+
+"""
+Manages a dataset.push.failures or dataset.pull.failures file, stored next to dataset.cfg, that lists the files that
+failed to transfer in a run with --continue-on-error, so that a follow-up run can retry them alone.
+
+failures structure:
+{
+    "version": 1,
+    "failures": {
+        object_key: error message
+    }
+}
+"""
+
+failures_filenames = {
+    "push": "dataset.push.failures",
+    "pull": "dataset.pull.failures",
+}
+
+failures_version = 1
+
+
+def load_failures(
+    dataset_directory: Path, direction: str, shard: typing.Optional[Shard] = None
+) -> typing.Dict[str, str]:
+    """
+    Read the files that failed to transfer in the last push or pull.
+    :param dataset_directory: The absolute directory path of the local dataset.
+    :param direction: Either "push" or "pull".
+    :param shard: The Shard that is transferred, which has failures of its own, or None for the whole dataset.
+    :return: The error messages by object key.
+    """
+    try:
+        with dataset_directory.joinpath(state_filename(failures_filenames[direction], shard)).open("r") as f:
+            data = json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+    if data.get("version") != failures_version:
+        return {}
+    return data.get("failures", {})
+
+
+def save_failures(
+    dataset_directory: Path, direction: str, failures: typing.Dict[str, str], shard: typing.Optional[Shard] = None
+):
+    """
+    Write the files that failed to transfer, or remove the file when none did.
+    :param dataset_directory: The absolute directory path of the local dataset.
+    :param direction: Either "push" or "pull".
+    :param failures: The error messages by object key.
+    :param shard: The Shard that is transferred, which has failures of its own, or None for the whole dataset.
+    """
+    failures_path = dataset_directory.joinpath(state_filename(failures_filenames[direction], shard))
+
+    if len(failures) == 0:
+        if failures_path.exists():
+            os.remove(str(failures_path))
+        return
+
+    with failures_path.open("w") as f:
+        json.dump({"version": failures_version, "failures": failures}, f, indent=2, sort_keys=True)
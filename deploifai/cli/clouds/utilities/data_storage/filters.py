@@ -0,0 +1,244 @@
+import hashlib
+import re
+import threading
+import typing
+from pathlib import Path
+
+"""
+Reads the include and exclude rules of a dataset from a .deploifaiignore file in the dataset directory, and from the
+command line.
+
+Patterns follow .gitignore: one pattern per line, blank lines and lines starting with # are skipped, a pattern ending
+with / only matches directories, a pattern with a / anywhere else is relative to the dataset directory, other patterns
+match a name at any depth, * and ? do not match /, ** matches any number of directories, and a pattern starting with !
+includes again what an earlier pattern excluded. Files in an excluded directory cannot be included again.
+"""
+
+ignore_filename = ".deploifaiignore"
+
+# excluded unless a rule includes them again
+default_exclude_patterns = ["__pycache__/", ".ipynb_checkpoints/", "*.tmp"]
+
+glob_characters = "*?["
+
+
+class PathRule:
+    """
+    One compiled .gitignore style pattern.
+    """
+
+    def __init__(self, pattern: str):
+        self.negated = pattern.startswith("!")
+        if self.negated:
+            pattern = pattern[1:]
+        elif pattern.startswith("\\!") or pattern.startswith("\\#"):
+            pattern = pattern[1:]
+
+        self.directory_only = pattern.endswith("/")
+        pattern = pattern.rstrip("/")
+
+        self.anchored = "/" in pattern
+        pattern = pattern.lstrip("/")
+
+        body = translate_pattern(pattern)
+        if self.anchored:
+            self.regex = re.compile("^" + body + "$")
+        else:
+            self.regex = re.compile("^(?:.*/)?" + body + "$")
+
+        # the part of an anchored pattern before its first wildcard, which every path it matches starts with
+        self.literal_prefix = None
+        if self.anchored:
+            end = min([pattern.index(c) for c in glob_characters if c in pattern] + [len(pattern)])
+            self.literal_prefix = pattern[:end]
+
+    def matches(self, path: str, is_directory: bool) -> bool:
+        if self.directory_only and not is_directory:
+            return False
+        return self.regex.match(path) is not None
+
+
+def translate_pattern(pattern: str) -> str:
+    """
+    Translate a .gitignore style glob into a regular expression.
+    """
+    i = 0
+    regex = ""
+    while i < len(pattern):
+        if pattern.startswith("**/", i):
+            regex += "(?:.*/)?"
+            i += 3
+        elif pattern.startswith("**", i):
+            regex += ".*"
+            i += 2
+        elif pattern[i] == "*":
+            regex += "[^/]*"
+            i += 1
+        elif pattern[i] == "?":
+            regex += "[^/]"
+            i += 1
+        elif pattern[i] == "[" and "]" in pattern[i + 2:]:
+            end = pattern.index("]", i + 2)
+            content = pattern[i + 1:end]
+            if content.startswith("!"):
+                content = "^" + content[1:]
+            regex += "[" + content.replace("\\", "\\\\") + "]"
+            i = end + 1
+        elif pattern[i] == "\\" and i + 1 < len(pattern):
+            regex += re.escape(pattern[i + 1])
+            i += 2
+        else:
+            regex += re.escape(pattern[i])
+            i += 1
+    return regex
+
+
+def parse_patterns(lines: typing.Iterable[str]) -> typing.List[str]:
+    patterns = []
+    for line in lines:
+        line = line.rstrip("\n").rstrip()
+        if len(line) == 0 or line.startswith("#"):
+            continue
+        patterns.append(line)
+    return patterns
+
+
+class PathFilter:
+    """
+    Decides which files of a dataset are pushed or pulled, by their object key.
+    A file is transferred if it is not excluded, and, when include patterns are given, it matches one of them.
+    """
+
+    def __init__(self, exclude: typing.Iterable[str] = (), include: typing.Iterable[str] = ()):
+        """
+        :param exclude: The exclude rules, in order, later rules taking precedence. Rules starting with ! include again.
+        :param include: The patterns of the only files to transfer, or none to transfer every file that is not excluded.
+        """
+        self.exclude_patterns = list(exclude)
+        self.include_patterns = list(include)
+        self.exclude_rules = [PathRule(p) for p in self.exclude_patterns]
+        self.include_rules = [PathRule(p) for p in self.include_patterns]
+        # whether each directory is excluded, which every file in the directory looks up
+        self._excluded_directories = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def load(
+        cls, dataset_directory: Path, exclude: typing.Iterable[str] = (), include: typing.Iterable[str] = ()
+    ) -> "PathFilter":
+        """
+        Read the .deploifaiignore file of a dataset directory, and add the rules given on the command line.
+        :param dataset_directory: The absolute directory path of the local dataset.
+        :param exclude: The exclude rules from the command line, which take precedence over the file.
+        :param include: The include patterns from the command line.
+        """
+        try:
+            with dataset_directory.joinpath(ignore_filename).open("r") as f:
+                file_patterns = parse_patterns(f)
+        except FileNotFoundError:
+            file_patterns = []
+
+        return cls(exclude=default_exclude_patterns + file_patterns + list(exclude), include=include)
+
+    @property
+    def fingerprint(self) -> str:
+        """
+        A digest of the rules, which changes whenever a different set of files may be selected.
+        """
+        rules = "\n".join(self.exclude_patterns) + "\n\n" + "\n".join(self.include_patterns)
+        return hashlib.md5(rules.encode()).hexdigest()
+
+    def is_excluded(self, path: str, is_directory: bool) -> bool:
+        """
+        Check whether a path is excluded by the exclude rules, either itself or through one of its parent directories.
+        :param path: The path relative to the dataset directory, with / separators.
+        :param is_directory: Whether the path is a directory.
+        """
+        parent, _, _ = path.rpartition("/")
+        if parent != "" and self.is_excluded_directory(parent):
+            return True
+        return self._match_exclude_rules(path, is_directory)
+
+    def is_excluded_directory(self, path: str) -> bool:
+        with self._lock:
+            excluded = self._excluded_directories.get(path)
+        if excluded is None:
+            excluded = self.is_excluded(path, True)
+            with self._lock:
+                self._excluded_directories[path] = excluded
+        return excluded
+
+    def _match_exclude_rules(self, path: str, is_directory: bool) -> bool:
+        excluded = False
+        for rule in self.exclude_rules:
+            if rule.negated == excluded and rule.matches(path, is_directory):
+                excluded = not rule.negated
+        return excluded
+
+    def is_included(self, path: str) -> bool:
+        """
+        Check whether a file matches the include patterns, either itself or through one of its parent directories.
+        """
+        if len(self.include_rules) == 0:
+            return True
+
+        parts = path.split("/")
+        for i in range(1, len(parts) + 1):
+            is_directory = i < len(parts)
+            ancestor = "/".join(parts[:i])
+            if any(rule.matches(ancestor, is_directory) for rule in self.include_rules if not rule.negated):
+                return True
+        return False
+
+    def matches(self, object_key: str) -> bool:
+        """
+        Check whether a file is transferred.
+        :param object_key: The key of the file object, which is its path relative to the dataset directory.
+        """
+        return not self.is_excluded(object_key, False) and self.is_included(object_key)
+
+    def may_contain_matches(self, path: str) -> bool:
+        """
+        Check whether a directory can contain files that are transferred, so that the walk can skip it otherwise.
+        :param path: The path of the directory relative to the dataset directory, with / separators.
+        """
+        if self.is_excluded_directory(path):
+            return False
+        if len(self.include_rules) == 0:
+            return True
+
+        directory_prefix = path + "/"
+        for rule in self.include_rules:
+            if rule.literal_prefix is None:
+                return True
+            if rule.literal_prefix.startswith(directory_prefix) or directory_prefix.startswith(rule.literal_prefix):
+                return True
+            if rule.matches(path, True):
+                return True
+        return False
+
+    def list_prefixes(self, prefix: typing.Optional[str]) -> typing.List[typing.Optional[str]]:
+        """
+        Narrow down the prefix to list in the cloud container to the literal prefixes of the include patterns, so that
+        objects that are not included are never listed.
+        :param prefix: The prefix of the target, or None for the whole dataset.
+        :return: The prefixes to list, which do not overlap, or [None] to list the whole container.
+        """
+        if len(self.include_rules) == 0 or any(
+            rule.literal_prefix is None or len(rule.literal_prefix) == 0 for rule in self.include_rules
+        ):
+            return [prefix]
+
+        prefixes = set()
+        for rule in self.include_rules:
+            # a literal prefix is only under the target at a / after it, since a/bc/ is not in the directory a/b
+            if prefix is None or rule.literal_prefix.startswith(prefix + "/"):
+                prefixes.add(rule.literal_prefix)
+            # the literal prefix may end part way through a name, so a/b* also includes files in the target a/bc
+            elif prefix.startswith(rule.literal_prefix):
+                prefixes.add(prefix)
+
+        # a prefix that starts with another one is already listed by it
+        return sorted(
+            p for p in prefixes if not any(p != other and p.startswith(other) for other in prefixes)
+        )
@@ -1,11 +1,67 @@
 import abc
+import collections
+import gzip
+import hashlib
+import itertools
+import json
+import math
 import os
+import random
+import threading
+import time
 import typing
+from concurrent.futures import ThreadPoolExecutor, wait
 from pathlib import Path
 from tqdm import tqdm
-from concurrent.futures import ThreadPoolExecutor, as_completed
 
-from deploifai.cli.utilities.config.dataset_config import find_config_directory
+from deploifai.cli.clouds.utilities.data_storage.compression import (
+    compress_file,
+    decompress_file,
+    encoding_metadata,
+    is_compressed,
+    is_compressible,
+    md5_metadata_key,
+    size_metadata_key,
+)
+from deploifai.cli.clouds.utilities.data_storage.concurrency import ConcurrencyController
+from deploifai.cli.clouds.utilities.data_storage.failures import failures_filenames, load_failures, save_failures
+from deploifai.cli.clouds.utilities.data_storage.filters import PathFilter
+from deploifai.cli.clouds.utilities.data_storage.hash_cache import HashCache
+from deploifai.cli.clouds.utilities.data_storage.journal import (
+    TransferJournal,
+    journal_filenames,
+    partial_download_suffix,
+)
+from deploifai.cli.clouds.utilities.data_storage.listing import PrefixPartitionedListing
+from deploifai.cli.clouds.utilities.data_storage.manifest import SyncManifest, normalise_etag
+from deploifai.cli.clouds.utilities.data_storage.options import TransferOptions
+from deploifai.cli.clouds.utilities.data_storage.packing import (
+    PackIndex,
+    PackWriter,
+    PackedRange,
+    coalesce_ranges,
+    index_key,
+    pack_prefix,
+    split_packed_ranges,
+)
+from deploifai.cli.clouds.utilities.data_storage.pipeline import TransferScheduler
+from deploifai.cli.clouds.utilities.data_storage.process_pool import ProcessTransferPool
+from deploifai.cli.clouds.utilities.data_storage.remote_file import RemoteFile, internal_key_prefix, is_under_prefix
+from deploifai.cli.clouds.utilities.data_storage.remote_manifest import RemoteManifest, remote_manifest_key
+from deploifai.cli.clouds.utilities.data_storage.sharding import unshard_filename
+from deploifai.cli.clouds.utilities.data_storage.snapshots import (
+    Snapshot,
+    content_prefix,
+    info_key,
+    is_info_key,
+    make_content_key,
+    make_shard_content_key,
+    manifest_key,
+    snapshot_prefix,
+)
+from deploifai.cli.clouds.utilities.data_storage.state_db import SyncStateDatabase, state_db_filename
+from deploifai.cli.clouds.utilities.data_storage.walker import DirectoryWalker
+from deploifai.cli.utilities.config.dataset_config import find_config_directory, relative_config_filepath
 
 
 class DataStorageHandlerException(Exception):
@@ -22,95 +78,1327 @@ class DataStorageHandlerTargetNotFoundException(DataStorageHandlerException):
         return "DataStorageHandlerTargetNotFoundException: Target not found"
 
 
+class DataStorageHandlerCorruptedFileException(DataStorageHandlerException):
+    def __init__(self, object_key: str):
+        self.object_key = object_key
+
+    def __str__(self):
+        return "DataStorageHandlerCorruptedFileException: Content of {} does not match its hash".format(
+            self.object_key
+        )
+
+
+class DataStorageHandlerDeleteException(DataStorageHandlerException):
+    def __init__(self, object_keys: typing.List[str]):
+        self.object_keys = object_keys
+
+    def __str__(self):
+        return "DataStorageHandlerDeleteException: Failed to delete {} objects, such as {}".format(
+            len(self.object_keys), self.object_keys[0]
+        )
+
+
+class DataStorageHandlerShardUploadException(DataStorageHandlerException):
+    def __init__(self, shard_key: str, member_count: int, err: Exception):
+        self.shard_key = shard_key
+        self.member_count = member_count
+        self.err = err
+
+    def __str__(self):
+        return "DataStorageHandlerShardUploadException: Failed to upload {} packed files in {}: {}: {}".format(
+            self.member_count, self.shard_key, type(self.err).__name__, self.err
+        )
+
+
+class DataStorageHandlerSnapshotNotFoundException(DataStorageHandlerException):
+    def __init__(self, snapshot_ref: str):
+        self.snapshot_ref = snapshot_ref
+
+    def __str__(self):
+        return "DataStorageHandlerSnapshotNotFoundException: No snapshot matches {}".format(self.snapshot_ref)
+
+
+class DataStorageHandlerAmbiguousSnapshotException(DataStorageHandlerException):
+    def __init__(self, snapshot_ref: str, snapshot_ids: typing.List[str]):
+        self.snapshot_ref = snapshot_ref
+        self.snapshot_ids = snapshot_ids
+
+    def __str__(self):
+        return "DataStorageHandlerAmbiguousSnapshotException: {} matches {} snapshots, such as {}".format(
+            self.snapshot_ref, len(self.snapshot_ids), ", ".join(self.snapshot_ids[:2])
+        )
+
+
+class TransferSummary:
+    """
+    Counts of what a push or pull did, reported to the user at the end of the run.
+    """
+
+    def __init__(self):
+        self.transferred = 0
+        self.skipped = 0
+        self.transferred_bytes = 0
+        self.concurrency = None
+        self.peak_concurrency = None
+        # the error messages of files that failed with continue_on_error, by object key
+        self.failed = {}
+        self.deleted = 0
+
+    def add(self, other: "TransferSummary"):
+        self.transferred += other.transferred
+        self.skipped += other.skipped
+        self.transferred_bytes += other.transferred_bytes
+        self.failed.update(other.failed)
+        self.deleted += other.deleted
+
+
+class StatusSummary:
+    """
+    Counts of how the local dataset differs from the cloud, reported to the user by a status.
+    """
+
+    def __init__(self):
+        # local files that are not in the cloud
+        self.added = 0
+        self.added_bytes = 0
+        # local files whose content differs from the cloud
+        self.modified = 0
+        self.modified_bytes = 0
+        # files in the cloud that are not local
+        self.deleted = 0
+        self.deleted_bytes = 0
+        self.unchanged = 0
+        # the generation of the remote manifest compared with, or None if the cloud container was listed
+        self.remote_generation = None
+
+
 class DataStorageHandler(abc.ABC):
-    def __init__(self, dataset_id: str, container_cloud_name: str, client):
+    # the maximum number of parts a cloud provider accepts in a multipart upload
+    max_part_count = 10000
+    # the maximum number of objects a cloud provider deletes in one request
+    max_delete_batch_size = 1000
+
+    def __init__(self, dataset_id: str, container_cloud_name: str, client, storage_info: dict = None):
         self.id = dataset_id
         self.container_cloud_name = container_cloud_name
         self.client = client
+        # the data storage info returned by the API, which the worker processes build their own handlers from
+        self.storage_info = storage_info
         self.dataset_directory = find_config_directory()
+        self.options = TransferOptions()
+        # the TransferJournal of the push or pull that is running
+        self.journal = None
+        # the SyncStateDatabase and HashCache of the push or pull that is running
+        self.state_db = None
+        self.hash_cache = None
+        # the ProcessTransferPool of the transfers that are running, if files are transferred in worker processes
+        self.process_pool = None
+        # the RemoteManifest of the push or pull that is running, if the file objects are not listed
+        self.remote_manifest = None
+        self._thread_local = threading.local()
+        # the long-lived pools of worker threads of the command that is running, by the kind of work they do
+        self._thread_pools = {}
+        self._thread_pools_lock = threading.Lock()
 
-    def push(self, target: Path):
+    def push(self, target: Path, options: TransferOptions = None):
         """
-        Uploads files to the cloud in the target directory.
+        Uploads new or modified files to the cloud in the target directory.
         :param target: The absolute path to the target file or directory to be uploaded.
+        :param options: The TransferOptions of the push.
+        :return: A TransferSummary of the push.
         """
-        self.upload_dataset(target)
+        self.options = options if options is not None else TransferOptions()
+        try:
+            return self.upload_dataset(target)
+        finally:
+            self.close_thread_pools()
 
-    def pull(self, target: Path):
+    def pull(self, target: Path, options: TransferOptions = None):
         """
-        Downloads files from the cloud in the target directory, overwriting files.
+        Downloads files from the cloud in the target directory, overwriting files that differ from the cloud.
         :param target: The absolute path to the target file or directory to be downloaded.
+        :param options: The TransferOptions of the pull.
+        :return: A TransferSummary of the pull.
+        """
+        self.options = options if options is not None else TransferOptions()
+        try:
+            return self.download_dataset(target)
+        finally:
+            self.close_thread_pools()
+
+    def status(self, target: Path, options: TransferOptions = None):
+        """
+        Compares the files in the target directory with the cloud, without transferring anything.
+        :param target: The absolute path to the target file or directory to be compared.
+        :param options: The TransferOptions that select the files to compare, like those of a push or pull.
+        :return: A StatusSummary of the differences.
+        """
+        self.options = options if options is not None else TransferOptions()
+        try:
+            return self.compare_dataset(target)
+        finally:
+            self.close_thread_pools()
+
+    def snapshot(self, name: typing.Optional[str] = None, options: TransferOptions = None):
+        """
+        Creates an immutable snapshot of the files in the cloud.
+        :param name: The name of the snapshot, or None.
+        :param options: The TransferOptions of the copies.
+        :return: The info of the snapshot, whether it was created, which it is not if an existing snapshot has the same
+        files, and a TransferSummary of the copies.
+        """
+        self.options = options if options is not None else TransferOptions()
+        try:
+            return self.create_snapshot(name)
+        finally:
+            self.close_thread_pools()
+
+    def list_snapshots(self) -> typing.List[dict]:
+        """
+        Lists the snapshots of the dataset.
+        :return: The info of every snapshot, oldest first.
+        """
+        infos = []
+        try:
+            for remote_file in self.list_files_concurrently(snapshot_prefix):
+                if is_info_key(remote_file.key):
+                    infos.append(json.loads(self.get_object_bytes(remote_file.key).decode()))
+        finally:
+            self.close_thread_pools()
+        infos.sort(key=lambda info: (info["created"], info["id"]))
+        return infos
+
+    def checkout(self, snapshot_ref: str, options: TransferOptions = None):
+        """
+        Restores the dataset directory to a snapshot, downloading only the files that differ from it.
+        :param snapshot_ref: The id of the snapshot, a prefix of it, or its name.
+        :param options: The TransferOptions of the checkout.
+        :return: The info of the snapshot, and a TransferSummary of the checkout.
+        """
+        self.options = options if options is not None else TransferOptions()
+        try:
+            return self.checkout_snapshot(snapshot_ref)
+        finally:
+            self.close_thread_pools()
+
+    def create_container(self):
+        """
+        Create a handle to the cloud container of the dataset, with a client of its own from the SDK of a specific
+        cloud service provider. Creating it must not send any request.
+        """
+        pass
+
+    def container(self):
         """
-        self.download_dataset(target)
+        The handle to the cloud container of the dataset for the calling thread.
+        Every worker thread resolves the container once and then reuses it for all of its transfers, so no SDK client
+        is shared between threads and no request is sent per file to look the container up.
+        """
+        container = getattr(self._thread_local, "container", None)
+        if container is None:
+            container = self.create_container()
+            self._thread_local.container = container
+        return container
+
+    def thread_pool(self, kind: str, max_workers: int) -> ThreadPoolExecutor:
+        """
+        The pool of worker threads that does one kind of work for the command that is running. It is created on first
+        use and kept until the command finishes, so its threads keep their SDK clients from one file to the next.
+        Work in a pool must never wait for other work in the same pool.
+        :param kind: The kind of work, like "part", "listing" or "hash".
+        :param max_workers: The number of threads of the pool, if it is created.
+        """
+        with self._thread_pools_lock:
+            pool = self._thread_pools.get(kind)
+            if pool is None:
+                pool = ThreadPoolExecutor(max_workers=max_workers)
+                self._thread_pools[kind] = pool
+            return pool
+
+    def part_pool(self) -> ThreadPoolExecutor:
+        """
+        The pool of worker threads that transfers the parts of large files, and sends batches of deletes.
+        It is sized for every file of the large-file lane to transfer part_concurrency parts at a time.
+        """
+        return self.thread_pool("part", self.options.part_concurrency * self.options.large_file_concurrency)
 
     @staticmethod
-    def upload_file(
-        client, file_path: Path, object_key: str, container_cloud_name: str
-    ):
+    def map_in_pool(pool: ThreadPoolExecutor, fn: typing.Callable, items: typing.Iterable) -> list:
+        """
+        Call a function with every item in a pool, and wait for all of them, like ThreadPoolExecutor.map.
+        If a call fails, the calls that have not started are cancelled, and the error is raised once the running calls
+        have finished, so nothing is left running after the failure is handled.
+        :param pool: The ThreadPoolExecutor to run the calls in.
+        :param fn: The function to call with each item.
+        :param items: The items.
+        :return: The return values of the calls, in the order of the items.
+        """
+        futures = [pool.submit(fn, item) for item in items]
+        try:
+            return [future.result() for future in futures]
+        finally:
+            for future in futures:
+                future.cancel()
+            wait(futures)
+
+    def close_thread_pools(self):
+        """
+        Shut down the pools of worker threads of the command that finished.
+        """
+        with self._thread_pools_lock:
+            pools = list(self._thread_pools.values())
+            self._thread_pools = {}
+        for pool in pools:
+            pool.shutdown()
+
+    @staticmethod
+    def is_throttling_error(err: Exception) -> bool:
+        """
+        Check whether an error raised by the SDK of a specific cloud service provider means requests are throttled.
+        :param err: The error raised during a transfer.
+        """
+        return False
+
+    @staticmethod
+    def is_retryable_error(err: Exception) -> bool:
+        """
+        Check whether an error raised during a transfer is transient, so the transfer may succeed if it is retried.
+        Providers extend this with the server and network errors of their SDK.
+        :param err: The error raised during a transfer.
+        """
+        return isinstance(err, (ConnectionError, TimeoutError))
+
+    def upload_file(self, file_path: Path, object_key: str, metadata: typing.Optional[dict] = None):
         """
         Upload a given file to the cloud dataset.
-        :param client: A client from the SDK of a specific cloud service provider.
         :param file_path: The absolute file path to upload.
         :param object_key: The key of the file object in cloud storage.
-        :param container_cloud_name: The cloud name of the dataset.
-        :return: None
+        :param metadata: The user metadata to set on the object.
+        :return: The ETag of the uploaded object.
+        """
+        pass
+
+    def get_object_bytes(self, object_key: str) -> typing.Optional[bytes]:
+        """
+        Download the whole content of a small object, such as an index the CLI keeps in the cloud container.
+        :param object_key: The key of the object in cloud storage.
+        :return: The content of the object, or None if it does not exist.
+        """
+        pass
+
+    def put_object_bytes(self, object_key: str, data: bytes) -> str:
+        """
+        Upload the content of a small object, replacing it if it exists.
+        :param object_key: The key of the object in cloud storage.
+        :param data: The content of the object.
+        :return: The ETag of the uploaded object.
+        """
+        pass
+
+    def get_versioned_object_bytes(self, object_key: str) -> typing.Tuple[typing.Optional[bytes], typing.Optional[str]]:
+        """
+        Download a small object whole, with the version it was downloaded at, to write it back conditionally.
+        :param object_key: The key of the object in cloud storage.
+        :return: The content of the object and its version, or None and None if there is no such object.
+        """
+        pass
+
+    def put_object_bytes_if_unchanged(self, object_key: str, data: bytes, version: typing.Optional[str]) -> bool:
+        """
+        Upload a small object whole, only if it is still at the version it was downloaded at, so that concurrent
+        writers of the object never overwrite each other's changes.
+        :param object_key: The key of the object in cloud storage.
+        :param data: The content of the object.
+        :param version: The version returned by get_versioned_object_bytes, or None if the object must not exist yet.
+        :return: Whether the object was uploaded, which it is not if another writer has changed it since.
+        """
+        pass
+
+    def copy_object(self, source: RemoteFile, destination_key: str):
+        """
+        Copy an object to another key within the cloud container, without downloading it. The copy fails if the object
+        no longer has the ETag, or generation, of the RemoteFile, so it never copies content other than what was
+        listed.
+        :param source: The RemoteFile of the object to copy, whose ETag is None if any content may be copied.
+        :param destination_key: The key of the copy, which is replaced if it exists.
+        """
+        pass
+
+    def begin_multipart_upload(self, object_key: str, metadata: typing.Optional[dict] = None) -> str:
+        """
+        Start uploading a large file in parts.
+        :param object_key: The key of the file object in cloud storage.
+        :param metadata: The user metadata to set on the object, for providers that set it when the upload starts.
+        :return: An id that identifies the upload in the other multipart upload methods.
+        """
+        pass
+
+    def upload_part(self, object_key: str, upload_id: str, part_number: int, data: bytes):
+        """
+        Upload one part of a large file. Called concurrently from several threads.
+        :param object_key: The key of the file object in cloud storage.
+        :param upload_id: The id returned by begin_multipart_upload.
+        :param part_number: The number of the part, counting from 1.
+        :param data: The content of the part.
+        :return: The json serialisable value that complete_multipart_upload needs to refer to the part.
         """
         pass
 
+    def complete_multipart_upload(
+        self, object_key: str, upload_id: str, parts: list, metadata: typing.Optional[dict] = None
+    ) -> str:
+        """
+        Assemble the uploaded parts into the file object.
+        :param object_key: The key of the file object in cloud storage.
+        :param upload_id: The id returned by begin_multipart_upload.
+        :param parts: The return values of upload_part, ordered by part number.
+        :param metadata: The user metadata to set on the object, for providers that set it when the object is assembled.
+        :return: The ETag of the uploaded object.
+        """
+        pass
+
+    def abort_multipart_upload(self, object_key: str, upload_id: str):
+        """
+        Discard the parts of an upload that failed.
+        :param object_key: The key of the file object in cloud storage.
+        :param upload_id: The id returned by begin_multipart_upload.
+        """
+        pass
+
+    def upload_large_file(self, file_path: Path, object_key: str, metadata: typing.Optional[dict] = None) -> str:
+        """
+        Upload a large file by splitting it into parts that are uploaded in parallel.
+        Every part is read by the thread of the part pool that uploads it, so at most one part per thread is held in
+        memory.
+        When the transfer is journaled, uploaded parts are recorded so an interrupted upload can be resumed, and the
+        upload is left open instead of being aborted if it fails.
+        :param file_path: The absolute file path to upload.
+        :param object_key: The key of the file object in cloud storage.
+        :param metadata: The user metadata to set on the object.
+        :return: The ETag of the uploaded object.
+        """
+        stat = file_path.stat()
+        part_size = max(self.options.part_size, math.ceil(stat.st_size / self.max_part_count))
+        part_count = max(1, math.ceil(stat.st_size / part_size))
+
+        upload = None
+        if self.journal is not None:
+            upload = self.journal.find_upload(object_key, stat, part_size)
+
+        if upload is not None:
+            upload_id = upload["upload_id"]
+            uploaded_parts = dict(upload["parts"])
+        else:
+            upload_id = self.begin_multipart_upload(object_key, metadata)
+            uploaded_parts = {}
+            if self.journal is not None:
+                self.journal.begin_upload(object_key, upload_id, stat, part_size)
+
+        def upload_part_of_file(part_number: int):
+            if part_number in uploaded_parts:
+                return uploaded_parts[part_number]
+
+            with open(str(file_path), "rb") as f:
+                f.seek((part_number - 1) * part_size)
+                data = f.read(part_size)
+            part = self.upload_part(object_key, upload_id, part_number, data)
+
+            if self.journal is not None:
+                self.journal.record_part(object_key, upload_id, part_number, part)
+            return part
+
+        try:
+            parts = self.map_in_pool(self.part_pool(), upload_part_of_file, range(1, part_count + 1))
+            etag = self.complete_multipart_upload(object_key, upload_id, parts, metadata)
+        except BaseException:
+            if self.journal is None:
+                self.abort_multipart_upload(object_key, upload_id)
+            raise
+
+        if self.journal is not None:
+            self.journal.end(object_key)
+        return etag
+
+    def upload_changed_file(
+        self, manifest: SyncManifest, file_path: Path, pack_index: PackIndex, pack_writer: PackWriter = None
+    ) -> typing.Union[int, TransferSummary, None]:
+        """
+        Upload a file only if it differs from the state recorded in the manifest at its last sync.
+        Files whose size and modification time are unchanged are skipped without being read, and files that were only
+        touched are skipped once their content hash, read from the hash cache when possible, matches.
+        :param manifest: The sync manifest of the dataset.
+        :param file_path: The absolute file path to upload.
+        :param pack_index: The PackIndex, from which a file uploaded as an object of its own is removed.
+        :param pack_writer: The PackWriter that small files are added to, if small files are packed.
+        :return: The number of bytes uploaded, or None if the file was skipped. A packed file returns a TransferSummary
+        of the files in the shard it filled, which is empty if the shard is not full yet.
+        """
+        object_key = file_path.relative_to(self.dataset_directory).as_posix()
+        stat = file_path.stat()
+
+        entry = manifest.get(object_key)
+        if entry is not None and not self.is_listed_as_synced(object_key, entry, pack_index):
+            # the push that uploaded the file never saved the listing of it, so it is uploaded again
+            entry = None
+        if manifest.entry_matches_stat(entry, stat):
+            # files hashed in worker processes are never looked up in the hash cache ahead of the upload, so the hash
+            # of an unchanged file is kept from being pruned here
+            self.hash_cache.mark_used(stat)
+            return None
+
+        packed = pack_writer is not None and stat.st_size < self.options.pack_threshold
+        if self.process_pool is not None and not packed and stat.st_size < self.options.multipart_threshold:
+            # the file is hashed in the worker process, which skips the upload if the content is unchanged
+            md5, uploaded = self.process_pool.upload_file(
+                file_path, object_key, self.hash_cache.get(stat), entry["md5"] if entry is not None else None
+            )
+            self.hash_cache.add(stat, md5)
+            if uploaded is None:
+                manifest.record(object_key, stat, md5, entry["etag"])
+                return None
+            manifest.record(object_key, stat, md5, uploaded.etag)
+            self.remote_manifest.add(uploaded)
+            pack_index.remove(object_key)
+            return stat.st_size
+
+        md5 = self.hash_cache.hash(file_path, stat)
+        if entry is not None and entry["md5"] == md5:
+            manifest.record(object_key, stat, md5, entry["etag"])
+            return None
+
+        if packed:
+            # recorded in the manifest, and counted, once its shard has been uploaded, by the file that fills the shard
+            shard_summary = pack_writer.add(file_path, object_key, stat)
+            return shard_summary if shard_summary is not None else TransferSummary()
+
+        uploaded = self.upload_object(file_path, object_key, md5)
+        manifest.record(object_key, stat, md5, uploaded.etag)
+        self.remote_manifest.add(uploaded)
+        pack_index.remove(object_key)
+        return stat.st_size
+
+    def is_listed_as_synced(self, object_key: str, entry: dict, pack_index: PackIndex) -> bool:
+        """
+        Check whether the cloud still lists a file as it was at its last sync. A push records its files in the sync
+        manifest as soon as they are uploaded, so if it fails before the remote manifest or the pack index is saved, the
+        manifest has files that no pull would find.
+        :param object_key: The key of the file.
+        :param entry: The entry of the file in the sync manifest.
+        :param pack_index: The PackIndex, which lists the packed files.
+        """
+        if entry["etag"] is None:
+            # packed files have no ETag of their own, and are listed by the pack index
+            packed_entry = pack_index.files.get(object_key)
+            return packed_entry is not None and packed_entry["md5"] == entry["md5"]
+        remote_file = self.remote_manifest.describe(object_key)
+        return remote_file is not None and normalise_etag(remote_file.etag) == entry["etag"]
+
+    def upload_object(self, file_path: Path, object_key: str, md5: str) -> RemoteFile:
+        """
+        Upload a file as an object of its own, in parts if it is large. With compress in the options, a file that
+        compresses well is uploaded gzip compressed, with metadata that lets a pull decompress it.
+        :param file_path: The absolute file path to upload.
+        :param object_key: The key of the file object in cloud storage.
+        :param md5: The md5 hex digest of the file.
+        :return: The RemoteFile describing the uploaded object.
+        """
+        stat = file_path.stat()
+        if self.options.compress and is_compressible(object_key):
+            compressed_path = compress_file(file_path, self.options.compression_level)
+            if compressed_path is not None:
+                try:
+                    # the compressed copy of unchanged content is identical, so an interrupted upload of it can resume
+                    os.utime(str(compressed_path), ns=(stat.st_atime_ns, stat.st_mtime_ns))
+                    metadata = encoding_metadata(md5, stat.st_size)
+                    etag = self.upload_object_file(compressed_path, object_key, metadata)
+                    return RemoteFile(
+                        object_key, compressed_path.stat().st_size, None, normalise_etag(etag), metadata
+                    )
+                finally:
+                    os.remove(str(compressed_path))
+
+        etag = self.upload_object_file(file_path, object_key)
+        return RemoteFile(object_key, stat.st_size, md5, normalise_etag(etag), {})
+
+    def upload_object_file(self, file_path: Path, object_key: str, metadata: typing.Optional[dict] = None) -> str:
+        if file_path.stat().st_size >= self.options.multipart_threshold:
+            return self.upload_large_file(file_path, object_key, metadata)
+        return self.upload_file(file_path, object_key, metadata)
+
+    def upload_pack_shard(
+        self, manifest: SyncManifest, pack_index: PackIndex, shard_path: Path, shard_key: str, members: list
+    ) -> TransferSummary:
+        """
+        Upload a sealed shard of packed files, and record its files in the pack index and the manifest.
+        The upload is retried here, rather than by the transfer of the file that filled the shard, because a retry of
+        that file would only pack it again. If the upload still fails, every file in the shard has failed, and with
+        continue_on_error they are all added to the failures instead of stopping the push.
+        :param manifest: The sync manifest of the dataset.
+        :param pack_index: The PackIndex.
+        :param shard_path: The path to the local shard file.
+        :param shard_key: The key of the shard object in cloud storage.
+        :param members: The files in the shard.
+        :return: A TransferSummary of the files in the shard.
+        """
+        summary = TransferSummary()
+        shard_size = shard_path.stat().st_size
+        try:
+            self.transfer_with_retries(None, lambda path: self.upload_object_file(path, shard_key), shard_path)
+        except Exception as err:
+            if not self.options.continue_on_error:
+                raise DataStorageHandlerShardUploadException(shard_key, len(members), err)
+            self.record_failure(summary, [member["key"] for member in members], err)
+            return summary
+
+        pack_index.add_shard(shard_key, shard_size, members)
+        for member in members:
+            manifest.record(member["key"], member["stat"], member["md5"], None)
+        summary.transferred = len(members)
+        summary.transferred_bytes = sum(member["length"] for member in members)
+        return summary
+
+    def load_remote_manifest(self) -> typing.Optional[RemoteManifest]:
+        return RemoteManifest.from_bytes(self.get_object_bytes(remote_manifest_key))
+
+    def save_remote_manifest(self, remote_manifest: RemoteManifest) -> int:
+        """
+        Upload the remote manifest, applying its changes to the latest one if another push has saved it since it was
+        loaded. The upload only succeeds if no other push saves the manifest between reading the latest one and writing
+        it, and the latest one is read again otherwise.
+        :param remote_manifest: The RemoteManifest.
+        :return: The generation of the saved manifest.
+        """
+        while True:
+            data, version = self.get_versioned_object_bytes(remote_manifest_key)
+            rebased = remote_manifest.rebase(RemoteManifest.from_bytes(data))
+            if self.put_object_bytes_if_unchanged(remote_manifest_key, rebased.to_bytes(), version):
+                return rebased.generation
+            # another push saved the manifest in the meantime
+            time.sleep(random.uniform(0.1, 1))
+
+    def list_remote_files(self, prefix: typing.Optional[str] = None) -> typing.Iterator[RemoteFile]:
+        """
+        List the file objects under a prefix from the remote manifest of the running push or pull, or by listing the
+        container if there is none.
+        :param prefix: The prefix of the object keys, or None for every file object.
+        :return: An iterator of RemoteFiles.
+        """
+        if self.remote_manifest is not None:
+            return self.remote_manifest.list_files(prefix)
+        return self.list_files_concurrently(prefix)
+
+    def list_files_concurrently(self, prefix: typing.Optional[str] = None) -> typing.Iterator[RemoteFile]:
+        """
+        List the file objects under a prefix with a PrefixPartitionedListing, which lists the directories under the
+        prefix at the same time.
+        :param prefix: The prefix of the object keys, or None for every file object.
+        :return: An iterator of RemoteFiles, in no particular order.
+        """
+        listing = PrefixPartitionedListing(
+            self.list_directory,
+            lambda list_prefix: (self.describe_file(f) for f in self.list_files(list_prefix or None)),
+            self.thread_pool("listing", self.options.listing_concurrency),
+            concurrency=self.options.listing_concurrency,
+        )
+        return listing.list(prefix or "")
+
+    def describe_remote_file(self, object_key: str) -> typing.Optional[RemoteFile]:
+        """
+        Find a single file object, from the remote manifest of the running push or pull if there is one.
+        :return: The RemoteFile, or None if there is no such file object.
+        """
+        if self.remote_manifest is not None:
+            return self.remote_manifest.describe(object_key)
+        for remote_file in self.list_remote_files(object_key):
+            if remote_file.key == object_key:
+                return remote_file
+        return None
+
+    def load_pack_index(self) -> PackIndex:
+        return PackIndex.from_bytes(self.get_object_bytes(index_key))
+
+    def save_pack_index(self, pack_index: PackIndex):
+        """
+        Upload the pack index. Other pushes, such as those of other shards, may have saved the index since it was
+        loaded, so the files added and removed by this push are applied to the latest index instead, which is only
+        written if no other push saves it in the meantime, and read again otherwise.
+        :param pack_index: The PackIndex.
+        :return: The PackIndex that was saved.
+        """
+        while True:
+            data, version = self.get_versioned_object_bytes(index_key)
+            latest_pack_index = pack_index.rebase(PackIndex.from_bytes(data))
+            if self.put_object_bytes_if_unchanged(index_key, latest_pack_index.to_bytes(), version):
+                return latest_pack_index
+            # another push saved the index in the meantime
+            time.sleep(random.uniform(0.1, 1))
+
     def upload_dataset(self, target: Path):
         """
         This function helps upload a directory to the cloud.
-        Uses a ThreadPoolExecutor to make uploads faster.
+        Files are streamed from the directory walk into a TransferScheduler, and the sync manifest is used to upload
+        only new or modified files.
         :param target: The absolute path to target file or directory to be uploaded.
-        :return: None
+        :return: A TransferSummary of the upload.
         """
         if not target.exists():
             raise DataStorageHandlerTargetNotFoundException()
 
-        # if target is a file, set it into the files list
-        if target.is_file():
-            files = [target]
+        prefix = self.target_prefix(target)
+        manifest = self.open_sync_state()
+        # the failures of an interrupted push are read from its journal before the failed files are retried
+        self.open_journal("push", manifest)
+        path_filter = self.load_path_filter()
+        walker = None
+
+        if self.options.retry_failed:
+            # only the files that failed in the last push, and still exist
+            files = (
+                f for f in (
+                    self.dataset_directory.joinpath(object_key)
+                    for object_key in load_failures(self.dataset_directory, "push", self.options.shard)
+                    if is_under_prefix(object_key, prefix)
+                )
+                if f.is_file()
+            )
+        # if target is a file, it is the only file to upload
+        elif target.is_file():
+            files = iter([target])
         else:
-            # if target is a directory, upload all files in it
-            directory_generator = Path(target).glob("**/*")
-            files = [f for f in directory_generator if f.is_file()]
-
-            if len(files) == 0:
-                raise DataStorageHandlerEmptyFilesException()
-
-        # begin uploading
-        with tqdm(total=len(files)) as pbar:
-            with ThreadPoolExecutor(max_workers=5) as ex:
-                futures = [
-                    ex.submit(
-                        self.upload_file, self.client, file_path, str(file_path.relative_to(self.dataset_directory).as_posix()), self.container_cloud_name
-                    )
-                    for file_path in files
-                ]
-                for future in as_completed(futures):
+            # the recorded directories may leave out files that other rules include
+            if manifest.directories_filter != path_filter.fingerprint:
+                manifest.directories = {}
+                manifest.directories_filter = path_filter.fingerprint
+
+            # if target is a directory, upload all files in it, without entering excluded directories
+            walker = DirectoryWalker(
+                self.dataset_directory,
+                directories=manifest.directories,
+                # mirroring needs to see every local file
+                skip_unchanged=self.options.skip_unchanged_directories and not self.options.delete,
+                directory_filter=path_filter.may_contain_matches,
+            )
+            files = walker.walk(target)
+
+        # the keys of the local files, which are kept in the cloud when mirroring, and only collected then
+        local_keys = set() if self.options.delete else None
+
+        def select_files(candidates: typing.Iterator[Path]):
+            for file_path in candidates:
+                object_key = file_path.relative_to(self.dataset_directory).as_posix()
+                if (
+                    not self.is_sync_state_file(file_path)
+                    and (self.options.shard is None or self.options.shard.contains(object_key))
+                    and path_filter.matches(object_key)
+                ):
+                    if local_keys is not None:
+                        local_keys.add(object_key)
+                    yield file_path
+
+        files = select_files(files)
+        # worker processes hash the files they upload themselves
+        if self.options.processes is None:
+            files = self.prehash_files(files, manifest)
+        self.remote_manifest = self.load_remote_manifest()
+        if self.remote_manifest is None or self.options.full_listing:
+            # the manifest is kept up to date from here on, so the container is only listed once
+            self.remote_manifest = RemoteManifest.from_listing(
+                self.list_files_concurrently(),
+                generation=self.remote_manifest.generation if self.remote_manifest is not None else 0,
+            )
+        pack_index = self.load_pack_index()
+        pack_writer = None
+        if self.options.pack:
+            pack_writer = PackWriter(
+                lambda *shard: self.upload_pack_shard(manifest, pack_index, *shard),
+                shard_size=self.options.shard_size,
+            )
+
+        scanned_directories = {}
+        # the hashes of files that the push did not see are only dropped once it has seen every local file
+        prune_hash_cache = False
+        # save the manifest even if the upload fails part way so finished files are not redone
+        try:
+            summary = self.run_transfers(
+                files,
+                lambda file_path: self.upload_changed_file(manifest, file_path, pack_index, pack_writer),
+                item_keys=lambda file_path: [file_path.relative_to(self.dataset_directory).as_posix()],
+                item_size=self.local_file_size,
+                # the dataset is not empty if the walk skipped unchanged directories
+                allow_empty=lambda: walker is not None and walker.skipped_count > 0,
+            )
+            if pack_writer is not None:
+                shard_summary = pack_writer.close()
+                if shard_summary is not None:
+                    summary.add(shard_summary)
+            # only a walk sees every local file, so a single file or a retry of failed files deletes nothing
+            if self.options.delete and walker is not None:
+                summary.deleted = self.delete_remote_files(manifest, pack_index, path_filter, prefix, local_keys)
+            self.update_failures("push", prefix, summary)
+            # directories are only recorded once all their files are synced, so they can be skipped next time
+            if walker is not None and len(summary.failed) == 0:
+                scanned_directories = walker.scanned
+            # only a walk of the whole dataset sees every local file
+            prune_hash_cache = walker is not None and prefix is None and not self.options.skip_unchanged_directories
+            return summary
+        finally:
+            try:
+                if pack_writer is not None:
+                    pack_writer.discard()
+                if pack_index.changed:
+                    self.save_pack_index(pack_index)
+                if self.remote_manifest.changed:
+                    manifest.remote_generation = self.save_remote_manifest(self.remote_manifest)
+                else:
+                    manifest.remote_generation = self.remote_manifest.generation
+                # the files of the directories are only listed in the cloud once the saves have succeeded
+                manifest.directories.update(scanned_directories)
+            finally:
+                self.remote_manifest = None
+                self.close_sync_state(manifest, prune=prune_hash_cache)
+                self.close_journal()
+
+    def delete_remote_files(
+        self,
+        manifest: SyncManifest,
+        pack_index: PackIndex,
+        path_filter: PathFilter,
+        prefix: typing.Optional[str],
+        local_keys: typing.Set[str],
+    ) -> int:
+        """
+        Delete the files in the cloud that do not exist locally, so the cloud dataset mirrors the local directory.
+        Excluded files are kept. Packed files are removed from the pack index, and shards that no longer hold any file
+        are deleted once the updated index is saved.
+        :param manifest: The sync manifest of the dataset.
+        :param pack_index: The PackIndex.
+        :param path_filter: The PathFilter of the push.
+        :param prefix: The prefix of the target, or None for the whole dataset.
+        :param local_keys: The keys of the local files under the target.
+        :return: The number of deleted files.
+        """
+        def is_deleted(object_key: str) -> bool:
+            return (
+                object_key not in local_keys
+                and is_under_prefix(object_key, prefix)
+                and (self.options.shard is None or self.options.shard.contains(object_key))
+                and path_filter.matches(object_key)
+                and not self.is_sync_state_file(self.dataset_directory.joinpath(object_key))
+            )
+
+        object_keys = [
+            object_key
+            for object_key in (
+                remote_file.key
+                for list_prefix in path_filter.list_prefixes(prefix)
+                for remote_file in self.list_remote_files(list_prefix)
+            )
+            if not object_key.startswith(internal_key_prefix) and is_deleted(object_key)
+        ]
+        packed_keys = [object_key for object_key in pack_index.files if is_deleted(object_key)]
+
+        self.delete_files(object_keys)
+        self.remote_manifest.remove(object_keys)
+        for object_key in packed_keys:
+            pack_index.remove(object_key)
+
+        referenced_shards = pack_index.shards
+        if pack_index.changed:
+            referenced_shards = self.save_pack_index(pack_index).shards
+            pack_index.changed = False
+        if self.options.shard is not None:
+            # the pushes of other shards may be uploading shards that are not in the index yet, so only the shards
+            # known to this push are deleted once they are unreferenced
+            shard_keys = list(pack_index.shards)
+        else:
+            # shards left unreferenced by this push, or by an earlier one that was interrupted
+            shard_keys = [self.describe_file(f).key for f in self.list_files(pack_prefix)]
+        self.delete_files([
+            shard_key for shard_key in shard_keys if shard_key != index_key and shard_key not in referenced_shards
+        ])
+
+        manifest.remove(object_keys + packed_keys)
+        return len(object_keys) + len(packed_keys)
+
+    def delete_local_files(
+        self, manifest: SyncManifest, path_filter: PathFilter, target: Path, remote_keys: typing.Set[str]
+    ) -> int:
+        """
+        Delete the local files that do not exist in the cloud, so the local directory mirrors the cloud dataset.
+        Excluded files are kept, and directories left empty are removed.
+        :param manifest: The sync manifest of the dataset.
+        :param path_filter: The PathFilter of the pull.
+        :param target: The absolute path to the target directory.
+        :param remote_keys: The keys of the files in the cloud under the target.
+        :return: The number of deleted files.
+        """
+        if not target.is_dir():
+            return 0
+
+        walker = DirectoryWalker(self.dataset_directory, directory_filter=path_filter.may_contain_matches)
+        object_keys = []
+        for file_path in walker.walk(target):
+            object_key = file_path.relative_to(self.dataset_directory).as_posix()
+            if (
+                object_key not in remote_keys
+                and path_filter.matches(object_key)
+                and not self.is_sync_state_file(file_path)
+            ):
+                object_keys.append(object_key)
+
+        for object_key in object_keys:
+            file_path = self.dataset_directory.joinpath(object_key)
+            os.remove(str(file_path))
+
+            directory = file_path.parent
+            while directory != target and directory != self.dataset_directory:
+                try:
+                    directory.rmdir()
+                except OSError:
+                    # the directory is not empty
+                    break
+                directory = directory.parent
+
+        manifest.remove(object_keys)
+        return len(object_keys)
+
+    def prehash_files(self, files: typing.Iterator[Path], manifest: SyncManifest) -> typing.Generator:
+        """
+        Hash the files that changed since their last sync on all cores, ahead of the transfer pipeline, so the hashes
+        are in the hash cache by the time the files are transferred. Unchanged files are passed through right away.
+        :param files: An iterator of the absolute paths of the files to upload.
+        :param manifest: The sync manifest of the dataset.
+        :return: A generator of the same file paths, each yielded once it is hashed.
+        """
+        worker_count = os.cpu_count() or 1
+        pool = self.thread_pool("hash", worker_count)
+        pending = collections.deque()
+
+        def hash_changed_file(file_path: Path, stat: os.stat_result):
+            try:
+                self.hash_cache.hash(file_path, stat)
+            except OSError:
+                # the error is raised again when the file is transferred, where it is handled
+                pass
+
+        try:
+            for file_path in files:
+                try:
+                    stat = file_path.stat()
+                except OSError:
+                    yield file_path
+                    continue
+
+                object_key = file_path.relative_to(self.dataset_directory).as_posix()
+                # looking up every file marks its hash as still in use, so the cache can be pruned after a full walk
+                if self.hash_cache.get(stat) is not None or manifest.is_unchanged(object_key, stat):
+                    yield file_path
+                    continue
+
+                pending.append((file_path, pool.submit(hash_changed_file, file_path, stat)))
+                # keep a few files queued per core, and pass on the oldest ones as soon as they are hashed
+                while len(pending) > worker_count * 4 or (len(pending) > 0 and pending[0][1].done()):
+                    file_path, future = pending.popleft()
                     future.result()
-                    pbar.update(1)
+                    yield file_path
+
+            while len(pending) > 0:
+                file_path, future = pending.popleft()
+                future.result()
+                yield file_path
+        finally:
+            # the pool outlives the generator, so files still being hashed are waited for if the consumer stops early
+            for _, future in pending:
+                future.cancel()
+            wait([future for _, future in pending])
+
+    def open_sync_state(self) -> SyncManifest:
+        """
+        Open the sync state database of the dataset for a push or pull, with its hash cache.
+        :return: The sync manifest of the dataset.
+        """
+        self.state_db = SyncStateDatabase.open(self.dataset_directory, self.options.shard)
+        self.hash_cache = HashCache.load(self.state_db)
+        return SyncManifest.load(self.state_db)
+
+    def close_sync_state(self, manifest: SyncManifest, prune: bool):
+        """
+        Save the sync manifest and the hash cache of a push or pull, and close the sync state database.
+        :param manifest: The sync manifest of the dataset.
+        :param prune: Whether to drop the hashes of files that the push or pull did not see.
+        """
+        try:
+            manifest.save()
+            self.hash_cache.save(prune=prune)
+        finally:
+            self.state_db.close()
+            self.state_db = None
+            self.hash_cache = None
+
+    def open_journal(self, direction: str, manifest: SyncManifest):
+        """
+        Open the TransferJournal of a push or pull, and attach it to the sync manifest.
+        Files finished by an interrupted run are added to the manifest even if the run never saved it, and the files
+        that failed in it to the failures. Its unfinished multipart transfers are continued when resuming, and
+        discarded otherwise.
+        :param direction: Either "push" or "pull".
+        :param manifest: The sync manifest of the dataset.
+        """
+        journal = TransferJournal.open(self.dataset_directory, direction, self.options.shard)
+        manifest.update(journal.completed_files)
+        if len(journal.failed_files) > 0:
+            # the interrupted run never saved its failures, so they are kept for a retry of the failed files
+            failures = load_failures(self.dataset_directory, direction, self.options.shard)
+            failures.update(journal.failed_files)
+            save_failures(self.dataset_directory, direction, failures, self.options.shard)
+
+        if not self.options.resume:
+            for object_key, upload in journal.multipart_uploads.items():
+                try:
+                    self.abort_multipart_upload(object_key, upload["upload_id"])
+                except Exception:
+                    # the upload may have expired already, and it is only cleaned up on a best effort basis
+                    pass
+            for object_key in journal.ranged_downloads:
+                partial_path = self.dataset_directory.joinpath(object_key + partial_download_suffix)
+                if partial_path.exists():
+                    os.remove(str(partial_path))
+            journal.reset()
+
+        manifest.journal = journal
+        self.journal = journal
+
+    def close_journal(self):
+        self.journal.close()
+        self.journal = None
+
+    def run_transfers(
+        self,
+        items: typing.Iterator,
+        transfer: typing.Callable,
+        item_keys: typing.Callable,
+        item_size: typing.Callable,
+        file_count: typing.Callable = None,
+        allow_empty: typing.Callable = None,
+    ) -> TransferSummary:
+        """
+        Runs a transfer function over a stream of items in a TransferScheduler, showing the progress.
+        Items from the multipart threshold up go to a large-file lane with a fixed number of concurrent transfers,
+        largest first, and the other items to a small-file lane.
+        Items that fail with a throttling or transient error are retried after a backoff, and the ConcurrencyController
+        lowers the number of concurrent transfers when the cloud provider throttles requests. With continue_on_error,
+        items that still fail are added to the failures of the summary instead of stopping the run. With processes in
+        the options, the files below the multipart threshold are transferred in a ProcessTransferPool.
+        :param items: An iterator of the items to transfer.
+        :param transfer: The function that transfers an item, and returns the number of bytes transferred, or None if
+        it skipped the item. An item of several files returns a TransferSummary of them instead.
+        :param item_keys: Returns the object keys of the files in an item.
+        :param item_size: Returns the size in bytes of an item.
+        :param file_count: Returns the number of files in an item, if it is not always one.
+        :param allow_empty: Returns whether it is expected that there are no items, once the items are exhausted.
+        :return: A TransferSummary of the transfers.
+        """
+        file_count = file_count or (lambda item: 1)
+
+        summary = TransferSummary()
+        controller = self.options.create_concurrency_controller()
+        large_file_controller = self.options.create_large_file_controller()
+        scheduler = TransferScheduler(
+            controller, large_file_controller, item_size=item_size, large_size=self.options.multipart_threshold
+        )
+
+        def transfer_item_in_lane(lane_controller: ConcurrencyController):
+            def transfer_item(item):
+                try:
+                    return self.transfer_with_retries(lane_controller, transfer, item)
+                except Exception as err:
+                    if not self.options.continue_on_error:
+                        raise
+                    failed = TransferSummary()
+                    self.record_failure(failed, item_keys(item), err)
+                    return failed
+            return transfer_item
+
+        if self.options.processes is not None:
+            self.process_pool = ProcessTransferPool(self, self.options.processes)
+
+        with tqdm(total=0) as pbar:
+            def on_produced(item):
+                # the total is only known once the walk or listing has finished, so grow it as items are found
+                pbar.total += file_count(item)
+                pbar.refresh()
+
+            def on_done(item, result):
+                # the throughput of the large-file lane does not depend on the concurrency of the small-file lane
+                lane_controller = large_file_controller if scheduler.is_large(item) else controller
+                if result is None:
+                    summary.skipped += 1
+                elif isinstance(result, TransferSummary):
+                    summary.add(result)
+                    lane_controller.record_transfer(result.transferred_bytes)
+                else:
+                    summary.transferred += 1
+                    summary.transferred_bytes += result
+                    lane_controller.record_transfer(result)
+                pbar.update(file_count(item))
+
+            try:
+                produced = scheduler.run(
+                    items,
+                    small_transfer=transfer_item_in_lane(controller),
+                    large_transfer=transfer_item_in_lane(large_file_controller),
+                    on_produced=on_produced,
+                    on_done=on_done,
+                )
+            finally:
+                if self.process_pool is not None:
+                    self.process_pool.shutdown()
+                    self.process_pool = None
+
+        summary.concurrency = controller.level
+        summary.peak_concurrency = controller.peak
+
+        if produced == 0 and (allow_empty is None or not allow_empty()):
+            raise DataStorageHandlerEmptyFilesException()
+
+        return summary
+
+    @staticmethod
+    def local_file_size(file_path: Path) -> int:
+        try:
+            return file_path.stat().st_size
+        except OSError:
+            # the error is raised again when the file is transferred, where it is handled
+            return 0
+
+    def transfer_with_retries(
+        self, controller: typing.Optional[ConcurrencyController], transfer: typing.Callable, item
+    ):
+        """
+        Transfer an item, retrying with exponential backoff and jitter while it fails with a throttling or transient
+        error, up to the number of retries in the options.
+        :param controller: The ConcurrencyController that is told about throttled requests, or None.
+        :param transfer: The function that transfers an item.
+        :param item: The item to transfer.
+        """
+        attempt = 0
+        while True:
+            try:
+                return transfer(item)
+            except Exception as err:
+                throttled = self.is_throttling_error(err)
+                if not (throttled or self.is_retryable_error(err)) or attempt >= self.options.retries:
+                    raise
+                if throttled and controller is not None:
+                    controller.record_throttle()
+                attempt += 1
+                time.sleep(min(2 ** attempt, 30) * random.uniform(0.5, 1))
+
+    def record_failure(self, summary: TransferSummary, object_keys: typing.Iterable[str], err: Exception):
+        """
+        Record files that failed with continue_on_error in the summary, and in the journal, so they are listed in the
+        failures even if the run is interrupted before it saves them.
+        :param summary: The TransferSummary to add the failures to.
+        :param object_keys: The object keys of the files.
+        :param err: The error the files failed with.
+        """
+        message = "{}: {}".format(type(err).__name__, err)
+        for object_key in object_keys:
+            summary.failed[object_key] = message
+            if self.journal is not None:
+                self.journal.record_failure(object_key, message)
+
+    def update_failures(self, direction: str, prefix: typing.Optional[str], summary: TransferSummary):
+        """
+        Replace the failures listed under a prefix with the files that failed in this run.
+        :param direction: Either "push" or "pull".
+        :param prefix: The prefix of the object keys that this run covered, or None for the whole dataset.
+        :param summary: The TransferSummary of this run.
+        """
+        failures = {
+            object_key: error
+            for object_key, error in load_failures(self.dataset_directory, direction, self.options.shard).items()
+            if not is_under_prefix(object_key, prefix)
+        }
+        failures.update(summary.failed)
+        save_failures(self.dataset_directory, direction, failures, self.options.shard)
+
+    def target_prefix(self, target: Path) -> typing.Optional[str]:
+        """
+        The prefix of the object keys of the files in a target, or None if the target is the whole dataset.
+        """
+        if target == self.dataset_directory:
+            return None
+        return target.relative_to(self.dataset_directory).as_posix()
+
+    def load_path_filter(self) -> PathFilter:
+        return PathFilter.load(self.dataset_directory, exclude=self.options.exclude, include=self.options.include)
+
+    def is_sync_state_file(self, file_path: Path) -> bool:
+        """
+        Check whether a file is the dataset config, or one of the files that the CLI keeps in the dataset directory to
+        track sync state. These files are never transferred, whatever the include and exclude rules.
+        """
+        if file_path.name.endswith(partial_download_suffix):
+            return True
+        if file_path.parent != self.dataset_directory:
+            return False
+
+        # the sync state files of a shard are named after those of the whole dataset
+        name = unshard_filename(file_path.name)
+        return (
+            name == relative_config_filepath.name
+            or name.startswith(state_db_filename)
+            or name in journal_filenames.values()
+            or name in failures_filenames.values()
+        )
 
     def list_files(self, prefix: str = None) -> typing.Generator:
         """
-        Returns a generator that lists all files in a cloud dataset based on a given prefix.
+        Returns a generator that lists all files in a cloud dataset based on a given prefix. Called concurrently from
+        several threads.
         :param prefix: The prefix of the files to be listed.
         """
         pass
 
+    def list_directory(self, prefix: str) -> typing.Generator:
+        """
+        Lazily list one level of the file objects under a prefix, with / as the delimiter, one page at a time. Called
+        concurrently from several threads.
+        :param prefix: The prefix of the object keys, or an empty string for the top level of the container.
+        :return: A generator that yields every page as it is read, as the RemoteFiles of the file objects directly
+        under the prefix in the page, and the prefixes of the directories under it in the page, each ending with /.
+        """
+        pass
+
     @staticmethod
-    def download_file(
-            client, file, dataset_directory: Path, container_cloud_name: str
-    ):
+    def describe_file(file) -> RemoteFile:
         """
-        Download a given file from the cloud to the local dataset.
-        :param client: A client from the SDK of a specific cloud service provider.
+        Read the properties of a file object yielded by the list_files generator.
         :param file: A file object yielded by the list_files generator.
-        :param dataset_directory: The absolute directory path of the local dataset.
-        :param container_cloud_name: The cloud name of the dataset.
+        :return: The RemoteFile describing the file object.
+        """
+        pass
+
+    def delete_objects(self, object_keys: typing.List[str]):
+        """
+        Delete objects from the cloud dataset in one request. Objects that do not exist are not an error.
+        Raises a DataStorageHandlerDeleteException with the keys of the objects that could not be deleted.
+        :param object_keys: The keys of at most max_delete_batch_size objects.
+        """
+        pass
+
+    def delete_files(self, object_keys: typing.List[str]):
+        """
+        Delete objects from the cloud dataset in batches, several batches at a time.
+        :param object_keys: The keys of the objects to delete.
+        """
+        batches = [
+            object_keys[i:i + self.max_delete_batch_size]
+            for i in range(0, len(object_keys), self.max_delete_batch_size)
+        ]
+        self.map_in_pool(self.part_pool(), self.delete_objects, batches)
+
+    def download_file(self, remote_file: RemoteFile) -> typing.Optional[dict]:
+        """
+        Download the object that holds the content of a file as it is stored, from the cloud to the path of the file in
+        the local dataset. Its directory has already been created.
+        :param remote_file: The RemoteFile to download.
+        :return: The user metadata of the object from the download response, or None if the provider lists it.
+        """
+        pass
+
+    def get_object_metadata(self, object_key: str) -> dict:
+        """
+        Read the user metadata of a file object.
+        :param object_key: The key of the file object in cloud storage.
         """
         pass
 
+    def download_small_file(self, remote_file: RemoteFile) -> typing.Optional[str]:
+        """
+        Download a file in a single request, and decompress it if it was pushed compressed.
+        :param remote_file: The RemoteFile to download.
+        :return: The md5 hex digest of the local file if it is known without reading the file, or None.
+        """
+        metadata = self.download_file(remote_file)
+        return self.decode_downloaded_file(remote_file, metadata)
+
+    def decode_downloaded_file(self, remote_file: RemoteFile, metadata: typing.Optional[dict]) -> typing.Optional[str]:
+        """
+        Decompress a downloaded file if its object is compressed.
+        :param remote_file: The RemoteFile that was downloaded.
+        :param metadata: The user metadata of the object, or None to use the metadata of the RemoteFile, or to read it
+        if the listing did not include it.
+        :return: The md5 hex digest of the local file if it is known without reading the file, or None.
+        """
+        if metadata is None:
+            metadata = remote_file.metadata
+        if metadata is None:
+            metadata = self.get_object_metadata(remote_file.content_key)
+
+        if not is_compressed(metadata):
+            return remote_file.md5
+
+        file_path = self.dataset_directory.joinpath(remote_file.key)
+        decompress_file(file_path, file_path.with_name(file_path.name + partial_download_suffix))
+        return metadata.get(md5_metadata_key)
+
+    def download_range(self, object_key: str, start: int, length: int) -> bytes:
+        """
+        Download a byte range of a file object. Called concurrently from several threads.
+        :param object_key: The key of the file object in cloud storage.
+        :param start: The offset of the first byte of the range.
+        :param length: The number of bytes in the range.
+        :return: The content of the range.
+        """
+        pass
+
+    def download_large_file(self, remote_file: RemoteFile):
+        """
+        Download a large file by fetching byte ranges in parallel, and writing each one at its offset into a
+        preallocated partial file, which replaces the local file once complete.
+        When the transfer is journaled, downloaded ranges are recorded so an interrupted download can be resumed.
+        :param remote_file: The RemoteFile to download.
+        """
+        part_size = self.options.part_size
+        part_count = max(1, math.ceil(remote_file.size / part_size))
+        file_path = self.dataset_directory.joinpath(remote_file.key)
+        partial_path = file_path.with_name(file_path.name + partial_download_suffix)
+
+        download = None
+        if self.journal is not None and partial_path.exists():
+            download = self.journal.find_download(remote_file.key, remote_file.etag, remote_file.size, part_size)
+
+        if download is not None:
+            downloaded_ranges = set(download["ranges"])
+        else:
+            downloaded_ranges = set()
+            # preallocate the file so every range can be written independently
+            with open(str(partial_path), "wb") as f:
+                f.truncate(remote_file.size)
+            if self.journal is not None:
+                self.journal.begin_download(remote_file.key, remote_file.etag, remote_file.size, part_size)
+
+        def download_part_of_file(part_index: int):
+            if part_index in downloaded_ranges:
+                return
+
+            start = part_index * part_size
+            data = self.download_range(remote_file.content_key, start, min(part_size, remote_file.size - start))
+            with open(str(partial_path), "r+b") as f:
+                f.seek(start)
+                f.write(data)
+
+            if self.journal is not None:
+                self.journal.record_range(remote_file.key, remote_file.etag, part_index)
+
+        self.map_in_pool(self.part_pool(), download_part_of_file, range(part_count))
+
+        os.replace(str(partial_path), str(file_path))
+        if self.journal is not None:
+            self.journal.end(remote_file.key)
+
     @staticmethod
     def make_dirs(object_key: str, dataset_directory: Path):
         """
@@ -122,30 +1410,493 @@ class DataStorageHandler(abc.ABC):
         abs_path = str(dataset_directory.joinpath(relative_path))
         os.makedirs(abs_path, exist_ok=True)
 
+    def download_changed_file(self, manifest: SyncManifest, remote_file: RemoteFile) -> typing.Optional[int]:
+        """
+        Download a file only if the local copy differs from the cloud.
+        A local file is kept if its stat and the remote ETag both match the manifest, or if its content hash matches
+        the md5 reported by the cloud provider.
+        :param manifest: The sync manifest of the dataset.
+        :param remote_file: The RemoteFile to download.
+        :return: The number of bytes downloaded, or None if the file was skipped.
+        """
+        file_path = self.dataset_directory.joinpath(remote_file.key)
+
+        try:
+            stat = file_path.stat()
+        except FileNotFoundError:
+            stat = None
+
+        if stat is not None:
+            # the size of a compressed object differs from its file, but its ETag changes with it all the same
+            entry = manifest.get(remote_file.key)
+            if manifest.is_unchanged(remote_file.key, stat) and entry["etag"] == remote_file.etag:
+                return None
+
+            size, md5 = self.describe_content(remote_file)
+            if stat.st_size == size and md5 is not None and self.hash_cache.hash(file_path, stat) == md5:
+                manifest.record(remote_file.key, stat, md5, remote_file.etag)
+                return None
+
+        if "/" in remote_file.key:
+            self.make_dirs(remote_file.key, self.dataset_directory)
+
+        if remote_file.size >= self.options.multipart_threshold:
+            self.download_large_file(remote_file)
+            md5 = self.decode_downloaded_file(remote_file, None)
+        elif self.process_pool is not None:
+            md5 = self.process_pool.download_file(remote_file)
+        else:
+            md5 = self.download_small_file(remote_file)
+
+        stat = file_path.stat()
+        if md5 is not None:
+            self.hash_cache.add(stat, md5)
+        else:
+            md5 = self.hash_cache.hash(file_path, stat)
+        manifest.record(remote_file.key, stat, md5, remote_file.etag)
+        return remote_file.size
+
     def download_dataset(self, target: Path):
         """
-        Downloads files from the cloud in the target directory.
+        Downloads files from the cloud in the target directory, skipping files that are identical locally.
         :param target: The absolute path to the target file or directory to be downloaded.
+        :return: A TransferSummary of the download.
         """
-        if target == self.dataset_directory:
-            prefix = None
+        prefix = self.target_prefix(target)
+
+        manifest = self.open_sync_state()
+        self.open_journal("pull", manifest)
+        pack_index = self.load_pack_index()
+        path_filter = self.load_path_filter()
+        # without a remote manifest, the file objects are listed
+        self.remote_manifest = None if self.options.full_listing else self.load_remote_manifest()
+        if self.remote_manifest is not None:
+            manifest.remote_generation = self.remote_manifest.generation
+
+        if self.options.retry_failed:
+            # only the files that failed in the last pull, each listed by its own key
+            keys = {
+                object_key for object_key in load_failures(self.dataset_directory, "pull", self.options.shard)
+                if is_under_prefix(object_key, prefix)
+            }
+            listed_files = (
+                remote_file for remote_file in (
+                    self.describe_remote_file(object_key) for object_key in keys if object_key not in pack_index.files
+                )
+                if remote_file is not None
+            )
         else:
-            prefix = target.relative_to(self.dataset_directory).as_posix()
+            keys = None
+            # only list the prefixes that included files can be under
+            listed_files = itertools.chain.from_iterable(
+                self.list_remote_files(list_prefix) for list_prefix in path_filter.list_prefixes(prefix)
+            )
+
+        # the keys of the files in the cloud, which are kept locally when mirroring
+        remote_keys = set()
+
+        def is_pulled(object_key: str) -> bool:
+            pulled = (
+                is_under_prefix(object_key, prefix)
+                and (keys is None or object_key in keys)
+                and (self.options.shard is None or self.options.shard.contains(object_key))
+                and path_filter.matches(object_key)
+                and not self.is_sync_state_file(self.dataset_directory.joinpath(object_key))
+            )
+            if pulled:
+                remote_keys.add(object_key)
+            return pulled
+
+        # packed files are pulled from their shards, which are listed under the internal prefix
+        files = (
+            f for f in listed_files
+            if not f.key.startswith(internal_key_prefix) and f.key not in pack_index.files and is_pulled(f.key)
+        )
+        packed_ranges = split_packed_ranges(pack_index, prefix, self.options.part_size, key_filter=is_pulled)
+
+        try:
+            summary = self.run_downloads(manifest, itertools.chain(files, packed_ranges))
+            # a retry of failed files does not list every file in the cloud, so it deletes nothing
+            if self.options.delete and keys is None:
+                summary.deleted = self.delete_local_files(manifest, path_filter, target, remote_keys)
+            self.update_failures("pull", prefix, summary)
+            return summary
+        finally:
+            self.remote_manifest = None
+            self.close_sync_state(manifest, prune=False)
+            self.close_journal()
 
-        files = self.list_files(prefix)
+    def compare_dataset(self, target: Path) -> StatusSummary:
+        """
+        Compare the local files in the target directory with the file objects in the cloud.
+        The remote files are read from the remote manifest unless full_listing is set, and the state of the local files
+        from the sync state database, with one prefix query for the target. A local file whose stat and remote ETag
+        both match its last sync is unchanged without being read, and the content hash of any other file of the same
+        size as its object is read from the hash cache, so only files that changed since they were last hashed are read.
+        :param target: The absolute path to the target file or directory to be compared.
+        :return: A StatusSummary of the differences.
+        """
+        prefix = self.target_prefix(target)
+        path_filter = self.load_path_filter()
+        pack_index = self.load_pack_index()
+        summary = StatusSummary()
 
-        with ThreadPoolExecutor(max_workers=5) as ex:
-            futures = [
-                ex.submit(
-                    self.download_file, self.client, file, self.dataset_directory, self.container_cloud_name
+        def is_compared(object_key: str) -> bool:
+            return (
+                is_under_prefix(object_key, prefix)
+                and not object_key.startswith(internal_key_prefix)
+                and (self.options.shard is None or self.options.shard.contains(object_key))
+                and path_filter.matches(object_key)
+                # sync state files are at the top of the dataset directory, except partial downloads
+                and not (
+                    ("/" not in object_key or object_key.endswith(partial_download_suffix))
+                    and self.is_sync_state_file(self.dataset_directory.joinpath(object_key))
                 )
-                for file in files
-            ]
+            )
 
-            if len(futures) == 0:
-                raise DataStorageHandlerEmptyFilesException()
+        self.remote_manifest = None if self.options.full_listing else self.load_remote_manifest()
+        try:
+            if self.remote_manifest is not None:
+                summary.remote_generation = self.remote_manifest.generation
+            remote_files = {
+                remote_file.key: remote_file
+                for list_prefix in path_filter.list_prefixes(prefix)
+                for remote_file in self.list_remote_files(list_prefix)
+                if is_compared(remote_file.key)
+            }
+        finally:
+            self.remote_manifest = None
+        # packed files are described by the pack index, with the same ETag as in the sync manifest
+        for object_key, entry in pack_index.files.items():
+            if object_key not in remote_files and is_compared(object_key):
+                remote_files[object_key] = RemoteFile(object_key, entry["length"], entry["md5"], None, {})
 
-            with tqdm(total=len(futures)) as pbar:
-                for future in as_completed(futures):
-                    future.result()
-                    pbar.update(1)
+        if target.is_file():
+            local_files = iter([target])
+        elif target.is_dir():
+            local_files = DirectoryWalker(
+                self.dataset_directory, directory_filter=path_filter.may_contain_matches
+            ).walk(target)
+        else:
+            local_files = iter([])
+
+        state_db = SyncStateDatabase.open(self.dataset_directory, self.options.shard)
+        try:
+            hash_cache = HashCache.load(state_db)
+            manifest = SyncManifest.load(state_db)
+            synced = {
+                object_key: entry
+                for object_key, entry in manifest.list_files(prefix)
+                if is_under_prefix(object_key, prefix)
+            }
+
+            # the files whose content has to be compared by hash, with their stat and remote file
+            unknown = []
+            # the keys are cut out of the paths as strings, which is much faster than with relative_to
+            base_length = len(str(self.dataset_directory.joinpath("x"))) - 1
+            for file_path in local_files:
+                object_key = str(file_path)[base_length:].replace(os.sep, "/")
+                remote_file = remote_files.pop(object_key, None)
+                # the remote files are already filtered
+                if remote_file is None and not is_compared(object_key):
+                    continue
+                try:
+                    stat = file_path.stat()
+                except FileNotFoundError:
+                    continue
+
+                if remote_file is None:
+                    summary.added += 1
+                    summary.added_bytes += stat.st_size
+                    continue
+
+                entry = synced.get(object_key)
+                if (
+                    entry is not None
+                    and entry["size"] == stat.st_size
+                    and entry["mtime"] == stat.st_mtime_ns
+                    and entry["etag"] == remote_file.etag
+                ):
+                    summary.unchanged += 1
+                    continue
+
+                size, md5 = self.describe_content(remote_file)
+                if size != stat.st_size:
+                    summary.modified += 1
+                    summary.modified_bytes += stat.st_size
+                    continue
+                # the last synced content is still in the cloud, if the ETag has not changed since
+                if md5 is None and entry is not None and entry["etag"] == remote_file.etag:
+                    md5 = entry["md5"]
+                unknown.append((file_path, stat, md5))
+
+            def hash_local_file(file: tuple) -> typing.Optional[str]:
+                try:
+                    return hash_cache.hash(file[0], file[1])
+                except OSError:
+                    # a file that cannot be read is reported as modified
+                    return None
+
+            # only the files that changed since they were last hashed are read, on all cores
+            local_md5s = self.map_in_pool(self.thread_pool("hash", os.cpu_count() or 1), hash_local_file, unknown)
+            for (file_path, stat, md5), local_md5 in zip(unknown, local_md5s):
+                if md5 is not None and local_md5 == md5:
+                    summary.unchanged += 1
+                else:
+                    summary.modified += 1
+                    summary.modified_bytes += stat.st_size
+
+            for remote_file in remote_files.values():
+                summary.deleted += 1
+                summary.deleted_bytes += self.describe_content(remote_file)[0]
+
+            hash_cache.save()
+        finally:
+            state_db.close()
+        return summary
+
+    @staticmethod
+    def describe_content(remote_file: RemoteFile) -> typing.Tuple[int, typing.Optional[str]]:
+        """
+        The size and md5 hex digest of the file that an object holds, which differ from those of the object when it is
+        compressed.
+        :param remote_file: The RemoteFile of the object.
+        :return: The size in bytes of the file, and its md5 hex digest, or None if it is not known.
+        """
+        if is_compressed(remote_file.metadata):
+            return int(remote_file.metadata[size_metadata_key]), remote_file.metadata.get(md5_metadata_key)
+        return remote_file.size, remote_file.md5
+
+    def run_downloads(self, manifest: SyncManifest, items: typing.Iterator) -> TransferSummary:
+        """
+        Download the files that differ locally, in a TransferScheduler.
+        :param manifest: The sync manifest of the dataset.
+        :param items: An iterator of the RemoteFiles of files stored as objects of their own, and the PackedRanges of
+        packed files.
+        :return: A TransferSummary of the downloads.
+        """
+        def transfer(item):
+            if isinstance(item, PackedRange):
+                return self.download_packed_range(manifest, item)
+            return self.download_changed_file(manifest, item)
+
+        def item_keys(item):
+            if isinstance(item, PackedRange):
+                return [entry["key"] for entry in item.entries]
+            return [item.key]
+
+        def item_size(item):
+            if isinstance(item, PackedRange):
+                return sum(entry["length"] for entry in item.entries)
+            return item.size
+
+        def file_count(item):
+            return len(item.entries) if isinstance(item, PackedRange) else 1
+
+        return self.run_transfers(items, transfer, item_keys=item_keys, item_size=item_size, file_count=file_count)
+
+    def is_packed_file_unchanged(self, manifest: SyncManifest, entry: dict) -> bool:
+        """
+        Check whether the local copy of a packed file has the content recorded in the pack index.
+        :param manifest: The sync manifest of the dataset.
+        :param entry: The index entry of the packed file, with an added "key".
+        """
+        file_path = self.dataset_directory.joinpath(entry["key"])
+        try:
+            stat = file_path.stat()
+        except FileNotFoundError:
+            return False
+
+        if stat.st_size != entry["length"]:
+            return False
+
+        manifest_entry = manifest.get(entry["key"])
+        if manifest.is_unchanged(entry["key"], stat) and manifest_entry["md5"] == entry["md5"]:
+            return True
+
+        if self.hash_cache.hash(file_path, stat) == entry["md5"]:
+            manifest.record(entry["key"], stat, entry["md5"], None)
+            return True
+        return False
+
+    def download_packed_range(self, manifest: SyncManifest, packed_range: PackedRange) -> TransferSummary:
+        """
+        Download the packed files of a PackedRange that differ locally, fetching runs of them that are next to each
+        other in the shard with a single ranged request.
+        :param manifest: The sync manifest of the dataset.
+        :param packed_range: The PackedRange to download.
+        :return: A TransferSummary of the files in the range.
+        """
+        summary = TransferSummary()
+        needed = [entry for entry in packed_range.entries if not self.is_packed_file_unchanged(manifest, entry)]
+        summary.skipped = len(packed_range.entries) - len(needed)
+
+        for group in coalesce_ranges(needed, self.options.part_size):
+            start = group[0]["offset"]
+            data = self.download_range(packed_range.shard_key, start, group[-1]["offset"] + group[-1]["length"] - start)
+
+            for entry in group:
+                content = data[entry["offset"] - start:entry["offset"] - start + entry["length"]]
+                self.write_packed_file(manifest, entry, content)
+                summary.transferred += 1
+                summary.transferred_bytes += entry["length"]
+
+        return summary
+
+    def write_packed_file(self, manifest: SyncManifest, entry: dict, content: bytes):
+        if hashlib.md5(content).hexdigest() != entry["md5"]:
+            raise DataStorageHandlerCorruptedFileException(entry["key"])
+
+        if "/" in entry["key"]:
+            self.make_dirs(entry["key"], self.dataset_directory)
+        file_path = self.dataset_directory.joinpath(entry["key"])
+        file_path.write_bytes(content)
+        stat = file_path.stat()
+        self.hash_cache.add(stat, entry["md5"])
+        manifest.record(entry["key"], stat, entry["md5"], None)
+
+    def read_packed_file(self, object_key: str, pack_index: PackIndex = None) -> bytes:
+        """
+        Read a single packed file from its shard with a ranged request, without pulling the shard.
+        :param object_key: The key of the packed file.
+        :param pack_index: The PackIndex, downloaded if not given.
+        :return: The content of the file.
+        """
+        if pack_index is None:
+            pack_index = self.load_pack_index()
+
+        entry = pack_index.files[object_key]
+        content = self.download_range(entry["shard"], entry["offset"], entry["length"])
+        if hashlib.md5(content).hexdigest() != entry["md5"]:
+            raise DataStorageHandlerCorruptedFileException(object_key)
+        return content
+
+    def create_snapshot(self, name: typing.Optional[str]) -> typing.Tuple[dict, bool, TransferSummary]:
+        """
+        Record the content of every file in the cloud in a snapshot manifest. The content of each file is copied within
+        the cloud container to a content-addressed object, unless an earlier snapshot already copied the same content,
+        so nothing is downloaded and a snapshot of an unchanged dataset costs no copies at all. Each copy only succeeds
+        if the object still has the ETag it was listed with, checked through its generation on Cloud Storage, so a file
+        replaced by a push in the meantime fails instead of putting other content in a shared content object.
+        :param name: The name of the snapshot, or None.
+        :return: The info of the snapshot, whether it was created, and a TransferSummary of the copies.
+        """
+        self.remote_manifest = None if self.options.full_listing else self.load_remote_manifest()
+        try:
+            pack_index = self.load_pack_index()
+            snapshot = Snapshot()
+            content_keys = {remote_file.key for remote_file in self.list_files_concurrently(content_prefix)}
+            lock = threading.Lock()
+
+            files = (
+                f for f in self.list_remote_files()
+                if not f.key.startswith(internal_key_prefix) and f.key not in pack_index.files
+            )
+            # the shards are copied as a whole, and their packed files point into the copies
+            shard_keys = set()
+            for object_key, entry in pack_index.files.items():
+                snapshot.add_packed_file(object_key, entry, make_shard_content_key(entry["shard"]))
+                shard_keys.add(entry["shard"])
+            shards = (
+                RemoteFile(shard_key, pack_index.shards.get(shard_key, 0), None, None, {})
+                for shard_key in sorted(shard_keys)
+            )
+
+            def copy_content(remote_file: RemoteFile) -> typing.Optional[int]:
+                if remote_file.key.startswith(pack_prefix):
+                    content_key = make_shard_content_key(remote_file.key)
+                else:
+                    if remote_file.metadata is None:
+                        # the listing did not include the metadata, which tells whether the object is compressed
+                        remote_file.metadata = self.get_object_metadata(remote_file.key)
+                    size, md5 = self.describe_content(remote_file)
+                    content_key = make_content_key(md5, is_compressed(remote_file.metadata), remote_file.etag)
+                    snapshot.add_file(remote_file.key, size, md5, content_key, remote_file.size)
+
+                with lock:
+                    if content_key in content_keys:
+                        return None
+                self.copy_object(remote_file, content_key)
+                # only a finished copy is shared, so a retried copy is not skipped
+                with lock:
+                    content_keys.add(content_key)
+                return remote_file.size
+
+            summary = self.run_transfers(
+                itertools.chain(files, shards),
+                copy_content,
+                item_keys=lambda remote_file: [remote_file.key],
+                item_size=lambda remote_file: remote_file.size,
+            )
+        finally:
+            self.remote_manifest = None
+
+        manifest_json = snapshot.to_json()
+        snapshot_id = Snapshot.make_id(manifest_json)
+        existing_info = self.get_object_bytes(info_key(snapshot_id))
+        if existing_info is not None:
+            return json.loads(existing_info.decode()), False, summary
+
+        # the info object is written last, so a snapshot is only listed once its manifest exists
+        info = snapshot.make_info(snapshot_id, name)
+        self.put_object_bytes(manifest_key(snapshot_id), gzip.compress(manifest_json))
+        self.put_object_bytes(info_key(snapshot_id), json.dumps(info).encode())
+        return info, True, summary
+
+    def find_snapshot(self, snapshot_ref: str) -> dict:
+        """
+        Find a snapshot by its id, a prefix of its id, or its name.
+        :param snapshot_ref: The id, prefix or name.
+        :return: The info of the snapshot.
+        """
+        info = self.get_object_bytes(info_key(snapshot_ref)) if "/" not in snapshot_ref else None
+        if info is not None:
+            return json.loads(info.decode())
+
+        infos = self.list_snapshots()
+        matches = [info for info in infos if info["name"] == snapshot_ref]
+        if len(matches) == 0:
+            matches = [info for info in infos if info["id"].startswith(snapshot_ref.lower())]
+        if len(matches) == 0:
+            raise DataStorageHandlerSnapshotNotFoundException(snapshot_ref)
+        if len(matches) > 1:
+            raise DataStorageHandlerAmbiguousSnapshotException(snapshot_ref, [info["id"] for info in matches])
+        return matches[0]
+
+    def checkout_snapshot(self, snapshot_ref: str) -> typing.Tuple[dict, TransferSummary]:
+        """
+        Download the files of a snapshot from their content objects, like a pull of the dataset as it was when the
+        snapshot was created. Only the snapshot manifest is read, and local files that already have the content of the
+        snapshot are skipped, so the cost of a checkout grows with the number of files that differ. As in a pull, only
+        the files of the shard that the include and exclude rules select are checked out.
+        :param snapshot_ref: The id of the snapshot, a prefix of it, or its name.
+        :return: The info of the snapshot, and a TransferSummary of the checkout.
+        """
+        info = self.find_snapshot(snapshot_ref)
+        snapshot = Snapshot.from_bytes(self.get_object_bytes(manifest_key(info["id"])))
+
+        manifest = self.open_sync_state()
+        self.open_journal("pull", manifest)
+        path_filter = self.load_path_filter()
+
+        def is_checked_out(object_key: str) -> bool:
+            return (
+                (self.options.shard is None or self.options.shard.contains(object_key))
+                and path_filter.matches(object_key)
+                and not self.is_sync_state_file(self.dataset_directory.joinpath(object_key))
+            )
+
+        try:
+            files = (remote_file for remote_file in snapshot.remote_files() if is_checked_out(remote_file.key))
+            packed_ranges = split_packed_ranges(
+                snapshot.pack_index(), None, self.options.part_size, key_filter=is_checked_out
+            )
+            summary = self.run_downloads(manifest, itertools.chain(files, packed_ranges))
+            if self.options.delete:
+                summary.deleted = self.delete_local_files(
+                    manifest, path_filter, self.dataset_directory, set(snapshot.files) | set(snapshot.packed)
+                )
+            return info, summary
+        finally:
+            self.close_sync_state(manifest, prune=False)
+            self.close_journal()
@@ -0,0 +1,110 @@
+import os
+import threading
+import typing
+from pathlib import Path
+
+from deploifai.cli.clouds.utilities.data_storage.manifest import hash_file
+from deploifai.cli.clouds.utilities.data_storage.state_db import SyncStateDatabase
+
+"""
+Caches, in the sync state database of the dataset, the content hash of local files so that a file is only read again
+once its stat changes.
+
+Hashes are keyed by the device, inode, size and modification time of the file, so a renamed or moved file keeps its
+cached hash, and a file that is modified in any way misses the cache.
+"""
+
+# added hashes are written to the database in one transaction once this many are pending
+flush_interval = 1000
+
+
+def stat_key(stat: os.stat_result) -> str:
+    return "{}:{}:{}:{}".format(stat.st_dev, stat.st_ino, stat.st_size, stat.st_mtime_ns)
+
+
+class HashCache:
+    """
+    The md5 hex digests of local files by their stat. Safe to use from multiple worker threads. Added hashes are
+    buffered and written to the SyncStateDatabase in bulk.
+    """
+
+    def __init__(self, database: SyncStateDatabase):
+        self.database = database
+        # the hashes added since the last flush
+        self._pending = {}
+        # the keys looked up or added by this run, which are the only ones kept when the cache is pruned
+        self._used = set()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def load(cls, database: SyncStateDatabase) -> "HashCache":
+        """
+        Open the hash cache in the sync state database of a dataset directory.
+        :param database: The SyncStateDatabase of the dataset directory, which is that of the shard when a shard is
+        transferred.
+        """
+        return cls(database)
+
+    def save(self, prune: bool = False):
+        """
+        Write the pending hashes to the database.
+        :param prune: Whether to drop the hashes of files that this run did not see, which is only right after a run
+        over the whole dataset.
+        """
+        with self._lock:
+            with self.database.transaction() as cursor:
+                self._flush(cursor)
+                if prune:
+                    cursor.execute(
+                        "CREATE TEMP TABLE IF NOT EXISTS used_hashes (stat_key TEXT PRIMARY KEY) WITHOUT ROWID"
+                    )
+                    cursor.execute("DELETE FROM used_hashes")
+                    cursor.executemany("INSERT INTO used_hashes (stat_key) VALUES (?)", ((key,) for key in self._used))
+                    cursor.execute("DELETE FROM hashes WHERE stat_key NOT IN (SELECT stat_key FROM used_hashes)")
+                    cursor.execute("DROP TABLE used_hashes")
+
+    def _flush(self, cursor):
+        cursor.executemany("INSERT OR REPLACE INTO hashes (stat_key, md5) VALUES (?, ?)", self._pending.items())
+        self._pending = {}
+
+    def get(self, stat: os.stat_result) -> typing.Optional[str]:
+        key = stat_key(stat)
+        with self._lock:
+            md5 = self._pending.get(key)
+            if md5 is None:
+                row = self.database.query_one("SELECT md5 FROM hashes WHERE stat_key = ?", (key,))
+                md5 = row[0] if row is not None else None
+            if md5 is not None:
+                self._used.add(key)
+        return md5
+
+    def mark_used(self, stat: os.stat_result):
+        """
+        Keep the hash of a file that is still there when the cache is pruned, without looking it up.
+        """
+        with self._lock:
+            self._used.add(stat_key(stat))
+
+    def add(self, stat: os.stat_result, md5: str):
+        """
+        Cache the hash of a file whose content is known without reading it, such as a file that was just downloaded.
+        """
+        key = stat_key(stat)
+        with self._lock:
+            self._used.add(key)
+            self._pending[key] = md5
+            if len(self._pending) >= flush_interval:
+                with self.database.transaction() as cursor:
+                    self._flush(cursor)
+
+    def hash(self, file_path: Path, stat: os.stat_result) -> str:
+        """
+        Get the md5 hex digest of a file, reading the file only if its stat is not in the cache.
+        :param file_path: The absolute path to the file.
+        :param stat: The stat result of the file.
+        """
+        md5 = self.get(stat)
+        if md5 is None:
+            md5 = hash_file(file_path)
+            self.add(stat, md5)
+        return md5
@@ -0,0 +1,222 @@
+import json
+import os
+import threading
+import typing
+from pathlib import Path
+
+from deploifai.cli.clouds.utilities.data_storage.sharding import Shard, state_filename
+
+"""
+Manages a dataset.push.journal or dataset.pull.journal file, stored next to dataset.cfg, that records the progress of
+a push or pull as it happens, so that an interrupted run can be resumed.
+
+Every line of the journal is a json record, appended and flushed as soon as the event happens:
+{"op": "file", "key": string, "entry": manifest entry}                    a file has been transferred
+{"op": "failed", "key": string, "error": string}                          a file has failed with --continue-on-error
+{"op": "upload", "key": string, "upload_id": string, "size": int, "mtime": int, "part_size": int}
+{"op": "part", "key": string, "upload_id": string, "number": int, "part": json}
+{"op": "download", "key": string, "etag": string, "size": int, "part_size": int}
+{"op": "range", "key": string, "etag": string, "index": int}
+{"op": "end", "key": string}                                                 a multipart transfer has finished
+"""
+
+journal_filenames = {
+    "push": "dataset.push.journal",
+    "pull": "dataset.pull.journal",
+}
+
+# ranged downloads are written to a partial file next to their destination, and renamed once complete
+partial_download_suffix = ".deploifai-partial"
+
+# the journal is flushed after every record, and synced to disk after this many records
+sync_interval = 100
+
+
+class TransferJournal:
+    """
+    A crash-safe, append-only record of the progress of a push or pull.
+    """
+
+    def __init__(self, journal_path: Path):
+        self.path = journal_path
+        # the progress of the last run, read when the journal is opened. Records written by this run are only appended
+        # to the file, so the memory held by the journal does not grow with the number of files transferred
+        self.completed_files = {}
+        self.failed_files = {}
+        self.multipart_uploads = {}
+        self.ranged_downloads = {}
+        # the keys of the multipart transfers begun by this run that have not finished yet
+        self._unfinished = set()
+        self._lock = threading.Lock()
+        self._file = None
+        self._unsynced = 0
+
+    @classmethod
+    def open(cls, dataset_directory: Path, direction: str, shard: typing.Optional[Shard] = None) -> "TransferJournal":
+        """
+        Read the journal left by the last push or pull, and open it to record the progress of this one.
+        :param dataset_directory: The absolute directory path of the local dataset.
+        :param direction: Either "push" or "pull".
+        :param shard: The Shard that is transferred, which has a journal of its own, or None for the whole dataset.
+        """
+        journal = cls(dataset_directory.joinpath(state_filename(journal_filenames[direction], shard)))
+        journal._read()
+        journal._file = journal.path.open("a")
+        return journal
+
+    def _read(self):
+        try:
+            with self.path.open("r") as f:
+                lines = f.readlines()
+        except FileNotFoundError:
+            return
+
+        for line in lines:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # the last line is cut short if the process died while writing it
+                continue
+            self._apply(record)
+
+    def _apply(self, record: dict):
+        op = record["op"]
+        key = record["key"]
+        if op == "file":
+            self.completed_files[key] = record["entry"]
+            self.failed_files.pop(key, None)
+        elif op == "failed":
+            self.failed_files[key] = record["error"]
+        elif op == "upload":
+            self.multipart_uploads[key] = dict(record, parts={})
+        elif op == "part":
+            upload = self.multipart_uploads.get(key)
+            if upload is not None and upload["upload_id"] == record["upload_id"]:
+                upload["parts"][record["number"]] = record["part"]
+        elif op == "download":
+            self.ranged_downloads[key] = dict(record, ranges=set())
+        elif op == "range":
+            download = self.ranged_downloads.get(key)
+            if download is not None and download["etag"] == record["etag"]:
+                download["ranges"].add(record["index"])
+        elif op == "end":
+            self.multipart_uploads.pop(key, None)
+            self.ranged_downloads.pop(key, None)
+
+    def _write(self, record: dict):
+        line = json.dumps(record, separators=(",", ":")) + "\n"
+        with self._lock:
+            self._file.write(line)
+            self._file.flush()
+            self._unsynced += 1
+            if self._unsynced >= sync_interval:
+                os.fsync(self._file.fileno())
+                self._unsynced = 0
+
+    def reset(self):
+        """
+        Forget the progress of the last run, to start this one from scratch.
+        """
+        with self._lock:
+            self.completed_files = {}
+            self.failed_files = {}
+            self.multipart_uploads = {}
+            self.ranged_downloads = {}
+            self._unfinished = set()
+            self._file.seek(0)
+            self._file.truncate()
+
+    def close(self):
+        """
+        Close the journal. It is removed unless there are unfinished multipart transfers left to resume, because
+        finished files are saved in the sync manifest by then.
+        """
+        with self._lock:
+            self._file.close()
+        if len(self.multipart_uploads) == 0 and len(self.ranged_downloads) == 0 and len(self._unfinished) == 0:
+            os.remove(str(self.path))
+
+    def record_file(self, object_key: str, entry: dict):
+        """
+        Record that a file has been transferred.
+        :param object_key: The key of the file object in cloud storage.
+        :param entry: The entry of the file in the sync manifest.
+        """
+        self._write({"op": "file", "key": object_key, "entry": entry})
+
+    def record_failure(self, object_key: str, error: str):
+        """
+        Record that a file has failed, and is left for a retry of the failed files.
+        :param object_key: The key of the file object in cloud storage.
+        :param error: The error message.
+        """
+        self._write({"op": "failed", "key": object_key, "error": error})
+
+    def begin_upload(self, object_key: str, upload_id: str, stat: os.stat_result, part_size: int):
+        with self._lock:
+            self._unfinished.add(object_key)
+        self._write({
+            "op": "upload",
+            "key": object_key,
+            "upload_id": upload_id,
+            "size": stat.st_size,
+            "mtime": stat.st_mtime_ns,
+            "part_size": part_size,
+        })
+
+    def record_part(self, object_key: str, upload_id: str, part_number: int, part):
+        """
+        :param part: The json serialisable value returned by upload_part.
+        """
+        self._write({"op": "part", "key": object_key, "upload_id": upload_id, "number": part_number, "part": part})
+
+    def find_upload(self, object_key: str, stat: os.stat_result, part_size: int) -> typing.Optional[dict]:
+        """
+        Find an unfinished multipart upload of a file that can be resumed, because neither the file nor the part size
+        has changed since.
+        :return: The upload record, with the uploaded parts by part number, or None.
+        """
+        upload = self.multipart_uploads.get(object_key)
+        if (
+            upload is not None
+            and upload["size"] == stat.st_size
+            and upload["mtime"] == stat.st_mtime_ns
+            and upload["part_size"] == part_size
+        ):
+            return upload
+        return None
+
+    def begin_download(self, object_key: str, etag: str, size: int, part_size: int):
+        with self._lock:
+            self._unfinished.add(object_key)
+        self._write({"op": "download", "key": object_key, "etag": etag, "size": size, "part_size": part_size})
+
+    def record_range(self, object_key: str, etag: str, index: int):
+        self._write({"op": "range", "key": object_key, "etag": etag, "index": index})
+
+    def find_download(self, object_key: str, etag: str, size: int, part_size: int) -> typing.Optional[dict]:
+        """
+        Find an unfinished ranged download of a file that can be resumed, because neither the object nor the part size
+        has changed since.
+        :return: The download record, with the indexes of the downloaded ranges, or None.
+        """
+        download = self.ranged_downloads.get(object_key)
+        if (
+            download is not None
+            and download["etag"] == etag
+            and download["size"] == size
+            and download["part_size"] == part_size
+        ):
+            return download
+        return None
+
+    def end(self, object_key: str):
+        """
+        Record that a multipart upload or ranged download has finished.
+        """
+        with self._lock:
+            # a transfer resumed from the last run finishes its record as well
+            self._unfinished.discard(object_key)
+            self.multipart_uploads.pop(object_key, None)
+            self.ranged_downloads.pop(object_key, None)
+        self._write({"op": "end", "key": object_key})
@@ -0,0 +1,157 @@
+import queue
+import threading
+import typing
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from deploifai.cli.clouds.utilities.data_storage.remote_file import RemoteFile
+
+default_listing_concurrency = 16
+
+# directories deeper than this are not split any further, whatever their number
+max_discovery_depth = 3
+
+# the number of pages of listed files waiting to be consumed
+listing_queue_size = 64
+
+
+class PrefixPartitionedListing:
+    """
+    Lists the file objects under a prefix with several cursors at a time.
+    Cloud providers only page through a listing sequentially, so the prefixes of the "directories" under the prefix
+    are discovered first, by listing one level at a time with a delimiter until there are enough of them to keep every
+    worker busy, and then every one of them is listed by a worker of its own. The files found by the discovery and the
+    partitions are merged into one stream page by page, so the listing is consumed while it is still running.
+    """
+
+    _sentinel = object()
+
+    def __init__(
+        self,
+        list_directory: typing.Callable[
+            [str], typing.Iterable[typing.Tuple[typing.List[RemoteFile], typing.List[str]]]
+        ],
+        list_prefix: typing.Callable[[str], typing.Iterable[RemoteFile]],
+        executor: ThreadPoolExecutor,
+        concurrency: int = default_listing_concurrency,
+    ):
+        """
+        :param list_directory: Lazily lists one level under a prefix, yielding every page as the RemoteFiles directly
+        under it and the prefixes of its subdirectories in the page.
+        :param list_prefix: Lists every RemoteFile under a prefix.
+        :param executor: The ThreadPoolExecutor of concurrency threads that lists the prefixes. Its threads are kept
+        busy until the listing finishes, so it must not run any other work the consumer of the listing waits for.
+        :param concurrency: The number of prefixes listed at a time.
+        """
+        self.list_directory = list_directory
+        self.list_prefix = list_prefix
+        self.executor = executor
+        self.concurrency = concurrency
+
+    def list(self, prefix: str = "") -> typing.Generator:
+        """
+        Lazily yields the RemoteFiles of all file objects under a prefix, in no particular order.
+        :param prefix: The prefix of the object keys, or an empty string for the whole container.
+        """
+        stop = threading.Event()
+        results = queue.Queue(maxsize=listing_queue_size)
+        futures = []
+
+        try:
+            # the top level is listed by the consumer, so its files are yielded as soon as its first page is read
+            pages = iter(self.list_directory(prefix))
+            files, pending = next(pages, ([], []))
+            for remote_file in files:
+                yield remote_file
+            if len(pending) == 0:
+                # there is nothing to split the listing on, so the rest of it is streamed by a single cursor without the
+                # delimiter, which starts from the beginning again, since a listing cannot be resumed from another
+                next_page = next(pages, None)
+                pages.close()
+                if next_page is None:
+                    return
+                first_page_keys = {remote_file.key for remote_file in files}
+                for remote_file in self.list_prefix(prefix):
+                    if remote_file.key not in first_page_keys:
+                        yield remote_file
+                return
+
+            for files in self._read_level(pages, pending):
+                for remote_file in files:
+                    yield remote_file
+
+            for _ in range(1, max_discovery_depth):
+                if len(pending) >= self.concurrency:
+                    break
+                level = [self.executor.submit(self._list_level, p, results, stop) for p in pending]
+                futures.extend(level)
+                for remote_file in self._merge(results, len(level)):
+                    yield remote_file
+                pending = [subprefix for future in level for subprefix in future.result()]
+                if len(pending) == 0:
+                    break
+
+            for p in pending:
+                futures.append(self.executor.submit(self._list_partition, p, results, stop))
+            for remote_file in self._merge(results, len(pending)):
+                yield remote_file
+        finally:
+            # lets the workers exit when the consumer stops early, or a partition fails, and frees the executor for the
+            # next listing once they have
+            stop.set()
+            wait(futures)
+
+    @staticmethod
+    def _read_level(pages: typing.Iterator, subprefixes: typing.List[str]) -> typing.Generator:
+        for files, page_subprefixes in pages:
+            subprefixes.extend(page_subprefixes)
+            yield files
+
+    def _merge(self, results: queue.Queue, worker_count: int) -> typing.Generator:
+        finished = 0
+        while finished < worker_count:
+            page = results.get()
+            if page is self._sentinel:
+                finished += 1
+            elif isinstance(page, BaseException):
+                raise page
+            else:
+                for remote_file in page:
+                    yield remote_file
+
+    def _list_level(self, prefix: str, results: queue.Queue, stop: threading.Event) -> typing.List[str]:
+        subprefixes = []
+        try:
+            for files in self._read_level(iter(self.list_directory(prefix)), subprefixes):
+                if len(files) > 0 and not self._put(results, files, stop):
+                    return subprefixes
+        except BaseException as err:
+            self._put(results, err, stop)
+            return subprefixes
+        self._put(results, self._sentinel, stop)
+        return subprefixes
+
+    def _list_partition(self, prefix: str, results: queue.Queue, stop: threading.Event):
+        try:
+            page = []
+            for remote_file in self.list_prefix(prefix):
+                page.append(remote_file)
+                if len(page) >= 1000:
+                    if not self._put(results, page, stop):
+                        return
+                    page = []
+            if len(page) > 0 and not self._put(results, page, stop):
+                return
+        except BaseException as err:
+            self._put(results, err, stop)
+            return
+        self._put(results, self._sentinel, stop)
+
+    @staticmethod
+    def _put(results: queue.Queue, item, stop: threading.Event) -> bool:
+        while not stop.is_set():
+            try:
+                results.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
@@ -0,0 +1,203 @@
+import hashlib
+import json
+import os
+import threading
+import typing
+from pathlib import Path
+
+from deploifai.cli.clouds.utilities.data_storage.state_db import SyncStateDatabase
+
+"""
+Records, in the sync state database of the dataset, the state of every file at the time it was last transferred, and
+the state of every directory at the time it was last walked by a push.
+
+The directories are only valid for the include and exclude rules whose fingerprint is the directories_filter.
+"""
+
+# recorded entries are written to the database in one transaction once this many are pending
+flush_interval = 1000
+
+hash_chunk_size = 1024 * 1024
+
+
+def hash_file(file_path: Path) -> str:
+    """
+    Computes the md5 hex digest of a file, reading it in chunks.
+    :param file_path: The absolute path to the file.
+    :return: The md5 hex digest of the file content.
+    """
+    md5 = hashlib.md5()
+    with open(str(file_path), "rb") as f:
+        for chunk in iter(lambda: f.read(hash_chunk_size), b""):
+            md5.update(chunk)
+    return md5.hexdigest()
+
+
+def normalise_etag(etag: typing.Optional[str]) -> typing.Optional[str]:
+    """
+    Strips the quotes that cloud providers put around ETags.
+    """
+    if etag is None:
+        return None
+    return etag.strip('"')
+
+
+class SyncManifest:
+    """
+    The local record of what has been synced between a dataset directory and its cloud container.
+    Entries are keyed by object key and are safe to record from multiple worker threads. They are buffered and written
+    to the SyncStateDatabase in bulk.
+    """
+
+    def __init__(self, database: SyncStateDatabase):
+        self.database = database
+        self.directories = {}
+        self.directories_filter = None
+        # the generation of this push or pull, which the files it records are marked with
+        self.generation = int(database.get_meta("generation") or 0) + 1
+        # the generation of the remote manifest that the dataset was last synced with, or None if it is not known
+        remote_generation = database.get_meta("remote_generation")
+        self.remote_generation = int(remote_generation) if remote_generation is not None else None
+        # a TransferJournal that every recorded entry is also written to as it happens
+        self.journal = None
+        # the entries recorded since the last flush by object key, or None for a removed file
+        self._pending = {}
+        # the directories as they are in the database
+        self._saved_directories = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def load(cls, database: SyncStateDatabase) -> "SyncManifest":
+        """
+        Read the manifest from the sync state database of a dataset directory.
+        :param database: The SyncStateDatabase of the dataset directory, which is that of the shard when a shard is
+        transferred.
+        """
+        manifest = cls(database)
+        for path, mtime, dirs in database.query("SELECT path, mtime, dirs FROM directories"):
+            manifest.directories[path] = {"mtime": mtime, "dirs": json.loads(dirs)}
+        manifest._saved_directories = dict(manifest.directories)
+        manifest.directories_filter = database.get_meta("directories_filter")
+        return manifest
+
+    def save(self):
+        """
+        Write the pending entries, the directories and the generation of this push or pull to the database, in one
+        transaction so an interrupted save leaves the last saved state.
+        """
+        with self._lock:
+            with self.database.transaction() as cursor:
+                self._flush(cursor)
+
+                changed_directories = [
+                    (path, record["mtime"], json.dumps(record["dirs"]))
+                    for path, record in self.directories.items()
+                    if self._saved_directories.get(path) != record
+                ]
+                cursor.executemany(
+                    "INSERT OR REPLACE INTO directories (path, mtime, dirs) VALUES (?, ?, ?)", changed_directories
+                )
+                cursor.executemany(
+                    "DELETE FROM directories WHERE path = ?",
+                    ((path,) for path in self._saved_directories if path not in self.directories),
+                )
+                self._saved_directories = dict(self.directories)
+
+                self.database.set_meta("directories_filter", self.directories_filter)
+                self.database.set_meta("generation", self.generation)
+                self.database.set_meta("remote_generation", self.remote_generation)
+
+    def _flush(self, cursor):
+        cursor.executemany(
+            "INSERT OR REPLACE INTO files (key, size, mtime, md5, etag, generation) VALUES (?, ?, ?, ?, ?, ?)",
+            (
+                (object_key, entry["size"], entry["mtime"], entry["md5"], entry["etag"], self.generation)
+                for object_key, entry in self._pending.items()
+                if entry is not None
+            ),
+        )
+        cursor.executemany(
+            "DELETE FROM files WHERE key = ?",
+            ((object_key,) for object_key, entry in self._pending.items() if entry is None),
+        )
+        self._pending = {}
+
+    def _write(self, entries: dict):
+        with self._lock:
+            self._pending.update(entries)
+            if len(self._pending) >= flush_interval:
+                with self.database.transaction() as cursor:
+                    self._flush(cursor)
+
+    def get(self, object_key: str) -> typing.Optional[dict]:
+        with self._lock:
+            if object_key in self._pending:
+                return self._pending[object_key]
+            row = self.database.query_one("SELECT size, mtime, md5, etag FROM files WHERE key = ?", (object_key,))
+        if row is None:
+            return None
+        return {"size": row[0], "mtime": row[1], "md5": row[2], "etag": row[3]}
+
+    def list_files(self, prefix: typing.Optional[str] = None) -> typing.Generator:
+        """
+        Lazily yields the entries of the synced files under a prefix, in the order of their keys, with a range query on
+        the primary key index of the database.
+        :param prefix: The prefix of the object keys, or None for every file.
+        :return: A generator of (object key, entry) tuples, whose entries also have the generation of their last sync.
+        """
+        with self._lock:
+            with self.database.transaction() as cursor:
+                self._flush(cursor)
+        for object_key, size, mtime, md5, etag, generation in self.database.query_prefix(
+            "files", "key, size, mtime, md5, etag, generation", "key", prefix
+        ):
+            yield object_key, {"size": size, "mtime": mtime, "md5": md5, "etag": etag, "generation": generation}
+
+    def record(self, object_key: str, stat: os.stat_result, md5: str, etag: typing.Optional[str]):
+        """
+        Record the state of a file that has just been transferred.
+        :param object_key: The key of the file object in cloud storage.
+        :param stat: The stat result of the local file after the transfer.
+        :param md5: The md5 hex digest of the file content.
+        :param etag: The ETag of the object in cloud storage.
+        """
+        entry = {
+            "size": stat.st_size,
+            "mtime": stat.st_mtime_ns,
+            "md5": md5,
+            "etag": normalise_etag(etag),
+        }
+        self._write({object_key: entry})
+        if self.journal is not None:
+            self.journal.record_file(object_key, entry)
+
+    def update(self, entries: dict):
+        """
+        Add entries recorded elsewhere, such as in the journal of an interrupted run.
+        :param entries: The manifest entries by object key.
+        """
+        self._write(entries)
+
+    def remove(self, object_keys: typing.Iterable[str]):
+        """
+        Forget files that have been deleted.
+        :param object_keys: The keys of the deleted files.
+        """
+        self._write({object_key: None for object_key in object_keys})
+
+    def is_unchanged(self, object_key: str, stat: os.stat_result) -> bool:
+        """
+        Check whether a local file still has the size and modification time recorded at its last sync.
+        """
+        return self.entry_matches_stat(self.get(object_key), stat)
+
+    @staticmethod
+    def entry_matches_stat(entry: typing.Optional[dict], stat: os.stat_result) -> bool:
+        """
+        Check whether an entry of the manifest records the size and modification time of a local file.
+        """
+        return (
+            entry is not None
+            and entry["size"] == stat.st_size
+            and entry["mtime"] == stat.st_mtime_ns
+        )
@@ -0,0 +1,122 @@
+import typing
+
+from deploifai.cli.clouds.utilities.data_storage.compression import default_compression_level
+from deploifai.cli.clouds.utilities.data_storage.concurrency import (
+    ConcurrencyController,
+    default_concurrency,
+    default_max_concurrency,
+)
+from deploifai.cli.clouds.utilities.data_storage.listing import default_listing_concurrency
+from deploifai.cli.clouds.utilities.data_storage.packing import default_pack_threshold, default_shard_size
+from deploifai.cli.clouds.utilities.data_storage.sharding import Shard
+
+default_part_size = 32 * 1024 * 1024
+
+default_part_concurrency = 8
+
+default_multipart_threshold = 100 * 1024 * 1024
+
+default_retries = 8
+
+default_large_file_concurrency = 2
+
+
+class TransferOptions:
+    """
+    Options of a dataset push or pull, usually set from the command line.
+    """
+
+    def __init__(
+        self,
+        concurrency: typing.Optional[int] = None,
+        max_concurrency: typing.Optional[int] = None,
+        part_size: int = default_part_size,
+        part_concurrency: int = default_part_concurrency,
+        large_file_concurrency: int = default_large_file_concurrency,
+        multipart_threshold: int = default_multipart_threshold,
+        pack: bool = False,
+        pack_threshold: int = default_pack_threshold,
+        shard_size: int = default_shard_size,
+        resume: bool = False,
+        retries: int = default_retries,
+        continue_on_error: bool = False,
+        retry_failed: bool = False,
+        skip_unchanged_directories: bool = False,
+        include: typing.Sequence[str] = (),
+        exclude: typing.Sequence[str] = (),
+        delete: bool = False,
+        shard: typing.Optional[Shard] = None,
+        processes: typing.Optional[int] = None,
+        compress: bool = False,
+        compression_level: int = default_compression_level,
+        full_listing: bool = False,
+        listing_concurrency: int = default_listing_concurrency,
+    ):
+        """
+        :param concurrency: The number of concurrent transfers. Fixed, unless max_concurrency is also given.
+        :param max_concurrency: The upper limit of concurrent transfers, tuned adaptively up to it.
+        :param part_size: The size in bytes of the parts that large files are split into.
+        :param part_concurrency: The number of parts of a large file that are transferred in parallel.
+        :param large_file_concurrency: The number of large files transferred at a time, in a lane of their own.
+        :param multipart_threshold: The size in bytes from which a file is transferred in parts.
+        :param pack: Whether to push small files packed into shard objects, instead of as objects of their own.
+        :param pack_threshold: The size in bytes below which a file is packed.
+        :param shard_size: The size in bytes from which a shard of packed files is uploaded.
+        :param resume: Whether to continue the multipart transfers of an interrupted run, instead of discarding them.
+        :param retries: The number of times a file is retried after a throttling or transient error.
+        :param continue_on_error: Whether to carry on with the other files when a file fails, and list it in the
+        failures file, instead of stopping the run.
+        :param retry_failed: Whether to transfer only the files listed in the failures file of the last run.
+        :param skip_unchanged_directories: Whether to skip the files of directories whose modification time is unchanged
+        since the last push, without listing them.
+        :param include: The patterns of the only files to transfer, or none to transfer every file that is not excluded.
+        :param exclude: The patterns of files to exclude, on top of the rules in the .deploifaiignore file.
+        :param delete: Whether to delete the files in the destination that do not exist in the source, so the
+        destination mirrors the source.
+        :param shard: The only Shard of the dataset to transfer, or None to transfer the whole dataset.
+        :param processes: The number of worker processes that hash and transfer the files below the multipart
+        threshold, or None to transfer every file in the threads of this process.
+        :param compress: Whether to upload files gzip compressed, unless they are already compressed.
+        :param compression_level: The gzip compression level of compressed uploads.
+        :param full_listing: Whether to list the file objects in the container, instead of reading the remote manifest.
+        A push then rebuilds the remote manifest from the listing.
+        :param listing_concurrency: The number of prefixes of the container listed at a time.
+        """
+        self.concurrency = concurrency
+        self.max_concurrency = max_concurrency
+        self.part_size = part_size
+        self.part_concurrency = part_concurrency
+        self.large_file_concurrency = large_file_concurrency
+        self.multipart_threshold = multipart_threshold
+        self.pack = pack
+        self.pack_threshold = pack_threshold
+        self.shard_size = shard_size
+        self.resume = resume
+        self.retries = retries
+        self.continue_on_error = continue_on_error
+        self.retry_failed = retry_failed
+        self.skip_unchanged_directories = skip_unchanged_directories
+        self.include = include
+        self.exclude = exclude
+        self.delete = delete
+        self.shard = shard
+        self.processes = processes
+        self.compress = compress
+        self.compression_level = compression_level
+        self.full_listing = full_listing
+        self.listing_concurrency = listing_concurrency
+
+    def create_concurrency_controller(self) -> ConcurrencyController:
+        if self.concurrency is not None and self.max_concurrency is None:
+            return ConcurrencyController(initial=self.concurrency, maximum=self.concurrency, adaptive=False)
+
+        return ConcurrencyController(
+            initial=self.concurrency if self.concurrency is not None else default_concurrency,
+            maximum=self.max_concurrency if self.max_concurrency is not None else default_max_concurrency,
+        )
+
+    def create_large_file_controller(self) -> ConcurrencyController:
+        # large files already transfer their parts in parallel, so their own concurrency is not tuned
+        return ConcurrencyController(
+            initial=self.large_file_concurrency, maximum=self.large_file_concurrency, adaptive=False
+        )
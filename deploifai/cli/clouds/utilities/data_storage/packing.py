@@ -0,0 +1,297 @@
+import gzip
+import hashlib
+import io
+import json
+import os
+import tarfile
+import tempfile
+import threading
+import typing
+import uuid
+from pathlib import Path
+
+from deploifai.cli.clouds.utilities.data_storage.remote_file import internal_key_prefix, is_under_prefix
+
+"""
+Packs small files of a dataset into large tar shard objects, so that pushing and pulling millions of tiny files costs
+one request per shard instead of one per file.
+
+The index object maps each packed file to the byte range of its content in a shard:
+{
+    "version": 1,
+    "files": {
+        object_key: {"shard": string, "offset": int, "length": int, "md5": string}
+    },
+    "shards": {shard_key: int}
+}
+"""
+
+pack_prefix = internal_key_prefix + "packs/"
+
+index_key = pack_prefix + "index.json.gz"
+
+index_version = 1
+
+default_pack_threshold = 1024 * 1024
+
+default_shard_size = 256 * 1024 * 1024
+
+
+class PackIndex:
+    """
+    The index of the files packed into shards, stored as a gzipped json object in the cloud container.
+    """
+
+    def __init__(self):
+        self.files = {}
+        self.shards = {}
+        self.changed = False
+        # the shards and files added, and the keys of the files removed, since the index was loaded
+        self.added_shards = {}
+        self.added = {}
+        self.removed = set()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_bytes(cls, data: typing.Optional[bytes]) -> "PackIndex":
+        """
+        :param data: The content of the index object, or None if there is no index object yet.
+        """
+        index = cls()
+        if data is None:
+            return index
+
+        content = json.loads(gzip.decompress(data).decode())
+        if content.get("version") == index_version:
+            index.files = content.get("files", {})
+            index.shards = content.get("shards", {})
+        return index
+
+    def to_bytes(self) -> bytes:
+        with self._lock:
+            self._remove_unreferenced_shards()
+            content = {"version": index_version, "files": self.files, "shards": self.shards}
+            return gzip.compress(json.dumps(content, separators=(",", ":")).encode())
+
+    def add_shard(self, shard_key: str, shard_size: int, members: typing.List[dict]):
+        """
+        Record the files of a shard that has been uploaded.
+        :param shard_key: The key of the shard object in cloud storage.
+        :param shard_size: The size of the shard object in bytes.
+        :param members: The files in the shard, each a dict with the key, offset, length and md5 of the file.
+        """
+        with self._lock:
+            self.shards[shard_key] = shard_size
+            self.added_shards[shard_key] = shard_size
+            for member in members:
+                entry = {
+                    "shard": shard_key,
+                    "offset": member["offset"],
+                    "length": member["length"],
+                    "md5": member["md5"],
+                }
+                self.files[member["key"]] = entry
+                self.added[member["key"]] = entry
+                self.removed.discard(member["key"])
+            self.changed = True
+
+    def remove(self, object_key: str):
+        """
+        Remove a file from the index, when it has been uploaded as an object of its own.
+        """
+        with self._lock:
+            if object_key in self.files:
+                del self.files[object_key]
+                self.added.pop(object_key, None)
+                self.removed.add(object_key)
+                self.changed = True
+
+    def rebase(self, latest: "PackIndex") -> "PackIndex":
+        """
+        Apply the changes made to this index since it was loaded to the index saved by another push in the meantime,
+        such as the push of another shard of the dataset. This index is left as it is, so it can be rebased again.
+        :param latest: The index in the container now.
+        :return: The index to save.
+        """
+        with self._lock:
+            latest.shards.update(self.added_shards)
+            for object_key, entry in self.added.items():
+                latest.files[object_key] = entry
+            for object_key in self.removed:
+                latest.files.pop(object_key, None)
+        return latest
+
+    def _remove_unreferenced_shards(self):
+        referenced = set(entry["shard"] for entry in self.files.values())
+        self.shards = {key: size for key, size in self.shards.items() if key in referenced}
+
+
+class PackWriter:
+    """
+    Appends small files to a local tar shard, and hands every shard that reaches the shard size over to be uploaded.
+    Files can be added from several worker threads. Sealed shards are uploaded by the thread that filled them, without
+    holding up the other threads.
+    """
+
+    def __init__(self, upload_shard: typing.Callable, shard_size: int = default_shard_size):
+        """
+        :param upload_shard: Called with the path of a sealed shard file, its object key, and its members, each a dict
+        with the key, offset, length, md5 and stat of a file. It retries the upload itself, and returns the outcome of
+        the upload for every member of the shard, so the members are never uploaded again by a retry of the file that
+        happened to fill the shard.
+        :param shard_size: The size in bytes from which a shard is sealed and uploaded.
+        """
+        self.upload_shard = upload_shard
+        self.shard_size = shard_size
+        self._lock = threading.Lock()
+        self._shard = None
+
+    def add(self, file_path: Path, object_key: str, stat: os.stat_result):
+        """
+        Add a file to the current shard.
+        :param file_path: The absolute path to the file.
+        :param object_key: The key the file would have as an object of its own.
+        :param stat: The stat result of the file, recorded in the sync manifest once the shard is uploaded.
+        :return: What upload_shard returned, if the file filled the shard, or None.
+        """
+        # read the whole file, which is small, so the content packed is exactly the content hashed
+        data = file_path.read_bytes()
+        info = tarfile.TarInfo(name=object_key)
+        info.size = len(data)
+        info.mtime = int(stat.st_mtime)
+
+        sealed = None
+        with self._lock:
+            if self._shard is None:
+                self._shard = _Shard()
+            self._shard.add(info, data, stat)
+            if self._shard.size() >= self.shard_size:
+                sealed = self._shard
+                self._shard = None
+
+        if sealed is not None:
+            return self._upload(sealed)
+        return None
+
+    def close(self):
+        """
+        Seal and upload the last shard.
+        :return: What upload_shard returned, or None if there was no shard left.
+        """
+        with self._lock:
+            sealed = self._shard
+            self._shard = None
+
+        if sealed is not None:
+            return self._upload(sealed)
+        return None
+
+    def discard(self):
+        """
+        Throw away the shard that is being filled, when the push failed.
+        """
+        with self._lock:
+            if self._shard is not None:
+                self._shard.close()
+                os.remove(self._shard.path)
+                self._shard = None
+
+    def _upload(self, shard: "_Shard"):
+        shard.close()
+        try:
+            return self.upload_shard(Path(shard.path), pack_prefix + "{}.tar".format(uuid.uuid4().hex), shard.members)
+        finally:
+            # upload_shard has either uploaded the shard or given up on it for good after its own retries, and the
+            # members of a failed shard are packed again from their files by the next push
+            os.remove(shard.path)
+
+
+class _Shard:
+    def __init__(self):
+        handle, self.path = tempfile.mkstemp(suffix=".tar", prefix="deploifai-pack-")
+        self._file = os.fdopen(handle, "wb")
+        self._tar = tarfile.open(fileobj=self._file, mode="w", format=tarfile.PAX_FORMAT)
+        self.members = []
+
+    def add(self, info: tarfile.TarInfo, data: bytes, stat: os.stat_result):
+        # the content of a member starts right after its header
+        header = info.tobuf(self._tar.format, self._tar.encoding, self._tar.errors)
+        offset = self._tar.offset + len(header)
+        self._tar.addfile(info, io.BytesIO(data))
+        self.members.append({
+            "key": info.name,
+            "offset": offset,
+            "length": info.size,
+            "md5": hashlib.md5(data).hexdigest(),
+            "stat": stat,
+        })
+
+    def size(self) -> int:
+        return self._tar.offset
+
+    def close(self):
+        self._tar.close()
+        self._file.close()
+
+
+class PackedRange:
+    """
+    A run of packed files that are next to each other in a shard, pulled together as one transfer.
+    """
+
+    def __init__(self, shard_key: str, entries: typing.List[dict]):
+        """
+        :param shard_key: The key of the shard object in cloud storage.
+        :param entries: The index entries of the files, each with an added "key", ordered by offset.
+        """
+        self.shard_key = shard_key
+        self.entries = entries
+
+
+def split_packed_ranges(
+    index: PackIndex,
+    prefix: typing.Optional[str],
+    max_length: int,
+    key_filter: typing.Optional[typing.Callable[[str], bool]] = None,
+) -> typing.Generator:
+    """
+    Yields the packed files under a prefix as PackedRanges that each span at most the maximum length of a shard.
+    :param index: The PackIndex.
+    :param prefix: The key of the target file or directory, or None for all files.
+    :param max_length: The maximum number of bytes of a shard spanned by a PackedRange.
+    :param key_filter: Returns whether to yield a file, given its key, or None to yield all files under the prefix.
+    """
+    entries_by_shard = {}
+    for key, entry in index.files.items():
+        if is_under_prefix(key, prefix) and (key_filter is None or key_filter(key)):
+            entries_by_shard.setdefault(entry["shard"], []).append(dict(entry, key=key))
+
+    for shard_key, entries in entries_by_shard.items():
+        entries.sort(key=lambda e: e["offset"])
+        start = 0
+        for i in range(1, len(entries) + 1):
+            if i == len(entries) or entries[i]["offset"] + entries[i]["length"] - entries[start]["offset"] > max_length:
+                yield PackedRange(shard_key, entries[start:i])
+                start = i
+
+
+def coalesce_ranges(entries: typing.List[dict], max_length: int, max_gap: int = 1024 * 1024) -> typing.List[list]:
+    """
+    Group the index entries of files in the same shard into byte ranges that can each be fetched with one request.
+    Entries are merged while the gap between them is small and the merged range stays below the maximum length.
+    :param entries: The index entries of files in one shard, each with an added "key".
+    :param max_length: The maximum length in bytes of a merged range.
+    :param max_gap: The maximum number of unneeded bytes fetched between two entries.
+    :return: Lists of entries, each covering one byte range.
+    """
+    groups = []
+    for entry in sorted(entries, key=lambda e: e["offset"]):
+        if len(groups) > 0:
+            group = groups[-1]
+            start = group[0]["offset"]
+            end = group[-1]["offset"] + group[-1]["length"]
+            if entry["offset"] - end <= max_gap and entry["offset"] + entry["length"] - start <= max_length:
+                group.append(entry)
+                continue
+        groups.append([entry])
+    return groups
@@ -0,0 +1,254 @@
+import itertools
+import queue
+import threading
+import typing
+
+from deploifai.cli.clouds.utilities.data_storage.concurrency import ConcurrencyController
+
+default_queue_size = 1000
+
+
+class TransferPipeline:
+    """
+    Runs a transfer function over a stream of items with a pool of worker threads.
+    The calling thread produces items into a bounded queue while the workers consume them, so walking a directory or
+    listing a container overlaps with the transfers, and memory use does not grow with the number of items.
+    A worker is started for every slot the ConcurrencyController may allow, and each one holds a slot while it
+    transfers an item.
+    """
+
+    _sentinel = object()
+
+    def __init__(
+        self,
+        controller: ConcurrencyController,
+        queue_size: int = default_queue_size,
+        priority: typing.Callable = None,
+        stop_event: threading.Event = None,
+    ):
+        """
+        :param controller: The ConcurrencyController that decides how many transfers run at the same time.
+        :param queue_size: The maximum number of items waiting in the queue for a worker.
+        :param priority: Returns the priority of an item. Workers take the queued item with the highest priority first,
+        instead of the oldest one.
+        :param stop_event: An event shared with other pipelines that should stop together with this one.
+        """
+        self.controller = controller
+        self.worker_count = controller.maximum
+        self.priority = priority
+        if priority is None:
+            self.queue = queue.Queue(maxsize=queue_size)
+        else:
+            self.queue = queue.PriorityQueue(maxsize=queue_size)
+        self.lock = threading.Lock()
+        self._stop = stop_event or threading.Event()
+        self._errors = []
+        self._workers = []
+        # breaks ties between items of the same priority in the order they were queued
+        self._sequence = itertools.count()
+
+    @property
+    def stopped(self) -> bool:
+        return self._stop.is_set()
+
+    def run(
+        self,
+        items: typing.Iterable,
+        transfer: typing.Callable,
+        on_produced: typing.Callable = None,
+        on_done: typing.Callable = None,
+    ) -> int:
+        """
+        Transfer every item, stopping at the first error.
+        :param items: An iterable, usually a generator, of the items to transfer.
+        :param transfer: The function called by a worker thread with each item.
+        :param on_produced: Called with each item when it is queued.
+        :param on_done: Called with each item and the return value of transfer when it is done.
+        :return: The number of items produced.
+        """
+        self.start(transfer, on_done)
+
+        produced = 0
+        try:
+            for item in items:
+                if not self.put(item):
+                    break
+                produced += 1
+                if on_produced is not None:
+                    with self.lock:
+                        on_produced(item)
+        except BaseException:
+            self.stop()
+            raise
+        finally:
+            self.finish()
+
+        return produced
+
+    def start(self, transfer: typing.Callable, on_done: typing.Callable = None):
+        """
+        Start the worker threads, which transfer the items put in the queue until finish is called.
+        """
+        self._workers = [
+            threading.Thread(target=self._work, args=(transfer, on_done), daemon=True)
+            for _ in range(self.worker_count)
+        ]
+        for worker in self._workers:
+            worker.start()
+
+    def put(self, item) -> bool:
+        """
+        Queue an item for the workers, waiting for space unless the pipeline has been stopped.
+        :return: False if the pipeline was stopped before the item was queued.
+        """
+        if self.priority is None:
+            return self._put(item)
+        # the queue returns the lowest entry first, and sentinels go after every item
+        return self._put((0, -self.priority(item), next(self._sequence), item))
+
+    def stop(self):
+        self._stop.set()
+
+    def finish(self):
+        """
+        Wait for the workers to transfer the queued items and exit, and raise the first error of a transfer.
+        """
+        for _ in self._workers:
+            sentinel = self._sentinel if self.priority is None else (1, 0, next(self._sequence), self._sentinel)
+            if not self._put(sentinel):
+                break
+        for worker in self._workers:
+            worker.join()
+
+        if len(self._errors) > 0:
+            raise self._errors[0]
+
+    def _put(self, item) -> bool:
+        while not self._stop.is_set():
+            try:
+                self.queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def _work(self, transfer: typing.Callable, on_done: typing.Callable):
+        while not self._stop.is_set():
+            if not self.controller.acquire(timeout=0.1):
+                continue
+
+            try:
+                if not self._work_one(transfer, on_done):
+                    return
+            finally:
+                self.controller.release()
+
+    def _work_one(self, transfer: typing.Callable, on_done: typing.Callable) -> bool:
+        """
+        Transfer the next item in the queue, if there is one.
+        :return: False if the worker should exit.
+        """
+        try:
+            item = self.queue.get(timeout=0.1)
+        except queue.Empty:
+            return True
+        if self.priority is not None:
+            item = item[-1]
+        if item is self._sentinel:
+            return False
+
+        try:
+            result = transfer(item)
+        except BaseException as err:
+            with self.lock:
+                self._errors.append(err)
+            self._stop.set()
+            return False
+
+        if on_done is not None:
+            with self.lock:
+                on_done(item, result)
+        return True
+
+
+class TransferScheduler:
+    """
+    Routes items by size into two TransferPipelines: a small-file lane that runs many transfers at a time, and a
+    large-file lane that runs a few transfers at a time, each of which transfers parts of its file in parallel.
+    Small files never wait behind large ones, and the large-file lane starts with the largest file it has been given,
+    so that the largest files do not finish last.
+    """
+
+    def __init__(
+        self,
+        small_controller: ConcurrencyController,
+        large_controller: ConcurrencyController,
+        item_size: typing.Callable,
+        large_size: int,
+        queue_size: int = default_queue_size,
+    ):
+        """
+        :param small_controller: The ConcurrencyController of the small-file lane.
+        :param large_controller: The ConcurrencyController of the large-file lane.
+        :param item_size: Returns the size in bytes of an item.
+        :param large_size: The size in bytes from which an item goes to the large-file lane.
+        :param queue_size: The maximum number of items waiting in the queue of each lane.
+        """
+        self.item_size = item_size
+        self.large_size = large_size
+        # an error in either lane stops both
+        stop_event = threading.Event()
+        self.small_lane = TransferPipeline(small_controller, queue_size=queue_size, stop_event=stop_event)
+        self.large_lane = TransferPipeline(
+            large_controller, queue_size=queue_size, priority=item_size, stop_event=stop_event
+        )
+        self.lock = threading.Lock()
+
+    def is_large(self, item) -> bool:
+        return self.item_size(item) >= self.large_size
+
+    def run(
+        self,
+        items: typing.Iterable,
+        small_transfer: typing.Callable,
+        large_transfer: typing.Callable,
+        on_produced: typing.Callable = None,
+        on_done: typing.Callable = None,
+    ) -> int:
+        """
+        Transfer every item in its lane, stopping at the first error.
+        :param items: An iterable, usually a generator, of the items to transfer.
+        :param small_transfer: The function called by a worker thread of the small-file lane with each item.
+        :param large_transfer: The function called by a worker thread of the large-file lane with each item.
+        :param on_produced: Called with each item when it is queued.
+        :param on_done: Called with each item and the return value of transfer when it is done, from either lane.
+        :return: The number of items produced.
+        """
+        def on_done_in_lane(item, result):
+            if on_done is not None:
+                with self.lock:
+                    on_done(item, result)
+
+        self.small_lane.start(small_transfer, on_done_in_lane)
+        self.large_lane.start(large_transfer, on_done_in_lane)
+
+        produced = 0
+        try:
+            for item in items:
+                lane = self.large_lane if self.is_large(item) else self.small_lane
+                if not lane.put(item):
+                    break
+                produced += 1
+                if on_produced is not None:
+                    with self.lock:
+                        on_produced(item)
+        except BaseException:
+            self.small_lane.stop()
+            raise
+        finally:
+            try:
+                self.small_lane.finish()
+            finally:
+                self.large_lane.finish()
+
+        return produced
@@ -0,0 +1,90 @@
+import multiprocessing
+import typing
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from deploifai.cli.clouds.utilities.data_storage.manifest import hash_file
+from deploifai.cli.clouds.utilities.data_storage.remote_file import RemoteFile
+
+"""
+Runs the CPU-bound part of file transfers, which is hashing the content and the TLS encryption of the requests, in a
+pool of worker processes, so that a transfer is not limited to the one core that the threads of a process share.
+
+Every worker process builds a data storage handler of its own, of the same class as the handler of the parent process,
+from the data storage info returned by the API, so no SDK client is shared between processes. The parent process keeps
+the sync state files and the progress bar, and the workers only return the results of their transfers to it.
+"""
+
+# the handler of a worker process, built once by init_worker
+_worker_handler = None
+
+
+def init_worker(handler_class: type, dataset_id: str, storage_info: dict, dataset_directory: Path, options):
+    global _worker_handler
+    handler = handler_class(None, dataset_id, storage_info)
+    handler.dataset_directory = dataset_directory
+    handler.options = options
+    _worker_handler = handler
+
+
+def upload_in_worker(
+    file_path: Path, object_key: str, md5: typing.Optional[str], synced_md5: typing.Optional[str]
+) -> typing.Tuple[str, typing.Optional[RemoteFile]]:
+    if md5 is None:
+        md5 = hash_file(file_path)
+    if md5 == synced_md5:
+        return md5, None
+    return md5, _worker_handler.upload_object(file_path, object_key, md5)
+
+
+def download_in_worker(remote_file: RemoteFile) -> str:
+    md5 = _worker_handler.download_small_file(remote_file)
+    if md5 is not None:
+        return md5
+    return hash_file(_worker_handler.dataset_directory.joinpath(remote_file.key))
+
+
+class ProcessTransferPool:
+    """
+    A pool of worker processes that upload and download files for the worker threads of a TransferScheduler.
+    A worker thread submits its file to the pool and waits for the result, so the number of files in flight is still
+    decided by the ConcurrencyController, and errors are retried by the thread like any other transfer error.
+    """
+
+    def __init__(self, handler, processes: int):
+        """
+        :param handler: The DataStorageHandler of the parent process, which the worker processes are built like.
+        :param processes: The number of worker processes.
+        """
+        self.executor = ProcessPoolExecutor(
+            max_workers=processes,
+            # forking a process while other threads hold locks, or with the connections of SDK clients, is unsafe
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=init_worker,
+            initargs=(type(handler), handler.id, handler.storage_info, handler.dataset_directory, handler.options),
+        )
+
+    def upload_file(
+        self, file_path: Path, object_key: str, md5: typing.Optional[str], synced_md5: typing.Optional[str]
+    ) -> typing.Tuple[str, typing.Optional[RemoteFile]]:
+        """
+        Hash a file and upload it if its content differs from the last synced content.
+        :param file_path: The absolute file path to upload.
+        :param object_key: The key of the file object in cloud storage.
+        :param md5: The md5 hex digest of the file from the hash cache, or None to hash the file.
+        :param synced_md5: The md5 hex digest of the file in the sync manifest, or None if it was never synced.
+        :return: The md5 hex digest of the file, and the RemoteFile of the uploaded object, or None if it was not
+        uploaded.
+        """
+        return self.executor.submit(upload_in_worker, file_path, object_key, md5, synced_md5).result()
+
+    def download_file(self, remote_file: RemoteFile) -> str:
+        """
+        Download a file, decompressing it if needed, and hash it unless its md5 is known.
+        :param remote_file: The RemoteFile to download.
+        :return: The md5 hex digest of the file.
+        """
+        return self.executor.submit(download_in_worker, remote_file).result()
+
+    def shutdown(self):
+        self.executor.shutdown()
@@ -0,0 +1,65 @@
+import base64
+import binascii
+import typing
+
+# objects that the CLI keeps in the cloud container for itself are stored under this prefix, and are never pulled
+internal_key_prefix = ".deploifai/"
+
+
+def is_under_prefix(object_key: str, prefix: typing.Optional[str]) -> bool:
+    """
+    Check whether an object is the target file, or a file in the target directory, of a push or pull.
+    :param object_key: The key of the object.
+    :param prefix: The key of the target, without a trailing /, or None for the whole dataset.
+    """
+    return prefix is None or object_key == prefix or object_key.startswith(prefix + "/")
+
+
+def base64_md5_to_hex(md5: typing.Union[str, bytes, bytearray, None]) -> typing.Optional[str]:
+    """
+    Converts an md5 digest reported by a cloud provider into the hex digest used in the sync manifest.
+    :param md5: The md5 digest, either base64 encoded or raw bytes.
+    """
+    if not md5:
+        return None
+    if isinstance(md5, str):
+        try:
+            md5 = base64.b64decode(md5)
+        except binascii.Error:
+            return None
+    return binascii.hexlify(bytes(md5)).decode()
+
+
+class RemoteFile:
+    """
+    The properties of a file object in cloud storage that are needed to decide whether it has to be transferred.
+    """
+
+    def __init__(
+        self,
+        key: str,
+        size: int,
+        md5: typing.Optional[str],
+        etag: typing.Optional[str],
+        metadata: typing.Optional[dict] = None,
+        content_key: typing.Optional[str] = None,
+        generation: typing.Optional[int] = None,
+    ):
+        """
+        :param key: The key of the file object in cloud storage.
+        :param size: The size of the file object in bytes.
+        :param md5: The md5 hex digest of the content, if the cloud provider reports it.
+        :param etag: The ETag of the file object, without quotes.
+        :param metadata: The user metadata of the file object, if the listing of the cloud provider includes it.
+        :param content_key: The key of the object that holds the content of the file, if it is not the file object
+        itself, such as the content-addressed object of a file in a snapshot.
+        :param generation: The generation of the file object, on cloud providers that version the content of objects
+        by generation and check preconditions on it instead of on the ETag, if the listing includes it.
+        """
+        self.key = key
+        self.size = size
+        self.md5 = md5
+        self.etag = etag
+        self.metadata = metadata
+        self.content_key = content_key if content_key is not None else key
+        self.generation = generation
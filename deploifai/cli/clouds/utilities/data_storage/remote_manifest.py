@@ -0,0 +1,159 @@
+import gzip
+import json
+import threading
+import typing
+
+from deploifai.cli.clouds.utilities.data_storage.remote_file import RemoteFile, internal_key_prefix
+
+"""
+Manages a manifest object in the cloud container that lists every file object of the dataset, so that a pull reads one
+object instead of paging through a listing of the whole container.
+
+Every push updates the manifest with the objects it uploaded and deleted, and builds it from a full listing if there
+is none yet. Each save increments the generation of the manifest, so a push that finds a newer generation than the
+one it loaded applies its own changes to the newer manifest instead of overwriting it. The manifest is only written if
+it is still at the version it was read at, and read again otherwise, so concurrent pushes, such as the pushes of the
+shards of a dataset, never overwrite each other's changes.
+
+remote manifest structure:
+{
+    "version": 1,
+    "generation": int,
+    "files": {
+        object_key: [size, md5 or null, etag, metadata]
+    }
+}
+
+The metadata is left out of an entry when it is not known, because the listing it was built from did not include it.
+"""
+
+remote_manifest_key = internal_key_prefix + "manifest.json.gz"
+
+remote_manifest_version = 1
+
+
+class RemoteManifest:
+    """
+    The file objects in the cloud container, stored as a gzipped json object next to them.
+    """
+
+    def __init__(self):
+        self.generation = 0
+        self.files = {}
+        self.changed = False
+        # the entries added and the keys removed since the manifest was loaded
+        self.added = {}
+        self.removed = set()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_bytes(cls, data: typing.Optional[bytes]) -> typing.Optional["RemoteManifest"]:
+        """
+        :param data: The content of the manifest object, or None if there is no manifest object yet.
+        :return: The RemoteManifest, or None if there is none, or it has a version this CLI does not read.
+        """
+        if data is None:
+            return None
+
+        content = json.loads(gzip.decompress(data).decode())
+        if content.get("version") != remote_manifest_version:
+            return None
+
+        manifest = cls()
+        manifest.generation = content.get("generation", 0)
+        manifest.files = content.get("files", {})
+        return manifest
+
+    @classmethod
+    def from_listing(cls, remote_files: typing.Iterable[RemoteFile], generation: int = 0) -> "RemoteManifest":
+        """
+        Build a manifest from a full listing of the container.
+        :param remote_files: The RemoteFiles of every file object.
+        :param generation: The generation of the manifest in the container when the listing started, or 0 if there is
+        none, which the listing replaces only if no push has saved the manifest since.
+        """
+        manifest = cls()
+        manifest.generation = generation
+        for remote_file in remote_files:
+            if not remote_file.key.startswith(internal_key_prefix):
+                manifest.files[remote_file.key] = cls.make_entry(remote_file)
+        manifest.changed = True
+        return manifest
+
+    def to_bytes(self) -> bytes:
+        with self._lock:
+            content = {"version": remote_manifest_version, "generation": self.generation, "files": self.files}
+            return gzip.compress(json.dumps(content, separators=(",", ":")).encode())
+
+    @staticmethod
+    def make_entry(remote_file: RemoteFile) -> list:
+        entry = [remote_file.size, remote_file.md5, remote_file.etag]
+        if remote_file.metadata is not None:
+            entry.append(remote_file.metadata)
+        return entry
+
+    @staticmethod
+    def describe_entry(object_key: str, entry: list) -> RemoteFile:
+        return RemoteFile(object_key, entry[0], entry[1], entry[2], entry[3] if len(entry) > 3 else None)
+
+    def describe(self, object_key: str) -> typing.Optional[RemoteFile]:
+        entry = self.files.get(object_key)
+        if entry is None:
+            return None
+        return self.describe_entry(object_key, entry)
+
+    def list_files(self, prefix: typing.Optional[str] = None) -> typing.Generator:
+        """
+        Lazily yields the RemoteFiles of the file objects under a prefix, like a listing of the container would.
+        :param prefix: The prefix of the object keys, or None for every file object.
+        """
+        with self._lock:
+            keys = sorted(k for k in self.files if prefix is None or k.startswith(prefix))
+        for object_key in keys:
+            remote_file = self.describe(object_key)
+            if remote_file is not None:
+                yield remote_file
+
+    def add(self, remote_file: RemoteFile):
+        """
+        Record a file object that has just been uploaded.
+        """
+        entry = self.make_entry(remote_file)
+        with self._lock:
+            self.files[remote_file.key] = entry
+            self.added[remote_file.key] = entry
+            self.removed.discard(remote_file.key)
+            self.changed = True
+
+    def remove(self, object_keys: typing.Iterable[str]):
+        """
+        Forget file objects that have been deleted.
+        """
+        with self._lock:
+            for object_key in object_keys:
+                self.files.pop(object_key, None)
+                self.added.pop(object_key, None)
+                self.removed.add(object_key)
+                self.changed = True
+
+    def rebase(self, latest: typing.Optional["RemoteManifest"]) -> "RemoteManifest":
+        """
+        Apply the changes made to this manifest since it was loaded to a manifest saved by another push in the meantime.
+        This manifest is left as it is, so it can be rebased again if the save conflicts with yet another push.
+        :param latest: The manifest in the container now, or None if there is none.
+        :return: The manifest to save, with the next generation.
+        """
+        if latest is None or latest.generation == self.generation:
+            # nothing was saved since this manifest was loaded, or its listing started
+            manifest = RemoteManifest()
+            manifest.files = self.files
+        else:
+            # the files found by a listing are not applied, because a newer manifest may have removed them since
+            manifest = latest
+            with self._lock:
+                for object_key, entry in self.added.items():
+                    manifest.files[object_key] = entry
+                for object_key in self.removed:
+                    manifest.files.pop(object_key, None)
+        manifest.generation = max(self.generation, latest.generation if latest is not None else 0) + 1
+        return manifest
@@ -0,0 +1,69 @@
+import hashlib
+import re
+import typing
+
+"""
+Splits the files of a dataset into shards, so that several machines can each transfer a disjoint part of the dataset.
+
+A file is assigned to a shard by a hash of its object key, so the assignment is the same on every machine and in every
+run, and does not depend on the order in which files are listed.
+
+Machines that transfer different shards of the same dataset directory keep their own sync state files, named like
+dataset.shard-0-of-4.state.db for dataset.state.db, so that each shard can be rerun independently.
+"""
+
+shard_filename_pattern = re.compile(r"^([^.]+)\.shard-\d+-of-\d+\.")
+
+
+class Shard:
+    """
+    One of count shards of a dataset, numbered from 0.
+    """
+
+    def __init__(self, index: int, count: int):
+        if count < 1:
+            raise ValueError("The number of shards must be at least 1")
+        if not 0 <= index < count:
+            raise ValueError("The shard index must be between 0 and {}".format(count - 1))
+        self.index = index
+        self.count = count
+
+    @classmethod
+    def parse(cls, value: str) -> "Shard":
+        """
+        Read a shard given as "index/count", such as "0/4" for the first of four shards.
+        """
+        index, separator, count = value.partition("/")
+        if separator == "" or not index.strip().isdigit() or not count.strip().isdigit():
+            raise ValueError("Expected a shard as I/N, such as 0/4 for the first of 4 shards")
+        return cls(int(index), int(count))
+
+    def __str__(self):
+        return "{}/{}".format(self.index, self.count)
+
+    def contains(self, object_key: str) -> bool:
+        """
+        Check whether a file is assigned to this shard.
+        :param object_key: The key of the file object in cloud storage.
+        """
+        digest = hashlib.md5(object_key.encode()).digest()
+        return int.from_bytes(digest[:8], "big") % self.count == self.index
+
+
+def state_filename(filename: str, shard: typing.Optional[Shard]) -> str:
+    """
+    The name of a sync state file of a shard.
+    :param filename: The name of the sync state file of the whole dataset, such as dataset.state.db.
+    :param shard: The Shard, or None for the whole dataset.
+    """
+    if shard is None:
+        return filename
+    name, _, extension = filename.partition(".")
+    return "{}.shard-{}-of-{}.{}".format(name, shard.index, shard.count, extension)
+
+
+def unshard_filename(filename: str) -> str:
+    """
+    The name of the sync state file of the whole dataset that a sync state file of a shard corresponds to.
+    """
+    return shard_filename_pattern.sub(r"\1.", filename)
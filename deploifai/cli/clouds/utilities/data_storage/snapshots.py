@@ -0,0 +1,178 @@
+import datetime
+import gzip
+import hashlib
+import json
+import threading
+import typing
+
+from deploifai.cli.clouds.utilities.data_storage.compression import encoding_metadata
+from deploifai.cli.clouds.utilities.data_storage.packing import PackIndex
+from deploifai.cli.clouds.utilities.data_storage.remote_file import RemoteFile, internal_key_prefix
+
+"""
+Manages immutable snapshots of a dataset, which record the content of every file at the time they are created, so
+that the dataset can be checked out as it was then, whatever has been pushed since.
+
+The content of every file is copied once, within the cloud container, to a content object that is never replaced:
+.deploifai/objects/<md5>          the content of a file, as it was pushed
+.deploifai/objects/<md5>.gz       the gzip compressed content of a file, as it was pushed with --compress
+.deploifai/objects/etag-<etag>    the content of an object whose md5 is not known, keyed by the ETag of its version
+.deploifai/objects/packs/<name>   a shard of packed files, whose name is already unique to its content
+Files with the same content, in one snapshot or in many, share their content object.
+
+A snapshot is a manifest object named by the sha256 of its content, so it cannot change once created, and snapshots of
+the same state of the dataset are the same snapshot:
+.deploifai/snapshots/<id>.json.gz
+{
+    "version": 1,
+    "files": {
+        object_key: [size, md5 or null, content key, content object size]
+    },
+    "packed": {
+        object_key: [size, md5, shard content key, offset]
+    }
+}
+
+Next to it, a small info object describes the snapshot, so that snapshots are listed without reading their manifests:
+.deploifai/snapshots/<id>.info.json
+{"id": string, "name": string or null, "created": iso 8601 datetime, "files": int, "size": int}
+"""
+
+content_prefix = internal_key_prefix + "objects/"
+
+snapshot_prefix = internal_key_prefix + "snapshots/"
+
+snapshot_version = 1
+
+# the number of hex digits of a snapshot id shown to the user, which is enough to tell snapshots apart
+short_id_length = 12
+
+
+def make_content_key(md5: typing.Optional[str], compressed: bool, etag: typing.Optional[str]) -> str:
+    """
+    The key of the content object of a file.
+    :param md5: The md5 hex digest of the file, or None if it is not known.
+    :param compressed: Whether the object of the file is gzip compressed.
+    :param etag: The ETag of the object of the file, which identifies its content when the md5 is not known.
+    """
+    if md5 is None:
+        return content_prefix + "etag-" + etag
+    return content_prefix + md5 + (".gz" if compressed else "")
+
+
+def make_shard_content_key(shard_key: str) -> str:
+    return content_prefix + "packs/" + shard_key.rsplit("/", 1)[-1]
+
+
+def manifest_key(snapshot_id: str) -> str:
+    return snapshot_prefix + snapshot_id + ".json.gz"
+
+
+def info_key(snapshot_id: str) -> str:
+    return snapshot_prefix + snapshot_id + ".info.json"
+
+
+def is_info_key(object_key: str) -> bool:
+    return object_key.startswith(snapshot_prefix) and object_key.endswith(".info.json")
+
+
+class Snapshot:
+    """
+    The manifest of a snapshot. Files are safe to add from multiple worker threads.
+    """
+
+    def __init__(self):
+        self.files = {}
+        self.packed = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "Snapshot":
+        """
+        :param data: The content of the manifest object.
+        """
+        content = json.loads(gzip.decompress(data).decode())
+        if content.get("version") != snapshot_version:
+            raise ValueError("Snapshot manifest version {} is not supported".format(content.get("version")))
+
+        snapshot = cls()
+        snapshot.files = content.get("files", {})
+        snapshot.packed = content.get("packed", {})
+        return snapshot
+
+    def to_json(self) -> bytes:
+        """
+        The canonical json of the manifest, whose sha256 is the id of the snapshot.
+        """
+        with self._lock:
+            content = {"version": snapshot_version, "files": self.files, "packed": self.packed}
+            return json.dumps(content, sort_keys=True, separators=(",", ":")).encode()
+
+    @staticmethod
+    def make_id(manifest_json: bytes) -> str:
+        return hashlib.sha256(manifest_json).hexdigest()
+
+    def add_file(self, object_key: str, size: int, md5: typing.Optional[str], content_key: str, content_size: int):
+        """
+        Record a file stored as an object of its own.
+        :param object_key: The key of the file object in cloud storage.
+        :param size: The size in bytes of the file.
+        :param md5: The md5 hex digest of the file, or None if it is not known.
+        :param content_key: The key of its content object.
+        :param content_size: The size in bytes of its content object, which is smaller if it is compressed.
+        """
+        with self._lock:
+            self.files[object_key] = [size, md5, content_key, content_size]
+
+    def add_packed_file(self, object_key: str, entry: dict, shard_content_key: str):
+        """
+        Record a packed file.
+        :param object_key: The key of the file object in cloud storage.
+        :param entry: The entry of the file in the pack index.
+        :param shard_content_key: The key of the content object of its shard.
+        """
+        with self._lock:
+            self.packed[object_key] = [entry["length"], entry["md5"], shard_content_key, entry["offset"]]
+
+    @property
+    def file_count(self) -> int:
+        return len(self.files) + len(self.packed)
+
+    @property
+    def size(self) -> int:
+        return sum(entry[0] for entry in self.files.values()) + sum(entry[0] for entry in self.packed.values())
+
+    def remote_files(self) -> typing.Generator:
+        """
+        Lazily yields the RemoteFiles of the files stored as objects of their own, whose content is downloaded from
+        their content objects.
+        """
+        for object_key, (size, md5, content_key, content_size) in self.files.items():
+            compressed = content_key.endswith(".gz")
+            yield RemoteFile(
+                object_key,
+                content_size,
+                None if compressed else md5,
+                # a content object is never replaced, so its key identifies its version like an ETag
+                content_key,
+                encoding_metadata(md5, size) if compressed else {},
+                content_key,
+            )
+
+    def pack_index(self) -> PackIndex:
+        """
+        A PackIndex of the packed files, whose shards are the content objects of the shards.
+        """
+        index = PackIndex()
+        for object_key, (length, md5, shard_content_key, offset) in self.packed.items():
+            index.files[object_key] = {"shard": shard_content_key, "offset": offset, "length": length, "md5": md5}
+        return index
+
+    def make_info(self, snapshot_id: str, name: typing.Optional[str]) -> dict:
+        return {
+            "id": snapshot_id,
+            "name": name,
+            "created": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"),
+            "files": self.file_count,
+            "size": self.size,
+        }
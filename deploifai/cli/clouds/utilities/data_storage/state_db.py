@@ -0,0 +1,183 @@
+import contextlib
+import sqlite3
+import threading
+import typing
+from pathlib import Path
+
+from deploifai.cli.clouds.utilities.data_storage.sharding import Shard, state_filename
+
+"""
+Manages a dataset.state.db file, stored next to dataset.cfg, that holds the sync state of a dataset directory in an
+SQLite database, so that looking up a file costs an index lookup instead of reading the whole state into memory.
+
+state database structure:
+meta (name TEXT PRIMARY KEY, value TEXT)
+    "version", "generation" (the number of the last push or pull), "remote_generation" (the generation of the remote
+    manifest at the last push or pull), "directories_filter"
+files (key TEXT PRIMARY KEY, size INTEGER, mtime INTEGER, md5 TEXT, etag TEXT, generation INTEGER)
+    the state of every file at the time it was last transferred, and the generation of the push or pull that did it
+hashes (stat_key TEXT PRIMARY KEY, md5 TEXT)
+    the md5 hex digests of local files by "device:inode:size:mtime"
+directories (path TEXT PRIMARY KEY, mtime INTEGER, dirs TEXT)
+    the state of every directory at the time it was last walked by a push, with its subdirectories as a json list
+
+Every table is keyed by a text primary key, which is compared byte by byte, so the rows under a prefix are a range of
+the primary key index and are queried without scanning the rest of the table.
+"""
+
+state_db_filename = "dataset.state.db"
+
+state_db_version = 1
+
+schema = """
+CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value TEXT) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS files (
+    key TEXT PRIMARY KEY, size INTEGER NOT NULL, mtime INTEGER NOT NULL, md5 TEXT, etag TEXT, generation INTEGER
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS hashes (stat_key TEXT PRIMARY KEY, md5 TEXT NOT NULL) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS directories (
+    path TEXT PRIMARY KEY, mtime INTEGER NOT NULL, dirs TEXT NOT NULL
+) WITHOUT ROWID;
+"""
+
+
+def prefix_range(prefix: str) -> typing.Tuple[str, typing.Optional[str]]:
+    """
+    The bounds of the keys that start with a prefix, as in "key >= lower AND key < upper".
+    :param prefix: The prefix of the keys.
+    :return: The lower bound, and the upper bound, or None if there is none.
+    """
+    # keys are compared by their utf-8 bytes, whose order is that of the code points
+    for i in range(len(prefix) - 1, -1, -1):
+        code_point = ord(prefix[i]) + 1
+        if code_point <= 0x10FFFF:
+            # surrogates are not encodable, and the next code point after them sorts the same
+            if 0xD800 <= code_point <= 0xDFFF:
+                code_point = 0xE000
+            return prefix, prefix[:i] + chr(code_point)
+    return prefix, None
+
+
+class SyncStateDatabase:
+    """
+    A connection to the sync state database of a dataset directory. Safe to use from multiple worker threads, which
+    take turns on the one connection.
+    """
+
+    def __init__(self, database_path: Path):
+        self.path = database_path
+        # transactions are begun explicitly, so that a bulk write is committed once
+        self.connection = sqlite3.connect(str(database_path), isolation_level=None, check_same_thread=False)
+        self._lock = threading.RLock()
+
+    @classmethod
+    def open(cls, dataset_directory: Path, shard: typing.Optional[Shard] = None) -> "SyncStateDatabase":
+        """
+        Open the sync state database of a dataset directory, creating it if there is none yet.
+        :param dataset_directory: The absolute directory path of the local dataset.
+        :param shard: The Shard that is transferred, which has a database of its own, or None for the whole dataset.
+        """
+        database = cls(dataset_directory.joinpath(state_filename(state_db_filename, shard)))
+        try:
+            database.connection.execute("PRAGMA journal_mode=WAL")
+            # a commit is durable once the write-ahead log is checkpointed, which the transfer journal makes up for
+            database.connection.execute("PRAGMA synchronous=NORMAL")
+            with database.transaction() as cursor:
+                # executescript would commit the transaction
+                for statement in schema.split(";"):
+                    if statement.strip() != "":
+                        cursor.execute(statement)
+                version = database.get_meta("version")
+                if version is not None and int(version) != state_db_version:
+                    # the state is only a cache of what has been synced, so a database of another version is rebuilt
+                    for table in ("files", "hashes", "directories", "meta"):
+                        cursor.execute("DELETE FROM {}".format(table))
+                database.set_meta("version", state_db_version)
+        except BaseException:
+            database.close()
+            raise
+        return database
+
+    @classmethod
+    def create(cls, dataset_directory: Path):
+        """
+        Create an empty sync state database in a new dataset directory.
+        :param dataset_directory: The directory path of the local dataset.
+        """
+        cls.open(dataset_directory).close()
+
+    @contextlib.contextmanager
+    def transaction(self):
+        """
+        Run statements in a transaction, which is committed if they all succeed and rolled back otherwise.
+        Transactions of different threads run one after the other.
+        :return: A cursor to run the statements with.
+        """
+        with self._lock:
+            cursor = self.connection.cursor()
+            if self.connection.in_transaction:
+                # nested in a transaction of the same thread
+                yield cursor
+                return
+            cursor.execute("BEGIN")
+            try:
+                yield cursor
+            except BaseException:
+                cursor.execute("ROLLBACK")
+                raise
+            cursor.execute("COMMIT")
+
+    def query(self, sql: str, parameters: typing.Iterable = ()) -> typing.List[tuple]:
+        with self._lock:
+            return self.connection.execute(sql, tuple(parameters)).fetchall()
+
+    def query_one(self, sql: str, parameters: typing.Iterable = ()) -> typing.Optional[tuple]:
+        with self._lock:
+            return self.connection.execute(sql, tuple(parameters)).fetchone()
+
+    def query_prefix(self, table: str, columns: str, key_column: str, prefix: typing.Optional[str]) -> typing.Generator:
+        """
+        Lazily yields the rows of a table whose key starts with a prefix, in the order of their keys.
+        The rows are read in batches, so that other threads can use the connection in between.
+        :param table: The name of the table.
+        :param columns: The columns to select, which start with the key column.
+        :param key_column: The name of the primary key column.
+        :param prefix: The prefix of the keys, or None for every row.
+        """
+        lower, upper = prefix_range(prefix or "")
+        after = None
+        while True:
+            conditions = ["{} >= ?".format(key_column)]
+            parameters = [lower]
+            if upper is not None:
+                conditions.append("{} < ?".format(key_column))
+                parameters.append(upper)
+            if after is not None:
+                conditions.append("{} > ?".format(key_column))
+                parameters.append(after)
+            rows = self.query(
+                "SELECT {} FROM {} WHERE {} ORDER BY {} LIMIT 1000".format(
+                    columns, table, " AND ".join(conditions), key_column
+                ),
+                parameters,
+            )
+            for row in rows:
+                yield row
+            if len(rows) < 1000:
+                return
+            after = rows[-1][0]
+
+    def get_meta(self, name: str) -> typing.Optional[str]:
+        row = self.query_one("SELECT value FROM meta WHERE name = ?", (name,))
+        return row[0] if row is not None else None
+
+    def set_meta(self, name: str, value):
+        with self.transaction() as cursor:
+            if value is None:
+                cursor.execute("DELETE FROM meta WHERE name = ?", (name,))
+            else:
+                cursor.execute("INSERT OR REPLACE INTO meta (name, value) VALUES (?, ?)", (name, str(value)))
+
+    def close(self):
+        with self._lock:
+            self.connection.close()
@@ -0,0 +1,106 @@
+import os
+import typing
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from pathlib import Path
+
+default_walk_concurrency = 8
+
+
+class DirectoryWalker:
+    """
+    Lists the files under a directory with os.scandir, scanning several subdirectories at a time, which hides the
+    latency of network filesystems.
+
+    Every scanned directory is recorded with its modification time and subdirectories. A directory only changes its
+    modification time when entries are added, removed or renamed in it, so with skip_unchanged, the files of a
+    directory that still has its recorded modification time are not listed, and its recorded subdirectories are walked
+    without listing it. Files modified in place in such a directory are missed, which is why it is opt-in.
+    """
+
+    def __init__(
+        self,
+        base_directory: Path,
+        directories: typing.Optional[dict] = None,
+        skip_unchanged: bool = False,
+        directory_filter: typing.Optional[typing.Callable[[str], bool]] = None,
+        concurrency: int = default_walk_concurrency,
+    ):
+        """
+        :param base_directory: The directory that the recorded directories are relative to.
+        :param directories: The directories recorded by the last walk, by their path relative to the base directory.
+        :param skip_unchanged: Whether to skip listing the directories that are unchanged since the last walk.
+        :param directory_filter: Returns whether to walk a subdirectory, given its path relative to the base directory.
+        :param concurrency: The number of directories scanned at a time.
+        """
+        self.base_directory = base_directory
+        self.directories = directories or {}
+        self.skip_unchanged = skip_unchanged
+        self.directory_filter = directory_filter
+        self.concurrency = concurrency
+        # the directories recorded by this walk, by their path relative to the base directory
+        self.scanned = {}
+        self.skipped_count = 0
+
+    def walk(self, directory: Path) -> typing.Generator:
+        """
+        Lazily yields the paths of all files under a directory.
+        :param directory: The absolute path to the directory.
+        """
+        pending = [directory]
+        running = set()
+
+        with ThreadPoolExecutor(max_workers=self.concurrency) as ex:
+            while len(pending) > 0 or len(running) > 0:
+                while len(pending) > 0 and len(running) < self.concurrency:
+                    running.add(ex.submit(self.scan, pending.pop()))
+
+                done, running = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    files, subdirectories = future.result()
+                    pending.extend(subdirectories)
+                    for file_path in files:
+                        yield file_path
+
+    def scan(self, directory: Path) -> typing.Tuple[typing.List[Path], typing.List[Path]]:
+        """
+        List the files and subdirectories of one directory.
+        :param directory: The absolute path to the directory.
+        :return: The paths of the files, and the paths of the subdirectories.
+        """
+        relative_path = directory.relative_to(self.base_directory).as_posix()
+
+        try:
+            mtime = os.stat(str(directory)).st_mtime_ns
+        except FileNotFoundError:
+            return [], []
+
+        record = self.directories.get(relative_path)
+        if self.skip_unchanged and record is not None and record["mtime"] == mtime:
+            self.scanned[relative_path] = record
+            self.skipped_count += 1
+            return [], self.filter_subdirectories(directory, record["dirs"])
+
+        files = []
+        subdirectory_names = []
+        try:
+            with os.scandir(str(directory)) as it:
+                for entry in it:
+                    # like os.walk, symbolic links to directories are neither followed nor listed as files
+                    if entry.is_dir(follow_symlinks=False):
+                        subdirectory_names.append(entry.name)
+                    elif entry.is_file():
+                        files.append(Path(entry.path))
+        except FileNotFoundError:
+            return [], []
+
+        # the modification time is read before listing, so a change made while listing is picked up next time
+        self.scanned[relative_path] = {"mtime": mtime, "dirs": sorted(subdirectory_names)}
+        return files, self.filter_subdirectories(directory, subdirectory_names)
+
+    def filter_subdirectories(self, directory: Path, names: typing.List[str]) -> typing.List[Path]:
+        subdirectories = [directory.joinpath(name) for name in names]
+        if self.directory_filter is None:
+            return subdirectories
+        return [
+            d for d in subdirectories if self.directory_filter(d.relative_to(self.base_directory).as_posix())
+        ]
@@ -1,6 +1,7 @@
 from pathlib import Path
 
 from deploifai.cli.api import DeploifaiAPI
+from deploifai.cli.clouds.utilities.data_storage.options import TransferOptions
 from deploifai.cli.clouds.azure.data_storage.handler import AzureDataStorageHandler
 from deploifai.cli.clouds.aws.data_storage.handler import AWSDataStorageHandler
 from deploifai.cli.clouds.gcp.data_storage.handler import GCPDataStorageHandler
@@ -17,14 +18,26 @@ class DataStorage:
         data = self.api.get_data_storage_info(self.id)
         provider = data["cloudProviderYodaConfig"]["provider"]
         if provider == "AZURE":
-            self.handler = AzureDataStorageHandler(self.api, self.id)
+            self.handler = AzureDataStorageHandler(self.api, self.id, data)
         elif provider == "AWS":
-            self.handler = AWSDataStorageHandler(self.api, self.id)
+            self.handler = AWSDataStorageHandler(self.api, self.id, data)
         elif provider == "GCP":
-            self.handler = GCPDataStorageHandler(self.api, self.id)
+            self.handler = GCPDataStorageHandler(self.api, self.id, data)
 
-    def push(self, target: Path):
-        self.handler.push(target)
+    def push(self, target: Path, options: TransferOptions = None):
+        return self.handler.push(target, options)
 
-    def pull(self, target: Path):
-        self.handler.pull(target)
+    def pull(self, target: Path, options: TransferOptions = None):
+        return self.handler.pull(target, options)
+
+    def status(self, target: Path, options: TransferOptions = None):
+        return self.handler.status(target, options)
+
+    def snapshot(self, name: str = None, options: TransferOptions = None):
+        return self.handler.snapshot(name, options)
+
+    def list_snapshots(self):
+        return self.handler.list_snapshots()
+
+    def checkout(self, snapshot_ref: str, options: TransferOptions = None):
+        return self.handler.checkout(snapshot_ref, options)
@@ -5,6 +5,8 @@ from deploifai.cli.dataset.push import push
 from deploifai.cli.dataset.create import create
 from deploifai.cli.dataset.list import list_data
 from deploifai.cli.dataset.pull import pull
+from deploifai.cli.dataset.status import status
+from deploifai.cli.dataset.snapshot import snapshot
 
 
 @click.group()
@@ -18,6 +20,8 @@ def dataset():
 dataset.add_command(init)
 dataset.add_command(push)
 dataset.add_command(pull)
+dataset.add_command(status)
+dataset.add_command(snapshot)
 dataset.add_command(info)
 dataset.add_command(create)
 dataset.add_command(list_data)
@@ -3,16 +3,50 @@ from pathlib import Path
 import click
 
 from deploifai.cli.clouds.utilities.data_storage.handler import DataStorageHandlerEmptyFilesException
+from deploifai.cli.clouds.utilities.data_storage.failures import failures_filenames
+from deploifai.cli.clouds.utilities.data_storage.options import TransferOptions
+from deploifai.cli.clouds.utilities.data_storage.sharding import Shard, state_filename
 from deploifai.cli.context import DeploifaiContextObj, pass_deploifai_context_obj, is_authenticated, dataset_found
 from deploifai.cli.core.data_storage import DataStorage
 
 
 @click.command()
 @click.argument("target", required=False)
+@click.option("--concurrency", type=click.IntRange(min=1),
+              help="Number of concurrent transfers. Fixed, unless --max-concurrency is also given")
+@click.option("--max-concurrency", type=click.IntRange(min=1),
+              help="Upper limit of concurrent transfers, which are tuned automatically up to it")
+@click.option("--part-size", type=click.IntRange(min=5), default=32, show_default=True,
+              help="Size in MB of the byte ranges that large files are downloaded in")
+@click.option("--part-concurrency", type=click.IntRange(min=1), default=8, show_default=True,
+              help="Number of byte ranges of a large file that are downloaded in parallel")
+@click.option("--resume", is_flag=True, default=False,
+              help="Continue the large file downloads left unfinished by an interrupted pull")
+@click.option("--continue-on-error", is_flag=True, default=False,
+              help="Carry on when a file fails, and list the failed files in dataset.pull.failures")
+@click.option("--retry-failed", is_flag=True, default=False,
+              help="Only pull the files listed in dataset.pull.failures by the last pull")
+@click.option("--include", multiple=True, metavar="PATTERN",
+              help="Only pull files matching this .gitignore style pattern. Can be repeated")
+@click.option("--exclude", multiple=True, metavar="PATTERN",
+              help="Skip files matching this .gitignore style pattern, on top of .deploifaiignore. Can be repeated")
+@click.option("--delete", is_flag=True, default=False,
+              help="Delete local files that do not exist in the cloud, so the local directory mirrors the dataset")
+@click.option("--shard", metavar="I/N",
+              help="Only pull shard I of N of the dataset, counting from 0. Each file belongs to exactly one shard")
+@click.option("--processes", type=click.IntRange(min=1),
+              help="Hash and transfer files in this many worker processes, for when one CPU core limits the transfer")
+@click.option("--full-listing", is_flag=True, default=False,
+              help="List the whole cloud container instead of reading the remote manifest kept by push")
 @pass_deploifai_context_obj
 @is_authenticated
 @dataset_found
-def pull(context: DeploifaiContextObj, target: str = None):
+def pull(context: DeploifaiContextObj, target: str = None, concurrency: int = None,
+         max_concurrency: int = None, part_size: int = 32, part_concurrency: int = 8,
+         resume: bool = False,
+         continue_on_error: bool = False, retry_failed: bool = False,
+         include: tuple = (), exclude: tuple = (), delete: bool = False,
+         shard: str = None, processes: int = None, full_listing: bool = False):
     """
     Download files from the cloud to local.
     """
@@ -32,6 +66,39 @@ def pull(context: DeploifaiContextObj, target: str = None):
     target_abs = cwd if target is None else cwd.joinpath(target)
 
     try:
-        datastorage_handler.pull(target_abs)
+        shard = Shard.parse(shard) if shard is not None else None
+    except ValueError as err:
+        raise click.BadParameter(str(err), param_hint="--shard")
+
+    options = TransferOptions(
+        concurrency=concurrency,
+        max_concurrency=max_concurrency,
+        part_size=part_size * 1024 * 1024,
+        part_concurrency=part_concurrency,
+        resume=resume,
+        continue_on_error=continue_on_error,
+        retry_failed=retry_failed,
+        include=include,
+        exclude=exclude,
+        delete=delete,
+        shard=shard,
+        processes=processes,
+        full_listing=full_listing,
+    )
+
+    try:
+        summary = datastorage_handler.pull(target_abs, options)
+        click.secho("Downloaded {} files ({:.1f} MB), {} unchanged".format(
+            summary.transferred, summary.transferred_bytes / 1e6, summary.skipped
+        ), fg="green")
+        click.secho("Concurrency: {} (peak {})".format(summary.concurrency, summary.peak_concurrency), fg="blue")
+        if delete:
+            click.secho("Deleted {} files".format(summary.deleted), fg="green")
+        if len(summary.failed) > 0:
+            click.secho("Failed to download {} files, listed in {}".format(
+                len(summary.failed), state_filename(failures_filenames["pull"], shard)
+            ), fg="red")
+            click.secho("Retry them with: deploifai dataset pull --retry-failed", fg="red")
+            raise click.exceptions.Exit(1)
     except DataStorageHandlerEmptyFilesException:
         click.secho("No files to pull", fg='yellow')
@@ -4,16 +4,60 @@ import click
 
 from deploifai.cli.clouds.utilities.data_storage.handler import DataStorageHandlerEmptyFilesException, \
     DataStorageHandlerTargetNotFoundException
+from deploifai.cli.clouds.utilities.data_storage.failures import failures_filenames
+from deploifai.cli.clouds.utilities.data_storage.options import TransferOptions
+from deploifai.cli.clouds.utilities.data_storage.sharding import Shard, state_filename
 from deploifai.cli.context import DeploifaiContextObj, pass_deploifai_context_obj, is_authenticated, dataset_found
 from deploifai.cli.core.data_storage import DataStorage
 
 
 @click.command()
 @click.argument("target", required=False)
+@click.option("--concurrency", type=click.IntRange(min=1),
+              help="Number of concurrent transfers. Fixed, unless --max-concurrency is also given")
+@click.option("--max-concurrency", type=click.IntRange(min=1),
+              help="Upper limit of concurrent transfers, which are tuned automatically up to it")
+@click.option("--part-size", type=click.IntRange(min=5), default=32, show_default=True,
+              help="Size in MB of the parts that large files are uploaded in")
+@click.option("--part-concurrency", type=click.IntRange(min=1), default=8, show_default=True,
+              help="Number of parts of a large file that are uploaded in parallel")
+@click.option("--pack", is_flag=True, default=False,
+              help="Pack files smaller than 1 MB into large shard objects, for datasets of many tiny files")
+@click.option("--resume", is_flag=True, default=False,
+              help="Continue the large file uploads left unfinished by an interrupted push")
+@click.option("--continue-on-error", is_flag=True, default=False,
+              help="Carry on when a file fails, and list the failed files in dataset.push.failures")
+@click.option("--retry-failed", is_flag=True, default=False,
+              help="Only push the files listed in dataset.push.failures by the last push")
+@click.option("--skip-unchanged-dirs", is_flag=True, default=False,
+              help="Skip directories with no files added, removed or renamed since the last push. "
+                   "Files modified in place in them are not pushed")
+@click.option("--include", multiple=True, metavar="PATTERN",
+              help="Only push files matching this .gitignore style pattern. Can be repeated")
+@click.option("--exclude", multiple=True, metavar="PATTERN",
+              help="Skip files matching this .gitignore style pattern, on top of .deploifaiignore. Can be repeated")
+@click.option("--delete", is_flag=True, default=False,
+              help="Delete files in the cloud that do not exist locally, so the dataset mirrors the local directory")
+@click.option("--shard", metavar="I/N",
+              help="Only push shard I of N of the dataset, counting from 0, to push from several machines in parallel")
+@click.option("--processes", type=click.IntRange(min=1),
+              help="Hash and transfer files in this many worker processes, for when one CPU core limits the transfer")
+@click.option("--compress", is_flag=True, default=False,
+              help="Store files gzip compressed in the cloud, except files that are already compressed. "
+                   "Pull decompresses them")
+@click.option("--full-listing", is_flag=True, default=False,
+              help="List the whole cloud container instead of trusting the remote manifest, "
+                   "and rebuild the manifest from the listing")
 @pass_deploifai_context_obj
 @is_authenticated
 @dataset_found
-def push(context: DeploifaiContextObj, target: str = None):
+def push(context: DeploifaiContextObj, target: str = None, concurrency: int = None,
+         max_concurrency: int = None, part_size: int = 32, part_concurrency: int = 8,
+         pack: bool = False, resume: bool = False,
+         continue_on_error: bool = False, retry_failed: bool = False, skip_unchanged_dirs: bool = False,
+         include: tuple = (), exclude: tuple = (), delete: bool = False,
+         shard: str = None, processes: int = None, compress: bool = False,
+         full_listing: bool = False):
     """
     Uploads files from local to the cloud.
     """
@@ -33,7 +77,43 @@ def push(context: DeploifaiContextObj, target: str = None):
     target_abs = cwd if target is None else cwd.joinpath(target)
 
     try:
-        datastorage_handler.push(target_abs)
+        shard = Shard.parse(shard) if shard is not None else None
+    except ValueError as err:
+        raise click.BadParameter(str(err), param_hint="--shard")
+
+    options = TransferOptions(
+        concurrency=concurrency,
+        max_concurrency=max_concurrency,
+        part_size=part_size * 1024 * 1024,
+        part_concurrency=part_concurrency,
+        pack=pack,
+        resume=resume,
+        continue_on_error=continue_on_error,
+        retry_failed=retry_failed,
+        skip_unchanged_directories=skip_unchanged_dirs,
+        include=include,
+        exclude=exclude,
+        delete=delete,
+        shard=shard,
+        processes=processes,
+        compress=compress,
+        full_listing=full_listing,
+    )
+
+    try:
+        summary = datastorage_handler.push(target_abs, options)
+        click.secho("Uploaded {} files ({:.1f} MB), {} unchanged".format(
+            summary.transferred, summary.transferred_bytes / 1e6, summary.skipped
+        ), fg="green")
+        click.secho("Concurrency: {} (peak {})".format(summary.concurrency, summary.peak_concurrency), fg="blue")
+        if delete:
+            click.secho("Deleted {} files".format(summary.deleted), fg="green")
+        if len(summary.failed) > 0:
+            click.secho("Failed to upload {} files, listed in {}".format(
+                len(summary.failed), state_filename(failures_filenames["push"], shard)
+            ), fg="red")
+            click.secho("Retry them with: deploifai dataset push --retry-failed", fg="red")
+            raise click.exceptions.Exit(1)
     except DataStorageHandlerEmptyFilesException:
         click.secho("No files to push", fg='yellow')
     except DataStorageHandlerTargetNotFoundException:
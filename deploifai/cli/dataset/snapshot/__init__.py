@@ -0,0 +1,17 @@
+import click
+
+from .create import create
+from .list import list_snapshot
+from .checkout import checkout
+
+
+@click.group()
+def snapshot():
+    """
+    Manage immutable snapshots of a dataset
+    """
+
+
+snapshot.add_command(create)
+snapshot.add_command(list_snapshot)
+snapshot.add_command(checkout)
@@ -0,0 +1,65 @@
+import click
+
+from deploifai.cli.clouds.utilities.data_storage.handler import DataStorageHandlerException
+from deploifai.cli.clouds.utilities.data_storage.options import TransferOptions
+from deploifai.cli.clouds.utilities.data_storage.snapshots import short_id_length
+from deploifai.cli.context import DeploifaiContextObj, pass_deploifai_context_obj, is_authenticated, dataset_found
+from deploifai.cli.core.data_storage import DataStorage
+
+
+@click.command()
+@click.argument("snapshot")
+@click.option("--concurrency", type=click.IntRange(min=1),
+              help="Number of concurrent transfers. Fixed, unless --max-concurrency is also given")
+@click.option("--max-concurrency", type=click.IntRange(min=1),
+              help="Upper limit of concurrent transfers, which are tuned automatically up to it")
+@click.option("--part-size", type=click.IntRange(min=5), default=32, show_default=True,
+              help="Size in MB of the byte ranges that large files are downloaded in")
+@click.option("--part-concurrency", type=click.IntRange(min=1), default=8, show_default=True,
+              help="Number of byte ranges of a large file that are downloaded in parallel")
+@click.option("--delete", is_flag=True, default=False,
+              help="Delete local files that are not in the snapshot, so the local directory mirrors it")
+@click.option("--processes", type=click.IntRange(min=1),
+              help="Hash and transfer files in this many worker processes, for when one CPU core limits the transfer")
+@pass_deploifai_context_obj
+@is_authenticated
+@dataset_found
+def checkout(context: DeploifaiContextObj, snapshot: str, concurrency: int = None,
+             max_concurrency: int = None, part_size: int = 32, part_concurrency: int = 8,
+             delete: bool = False, processes: int = None):
+    """
+    Restore the local dataset to a snapshot, given its id, a prefix of its id or its name. Only the files that differ
+    from the snapshot are downloaded.
+    """
+
+    api = context.api
+    dataset_id = context.dataset_config["DATASET"]["id"]
+
+    data = context.api.get_data_storage_info(dataset_id)
+
+    click.secho("Dataset Name: {}".format(data["name"]), fg="blue")
+    click.secho("Cloud Provider: {}".format(data["cloudProviderYodaConfig"]["provider"]), fg="blue")
+
+    datastorage_handler = DataStorage(api, dataset_id)
+
+    options = TransferOptions(
+        concurrency=concurrency,
+        max_concurrency=max_concurrency,
+        part_size=part_size * 1024 * 1024,
+        part_concurrency=part_concurrency,
+        delete=delete,
+        processes=processes,
+    )
+
+    try:
+        info, summary = datastorage_handler.checkout(snapshot, options)
+    except DataStorageHandlerException as err:
+        click.secho(str(err), fg="red")
+        raise click.exceptions.Exit(1)
+
+    click.secho("Checked out snapshot {}".format(info["id"][:short_id_length]), fg="green")
+    click.secho("Downloaded {} files ({:.1f} MB), {} unchanged".format(
+        summary.transferred, summary.transferred_bytes / 1e6, summary.skipped
+    ), fg="green")
+    if delete:
+        click.secho("Deleted {} files".format(summary.deleted), fg="green")
@@ -0,0 +1,55 @@
+import click
+
+from deploifai.cli.clouds.utilities.data_storage.handler import DataStorageHandlerEmptyFilesException
+from deploifai.cli.clouds.utilities.data_storage.options import TransferOptions
+from deploifai.cli.clouds.utilities.data_storage.snapshots import short_id_length
+from deploifai.cli.context import DeploifaiContextObj, pass_deploifai_context_obj, is_authenticated, dataset_found
+from deploifai.cli.core.data_storage import DataStorage
+
+
+@click.command()
+@click.option("--name", help="A name to check the snapshot out by, instead of its id")
+@click.option("--concurrency", type=click.IntRange(min=1),
+              help="Number of concurrent copies. Fixed, unless --max-concurrency is also given")
+@click.option("--max-concurrency", type=click.IntRange(min=1),
+              help="Upper limit of concurrent copies, which are tuned automatically up to it")
+@click.option("--full-listing", is_flag=True, default=False,
+              help="List the whole cloud container instead of reading the remote manifest kept by push")
+@pass_deploifai_context_obj
+@is_authenticated
+@dataset_found
+def create(context: DeploifaiContextObj, name: str = None, concurrency: int = None, max_concurrency: int = None,
+           full_listing: bool = False):
+    """
+    Create a snapshot of the files in the cloud, which can be checked out later whatever is pushed since.
+    """
+
+    api = context.api
+    dataset_id = context.dataset_config["DATASET"]["id"]
+
+    data = context.api.get_data_storage_info(dataset_id)
+
+    click.secho("Dataset Name: {}".format(data["name"]), fg="blue")
+    click.secho("Cloud Provider: {}".format(data["cloudProviderYodaConfig"]["provider"]), fg="blue")
+
+    datastorage_handler = DataStorage(api, dataset_id)
+
+    options = TransferOptions(
+        concurrency=concurrency,
+        max_concurrency=max_concurrency,
+        full_listing=full_listing,
+    )
+
+    try:
+        info, created, summary = datastorage_handler.snapshot(name, options)
+    except DataStorageHandlerEmptyFilesException:
+        click.secho("No files to snapshot", fg="yellow")
+        return
+
+    if created:
+        click.secho("Created snapshot {}".format(info["id"][:short_id_length]), fg="green")
+    else:
+        click.secho("The files are unchanged since snapshot {}".format(info["id"][:short_id_length]), fg="yellow")
+    click.secho("{} files ({:.1f} MB), {} new content objects copied ({:.1f} MB)".format(
+        info["files"], info["size"] / 1e6, summary.transferred, summary.transferred_bytes / 1e6
+    ), fg="blue")
@@ -0,0 +1,35 @@
+import click
+
+from deploifai.cli.clouds.utilities.data_storage.snapshots import short_id_length
+from deploifai.cli.context import DeploifaiContextObj, pass_deploifai_context_obj, is_authenticated, dataset_found
+from deploifai.cli.core.data_storage import DataStorage
+
+
+@click.command("list")
+@pass_deploifai_context_obj
+@is_authenticated
+@dataset_found
+def list_snapshot(context: DeploifaiContextObj):
+    """
+    List the snapshots of the dataset, oldest first
+    """
+
+    api = context.api
+    dataset_id = context.dataset_config["DATASET"]["id"]
+
+    datastorage_handler = DataStorage(api, dataset_id)
+
+    infos = datastorage_handler.list_snapshots()
+
+    if len(infos) == 0:
+        click.secho("No snapshots exist", fg="yellow")
+        return
+
+    for info in infos:
+        click.echo("{}  {}  {} files ({:.1f} MB){}".format(
+            info["id"][:short_id_length],
+            info["created"],
+            info["files"],
+            info["size"] / 1e6,
+            "  " + info["name"] if info["name"] is not None else "",
+        ))
@@ -0,0 +1,65 @@
+from pathlib import Path
+
+import click
+
+from deploifai.cli.clouds.utilities.data_storage.options import TransferOptions
+from deploifai.cli.clouds.utilities.data_storage.sharding import Shard
+from deploifai.cli.context import DeploifaiContextObj, pass_deploifai_context_obj, is_authenticated, dataset_found
+from deploifai.cli.core.data_storage import DataStorage
+
+
+@click.command()
+@click.argument("target", required=False)
+@click.option("--include", multiple=True, metavar="PATTERN",
+              help="Only compare files matching this .gitignore style pattern. Can be repeated")
+@click.option("--exclude", multiple=True, metavar="PATTERN",
+              help="Skip files matching this .gitignore style pattern, on top of .deploifaiignore. Can be repeated")
+@click.option("--shard", metavar="I/N",
+              help="Only compare shard I of N of the dataset, counting from 0")
+@click.option("--full-listing", is_flag=True, default=False,
+              help="List the whole cloud container instead of reading the remote manifest kept by push")
+@pass_deploifai_context_obj
+@is_authenticated
+@dataset_found
+def status(context: DeploifaiContextObj, target: str = None,
+           include: tuple = (), exclude: tuple = (), shard: str = None, full_listing: bool = False):
+    """
+    Show how local files differ from the cloud, without transferring anything.
+    """
+
+    api = context.api
+    dataset_id = context.dataset_config["DATASET"]["id"]
+
+    data = context.api.get_data_storage_info(dataset_id)
+
+    click.secho("Dataset Name: {}".format(data["name"]), fg="blue")
+    click.secho("Cloud Provider: {}".format(data["cloudProviderYodaConfig"]["provider"]), fg="blue")
+
+    datastorage_handler = DataStorage(api, dataset_id)
+
+    # find the absolute path to the target directory
+    cwd = Path.cwd()
+    target_abs = cwd if target is None else cwd.joinpath(target)
+
+    try:
+        shard = Shard.parse(shard) if shard is not None else None
+    except ValueError as err:
+        raise click.BadParameter(str(err), param_hint="--shard")
+
+    options = TransferOptions(
+        include=include,
+        exclude=exclude,
+        shard=shard,
+        full_listing=full_listing,
+    )
+
+    summary = datastorage_handler.status(target_abs, options)
+    if summary.remote_generation is not None:
+        click.secho("Compared with the remote manifest (generation {})".format(summary.remote_generation), fg="blue")
+    else:
+        click.secho("Compared with a listing of the cloud container", fg="blue")
+
+    click.secho("Added: {} files ({:.1f} MB)".format(summary.added, summary.added_bytes / 1e6), fg="green")
+    click.secho("Modified: {} files ({:.1f} MB)".format(summary.modified, summary.modified_bytes / 1e6), fg="yellow")
+    click.secho("Deleted: {} files ({:.1f} MB)".format(summary.deleted, summary.deleted_bytes / 1e6), fg="red")
+    click.secho("Unchanged: {} files".format(summary.unchanged))
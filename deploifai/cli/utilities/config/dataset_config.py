@@ -2,6 +2,7 @@ import configparser
 import pathlib
 import click
 
+from deploifai.cli.clouds.utilities.data_storage.state_db import SyncStateDatabase
 from deploifai.cli.utilities.config.find_config_filepath import find_config_absolute_path
 
 """
@@ -40,7 +41,7 @@ class DatasetNotInitialisedError(Exception):
 
 def create_config_files(new_dataset_dir: str = None):
     """
-    Creates the .dataset config files.
+    Creates the .dataset config files, and the sync state database next to them.
     :return: None
     """
     global config_file_path
@@ -59,6 +60,8 @@ def create_config_files(new_dataset_dir: str = None):
     with config_file_path.open("w") as config_file:
         config.write(config_file)
 
+    SyncStateDatabase.create(dataset_config_dir)
+
 
 def read_config_file() -> configparser.ConfigParser:
     """
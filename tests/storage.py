@@ -0,0 +1,175 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import typing
+import unittest
+from pathlib import Path
+from unittest import mock
+
+from deploifai.cli.clouds.utilities.data_storage.handler import DataStorageHandler
+from deploifai.cli.clouds.utilities.data_storage.remote_file import RemoteFile
+from deploifai.cli.utilities.config import dataset_config
+
+"""
+A data storage handler that keeps the cloud container in a local directory, so that pushes and pulls are tested end to
+end without a cloud provider. Conditional writes check the md5 of the object, like the ETag of a cloud provider, and
+the directory is shared with the worker processes of a push with processes.
+"""
+
+
+class DirectoryDataStorageHandler(DataStorageHandler):
+    def __init__(self, api, dataset_id: str, data: dict = None):
+        if data is None:
+            data = api.get_data_storage_info(dataset_id)
+        self.root = Path(data["root"])
+        super().__init__(dataset_id, self.root.name, None, data)
+
+    def object_path(self, object_key: str) -> Path:
+        return self.root.joinpath("objects", object_key)
+
+    def metadata_path(self, object_key: str) -> Path:
+        return self.root.joinpath("metadata", object_key + ".json")
+
+    def write_object(self, object_key: str, data: bytes, metadata: typing.Optional[dict] = None) -> str:
+        for path, content in ((self.object_path(object_key), data),
+                              (self.metadata_path(object_key), json.dumps(metadata or {}).encode())):
+            path.parent.mkdir(parents=True, exist_ok=True)
+            # written whole and then renamed, so a reader never sees a partial object
+            partial_path = path.with_name(path.name + ".partial-{}".format(os.getpid()))
+            partial_path.write_bytes(content)
+            os.replace(str(partial_path), str(path))
+        return hashlib.md5(data).hexdigest()
+
+    def upload_file(self, file_path: Path, object_key: str, metadata: typing.Optional[dict] = None):
+        return self.write_object(object_key, file_path.read_bytes(), metadata)
+
+    def get_object_bytes(self, object_key: str) -> typing.Optional[bytes]:
+        try:
+            return self.object_path(object_key).read_bytes()
+        except FileNotFoundError:
+            return None
+
+    def put_object_bytes(self, object_key: str, data: bytes) -> str:
+        return self.write_object(object_key, data)
+
+    def get_versioned_object_bytes(self, object_key: str) -> typing.Tuple[typing.Optional[bytes], typing.Optional[str]]:
+        data = self.get_object_bytes(object_key)
+        if data is None:
+            return None, None
+        return data, hashlib.md5(data).hexdigest()
+
+    def put_object_bytes_if_unchanged(self, object_key: str, data: bytes, version: typing.Optional[str]) -> bool:
+        if self.get_versioned_object_bytes(object_key)[1] != version:
+            return False
+        self.write_object(object_key, data)
+        return True
+
+    def copy_object(self, source: RemoteFile, destination_key: str):
+        data = self.object_path(source.key).read_bytes()
+        if source.etag is not None and hashlib.md5(data).hexdigest() != source.etag:
+            raise ValueError("The object {} has changed since it was listed".format(source.key))
+        self.write_object(destination_key, data, self.get_object_metadata(source.key))
+
+    def abort_multipart_upload(self, object_key: str, upload_id: str):
+        pass
+
+    def list_files(self, prefix: str = None) -> typing.Generator:
+        objects_path = self.root.joinpath("objects")
+        for path in sorted(objects_path.rglob("*")):
+            object_key = path.relative_to(objects_path).as_posix()
+            if path.is_file() and ".partial-" not in path.name and (prefix is None or object_key.startswith(prefix)):
+                yield object_key
+
+    def list_directory(self, prefix: str) -> typing.Generator:
+        files = []
+        subprefixes = set()
+        for object_key in self.list_files(prefix or None):
+            name, separator, _ = object_key[len(prefix):].partition("/")
+            if separator == "":
+                files.append(self.describe_file(object_key))
+            else:
+                subprefixes.add(prefix + name + "/")
+        yield files, sorted(subprefixes)
+
+    def describe_file(self, file) -> RemoteFile:
+        data = self.object_path(file).read_bytes()
+        md5 = hashlib.md5(data).hexdigest()
+        return RemoteFile(file, len(data), md5, md5, self.get_object_metadata(file))
+
+    def delete_objects(self, object_keys: typing.List[str]):
+        for object_key in object_keys:
+            for path in (self.object_path(object_key), self.metadata_path(object_key)):
+                if path.exists():
+                    os.remove(str(path))
+
+    def download_file(self, remote_file: RemoteFile) -> typing.Optional[dict]:
+        shutil.copyfile(
+            str(self.object_path(remote_file.content_key)), str(self.dataset_directory.joinpath(remote_file.key))
+        )
+        return self.get_object_metadata(remote_file.content_key)
+
+    def get_object_metadata(self, object_key: str) -> dict:
+        return json.loads(self.metadata_path(object_key).read_text())
+
+    def download_range(self, object_key: str, start: int, length: int) -> bytes:
+        with self.object_path(object_key).open("rb") as f:
+            f.seek(start)
+            return f.read(length)
+
+
+class DatasetTestCase(unittest.TestCase):
+    """
+    Runs every test in a dataset directory of its own, which is the working directory, with a container in a
+    directory next to it.
+    """
+
+    def setUp(self):
+        temporary_directory = tempfile.TemporaryDirectory()
+        self.addCleanup(temporary_directory.cleanup)
+        self.dataset_directory = Path(temporary_directory.name).joinpath("dataset").resolve()
+        self.dataset_directory.mkdir()
+        config_path = self.dataset_directory.joinpath(dataset_config.relative_config_filepath)
+        config_path.write_text("[DATASET]\nid = dataset\n")
+
+        cwd = os.getcwd()
+        os.chdir(str(self.dataset_directory))
+        self.addCleanup(os.chdir, cwd)
+        config_path_patch = mock.patch.object(dataset_config, "config_file_path", config_path)
+        config_path_patch.start()
+        self.addCleanup(config_path_patch.stop)
+
+        self.storage_info = {"root": str(Path(temporary_directory.name).joinpath("container"))}
+
+    def create_handler(self) -> DirectoryDataStorageHandler:
+        return DirectoryDataStorageHandler(None, "dataset", self.storage_info)
+
+    def write_files(self, files: typing.Dict[str, bytes]):
+        for object_key, data in files.items():
+            file_path = self.dataset_directory.joinpath(object_key)
+            file_path.parent.mkdir(parents=True, exist_ok=True)
+            file_path.write_bytes(data)
+
+    def read_files(self) -> typing.Dict[str, bytes]:
+        """
+        The content of the dataset files in the dataset directory, without its sync state files.
+        """
+        handler = self.create_handler()
+        return {
+            path.relative_to(self.dataset_directory).as_posix(): path.read_bytes()
+            for path in self.dataset_directory.rglob("*")
+            if path.is_file() and not handler.is_sync_state_file(path)
+        }
+
+    def clear_dataset_directory(self):
+        """
+        Remove every file, and the sync state, from the dataset directory, as on a machine that has never pulled.
+        """
+        for path in self.dataset_directory.iterdir():
+            if path.name == dataset_config.relative_config_filepath.name:
+                continue
+            if path.is_dir():
+                shutil.rmtree(str(path))
+            else:
+                os.remove(str(path))
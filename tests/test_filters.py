@@ -0,0 +1,105 @@
+import unittest
+
+from deploifai.cli.clouds.utilities.data_storage.filters import PathFilter, parse_patterns
+
+
+class PathFilterTest(unittest.TestCase):
+    def test_unanchored_pattern_matches_name_at_any_depth(self):
+        path_filter = PathFilter(exclude=["*.log"])
+        self.assertFalse(path_filter.matches("a.log"))
+        self.assertFalse(path_filter.matches("a/b/c.log"))
+        self.assertTrue(path_filter.matches("a/b/c.txt"))
+
+    def test_anchored_pattern_matches_from_dataset_directory(self):
+        path_filter = PathFilter(exclude=["a/*.txt"])
+        self.assertFalse(path_filter.matches("a/b.txt"))
+        self.assertTrue(path_filter.matches("x/a/b.txt"))
+        # * does not match /
+        self.assertTrue(path_filter.matches("a/b/c.txt"))
+
+    def test_double_star_matches_any_number_of_directories(self):
+        path_filter = PathFilter(exclude=["a/**/c.txt"])
+        self.assertFalse(path_filter.matches("a/c.txt"))
+        self.assertFalse(path_filter.matches("a/b/b/c.txt"))
+        self.assertTrue(path_filter.matches("b/c.txt"))
+
+    def test_directory_pattern_excludes_files_in_directory(self):
+        path_filter = PathFilter(exclude=["build/"])
+        self.assertFalse(path_filter.matches("build/a.txt"))
+        self.assertFalse(path_filter.matches("x/build/a.txt"))
+        # only directories match a pattern ending with /
+        self.assertTrue(path_filter.matches("x/build"))
+
+    def test_negated_pattern_includes_again(self):
+        path_filter = PathFilter(exclude=["*.txt", "!keep.txt"])
+        self.assertFalse(path_filter.matches("a.txt"))
+        self.assertTrue(path_filter.matches("keep.txt"))
+        self.assertTrue(path_filter.matches("a/keep.txt"))
+
+    def test_files_in_excluded_directory_cannot_be_included_again(self):
+        path_filter = PathFilter(exclude=["data/", "!data/keep.txt"])
+        self.assertFalse(path_filter.matches("data/keep.txt"))
+
+    def test_later_rules_take_precedence(self):
+        path_filter = PathFilter(exclude=["!a.txt", "*.txt"])
+        self.assertFalse(path_filter.matches("a.txt"))
+
+    def test_include_patterns_select_files_and_directories(self):
+        path_filter = PathFilter(include=["images/", "*.csv"])
+        self.assertTrue(path_filter.matches("images/a/b.png"))
+        self.assertTrue(path_filter.matches("x/y.csv"))
+        self.assertFalse(path_filter.matches("x/y.png"))
+
+    def test_exclude_rules_apply_to_included_files(self):
+        path_filter = PathFilter(exclude=["*.tmp"], include=["images/"])
+        self.assertFalse(path_filter.matches("images/a.tmp"))
+
+    def test_may_contain_matches(self):
+        path_filter = PathFilter(exclude=["cache/"], include=["a/b/*.txt"])
+        self.assertTrue(path_filter.may_contain_matches("a"))
+        self.assertTrue(path_filter.may_contain_matches("a/b"))
+        self.assertFalse(path_filter.may_contain_matches("a/c"))
+        self.assertFalse(path_filter.may_contain_matches("cache"))
+
+    def test_fingerprint_changes_with_rules(self):
+        self.assertEqual(PathFilter(exclude=["a"]).fingerprint, PathFilter(exclude=["a"]).fingerprint)
+        self.assertNotEqual(PathFilter(exclude=["a"]).fingerprint, PathFilter(include=["a"]).fingerprint)
+
+    def test_parse_patterns_skips_blank_lines_and_comments(self):
+        self.assertEqual(parse_patterns(["# comment\n", "\n", "*.log  \n", "\\#name\n"]), ["*.log", "\\#name"])
+
+
+class ListPrefixesTest(unittest.TestCase):
+    def test_without_include_patterns_lists_target(self):
+        self.assertEqual(PathFilter().list_prefixes(None), [None])
+        self.assertEqual(PathFilter().list_prefixes("a"), ["a"])
+
+    def test_unanchored_include_pattern_lists_target(self):
+        self.assertEqual(PathFilter(include=["*.csv"]).list_prefixes("a"), ["a"])
+
+    def test_literal_prefixes_of_include_patterns(self):
+        path_filter = PathFilter(include=["a/b/*.txt", "c/d.txt"])
+        self.assertEqual(path_filter.list_prefixes(None), ["a/b/", "c/d.txt"])
+
+    def test_overlapping_prefixes_are_listed_once(self):
+        path_filter = PathFilter(include=["/a/", "a/b/c.txt"])
+        self.assertEqual(path_filter.list_prefixes(None), ["a"])
+
+    def test_unanchored_directory_pattern_lists_target(self):
+        # a/ matches a directory named a at any depth
+        self.assertEqual(PathFilter(include=["a/"]).list_prefixes(None), [None])
+
+    def test_literal_prefix_under_target(self):
+        path_filter = PathFilter(include=["a/b/c/*.txt", "x/*.txt"])
+        self.assertEqual(path_filter.list_prefixes("a/b"), ["a/b/c/"])
+
+    def test_literal_prefix_ending_part_way_through_target_name(self):
+        self.assertEqual(PathFilter(include=["a/b*"]).list_prefixes("a/bc"), ["a/bc"])
+
+    def test_literal_prefix_of_sibling_directory_is_not_listed(self):
+        # a/bc/ starts with the target a/b, but is not in the directory a/b
+        self.assertEqual(PathFilter(include=["a/bc/**"]).list_prefixes("a/b"), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,71 @@
+import contextlib
+import typing
+import unittest
+
+from google.api_core.exceptions import Forbidden, NotFound
+
+from deploifai.cli.clouds.gcp.data_storage.handler import GCPDataStorageHandler
+from deploifai.cli.clouds.utilities.data_storage.handler import DataStorageHandlerDeleteException
+
+
+class FakeBucket:
+    """
+    Deletes blobs like a Cloud Storage bucket, where a batch raises the first error of its calls once they all ran.
+    """
+
+    def __init__(self, object_keys: typing.Iterable[str], forbidden_keys: typing.Iterable[str] = ()):
+        self.object_keys = set(object_keys)
+        self.forbidden_keys = set(forbidden_keys)
+        self.client = self
+        self._batch_errors = None
+
+    @contextlib.contextmanager
+    def batch(self):
+        self._batch_errors = []
+        yield
+        errors = self._batch_errors
+        self._batch_errors = None
+        if len(errors) > 0:
+            raise errors[0]
+
+    def delete_blob(self, object_key: str):
+        if object_key in self.forbidden_keys:
+            err = Forbidden(object_key)
+        elif object_key not in self.object_keys:
+            err = NotFound(object_key)
+        else:
+            self.object_keys.remove(object_key)
+            return
+        if self._batch_errors is None:
+            raise err
+        self._batch_errors.append(err)
+
+
+class GCPDeleteObjectsTest(unittest.TestCase):
+    def delete_objects(self, bucket: FakeBucket, object_keys: typing.List[str]):
+        # the handler is built without credentials, since it only sends requests through the bucket
+        handler = GCPDataStorageHandler.__new__(GCPDataStorageHandler)
+        handler.container = lambda: bucket
+        handler.delete_objects(object_keys)
+
+    def test_deletes_every_object(self):
+        bucket = FakeBucket(["a", "b"])
+        self.delete_objects(bucket, ["a", "b"])
+        self.assertEqual(bucket.object_keys, set())
+
+    def test_missing_objects_are_not_an_error(self):
+        bucket = FakeBucket(["b"])
+        self.delete_objects(bucket, ["a", "b"])
+        self.assertEqual(bucket.object_keys, set())
+
+    def test_failure_after_missing_object_is_raised(self):
+        bucket = FakeBucket(["b", "c", "d"], forbidden_keys=["c"])
+
+        with self.assertRaises(DataStorageHandlerDeleteException) as raised:
+            self.delete_objects(bucket, ["a", "b", "c", "d"])
+        self.assertEqual(raised.exception.object_keys, ["c"])
+        self.assertEqual(bucket.object_keys, {"c"})
+
+
+if __name__ == "__main__":
+    unittest.main()
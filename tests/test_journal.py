@@ -0,0 +1,93 @@
+import os
+import tempfile
+import unittest
+from pathlib import Path
+
+from deploifai.cli.clouds.utilities.data_storage.journal import TransferJournal
+from deploifai.cli.clouds.utilities.data_storage.sharding import Shard
+
+entry = {"size": 1, "mtime": 2, "md5": "md5", "etag": "etag"}
+
+
+class TransferJournalTest(unittest.TestCase):
+    def setUp(self):
+        temporary_directory = tempfile.TemporaryDirectory()
+        self.addCleanup(temporary_directory.cleanup)
+        self.directory = Path(temporary_directory.name)
+        self.stat = self.directory.stat()
+
+    def test_interrupted_run_is_replayed(self):
+        journal = TransferJournal.open(self.directory, "push")
+        journal.record_file("a.txt", entry)
+        journal.record_failure("b.txt", "error")
+        journal.record_failure("c.txt", "error")
+        journal.record_file("c.txt", entry)
+        journal.begin_upload("big.bin", "upload", self.stat, 5)
+        journal.record_part("big.bin", "upload", 1, "part 1")
+        journal.record_part("big.bin", "other upload", 2, "part 2")
+        journal._file.close()
+
+        journal = TransferJournal.open(self.directory, "push")
+        self.assertEqual(journal.completed_files, {"a.txt": entry, "c.txt": entry})
+        # a file that failed and then succeeded is not failed
+        self.assertEqual(journal.failed_files, {"b.txt": "error"})
+        upload = journal.find_upload("big.bin", self.stat, 5)
+        self.assertEqual(upload["parts"], {1: "part 1"})
+        self.assertIsNone(journal.find_upload("big.bin", self.stat, 6))
+        journal.close()
+
+    def test_cut_short_last_line_is_skipped(self):
+        journal = TransferJournal.open(self.directory, "pull")
+        journal.record_file("a.txt", entry)
+        journal._file.write('{"op": "file", "key": "b.t')
+        journal._file.close()
+
+        journal = TransferJournal.open(self.directory, "pull")
+        self.assertEqual(list(journal.completed_files), ["a.txt"])
+        journal.close()
+
+    def test_finished_transfers_are_not_resumed(self):
+        journal = TransferJournal.open(self.directory, "pull")
+        journal.begin_download("big.bin", "etag", 10, 5)
+        journal.record_range("big.bin", "etag", 0)
+        journal.record_range("big.bin", "other etag", 1)
+        journal.begin_download("done.bin", "etag", 10, 5)
+        journal.end("done.bin")
+        journal._file.close()
+
+        journal = TransferJournal.open(self.directory, "pull")
+        self.assertEqual(journal.find_download("big.bin", "etag", 10, 5)["ranges"], {0})
+        self.assertIsNone(journal.find_download("big.bin", "new etag", 10, 5))
+        self.assertIsNone(journal.find_download("done.bin", "etag", 10, 5))
+        journal.close()
+
+    def test_journal_is_kept_while_transfers_are_unfinished(self):
+        journal = TransferJournal.open(self.directory, "push")
+        journal.begin_upload("big.bin", "upload", self.stat, 5)
+        journal.close()
+        self.assertTrue(journal.path.exists())
+
+        journal = TransferJournal.open(self.directory, "push")
+        journal.end("big.bin")
+        journal.close()
+        self.assertFalse(journal.path.exists())
+
+    def test_reset_forgets_last_run(self):
+        journal = TransferJournal.open(self.directory, "push")
+        journal.record_file("a.txt", entry)
+        journal._file.close()
+
+        journal = TransferJournal.open(self.directory, "push")
+        journal.reset()
+        self.assertEqual(journal.completed_files, {})
+        journal._file.close()
+        self.assertEqual(os.path.getsize(str(journal.path)), 0)
+
+    def test_shards_have_journals_of_their_own(self):
+        journal = TransferJournal.open(self.directory, "push", Shard(1, 4))
+        self.assertEqual(journal.path.name, "dataset.shard-1-of-4.push.journal")
+        journal.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,88 @@
+import typing
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+from deploifai.cli.clouds.utilities.data_storage.listing import PrefixPartitionedListing
+from deploifai.cli.clouds.utilities.data_storage.remote_file import RemoteFile
+
+
+class FakeContainer:
+    """
+    Lists a set of object keys like a cloud provider, in pages of a few keys.
+    """
+
+    def __init__(self, object_keys: typing.Iterable[str], page_size: int = 3):
+        self.object_keys = sorted(object_keys)
+        self.page_size = page_size
+        self.listed_prefixes = []
+
+    def list_directory(self, prefix: str) -> typing.Generator:
+        entries = []
+        for object_key in self.object_keys:
+            if object_key.startswith(prefix):
+                name, separator, _ = object_key[len(prefix):].partition("/")
+                entry = prefix + name + separator
+                if len(entries) == 0 or entries[-1] != entry:
+                    entries.append(entry)
+        for i in range(0, max(len(entries), 1), self.page_size):
+            page = entries[i:i + self.page_size]
+            yield (
+                [RemoteFile(entry, 1, None, None) for entry in page if not entry.endswith("/")],
+                [entry for entry in page if entry.endswith("/")],
+            )
+
+    def list_prefix(self, prefix: str) -> typing.Generator:
+        self.listed_prefixes.append(prefix)
+        for object_key in self.object_keys:
+            if object_key.startswith(prefix):
+                yield RemoteFile(object_key, 1, None, None)
+
+
+class PrefixPartitionedListingTest(unittest.TestCase):
+    def setUp(self):
+        self.executor = ThreadPoolExecutor(max_workers=4)
+        self.addCleanup(self.executor.shutdown)
+
+    def list(self, container: FakeContainer, prefix: str = "", concurrency: int = 4) -> typing.List[str]:
+        listing = PrefixPartitionedListing(
+            container.list_directory, container.list_prefix, self.executor, concurrency=concurrency
+        )
+        return [remote_file.key for remote_file in listing.list(prefix)]
+
+    def test_lists_every_file_once(self):
+        object_keys = ["top.txt"] + ["d{}/e{}/f{}.txt".format(i % 5, i % 3, i) for i in range(100)]
+        container = FakeContainer(object_keys)
+
+        listed = self.list(container)
+        self.assertEqual(sorted(listed), sorted(object_keys))
+
+    def test_lists_under_prefix(self):
+        container = FakeContainer(["a/b/c.txt", "a/d.txt", "ab/e.txt"])
+
+        self.assertEqual(sorted(self.list(container, "a/")), ["a/b/c.txt", "a/d.txt"])
+
+    def test_flat_prefix_is_listed_by_one_cursor(self):
+        object_keys = ["f{:02}.txt".format(i) for i in range(10)]
+        container = FakeContainer(object_keys)
+
+        listed = self.list(container)
+        # the first page is not listed twice when the listing starts again without the delimiter
+        self.assertEqual(sorted(listed), object_keys)
+        self.assertEqual(container.listed_prefixes, [""])
+
+    def test_empty_container(self):
+        self.assertEqual(self.list(FakeContainer([])), [])
+
+    def test_errors_of_partitions_are_raised(self):
+        container = FakeContainer(["d{}/f.txt".format(i) for i in range(8)])
+
+        def list_prefix(prefix: str):
+            raise ConnectionError(prefix)
+
+        container.list_prefix = list_prefix
+        with self.assertRaises(ConnectionError):
+            self.list(container, concurrency=2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,74 @@
+import tempfile
+import unittest
+from pathlib import Path
+
+from deploifai.cli.clouds.utilities.data_storage.manifest import SyncManifest, normalise_etag
+from deploifai.cli.clouds.utilities.data_storage.state_db import SyncStateDatabase
+
+
+class SyncManifestTest(unittest.TestCase):
+    def setUp(self):
+        temporary_directory = tempfile.TemporaryDirectory()
+        self.addCleanup(temporary_directory.cleanup)
+        self.directory = Path(temporary_directory.name)
+        self.file_path = self.directory.joinpath("a.txt")
+        self.file_path.write_text("a")
+
+    def open_manifest(self) -> SyncManifest:
+        database = SyncStateDatabase.open(self.directory)
+        self.addCleanup(database.close)
+        return SyncManifest.load(database)
+
+    def test_saved_entries_are_loaded(self):
+        manifest = self.open_manifest()
+        manifest.record("a.txt", self.file_path.stat(), "md5", '"etag"')
+        manifest.directories["d"] = {"mtime": 1, "dirs": ["e"]}
+        manifest.save()
+        manifest.database.close()
+
+        manifest = self.open_manifest()
+        self.assertEqual(manifest.get("a.txt")["etag"], "etag")
+        self.assertEqual(manifest.directories, {"d": {"mtime": 1, "dirs": ["e"]}})
+        self.assertEqual(manifest.generation, 2)
+
+    def test_unsaved_entries_are_lost(self):
+        manifest = self.open_manifest()
+        manifest.record("a.txt", self.file_path.stat(), "md5", "etag")
+        manifest.database.close()
+
+        self.assertIsNone(self.open_manifest().get("a.txt"))
+
+    def test_is_unchanged_compares_size_and_modification_time(self):
+        manifest = self.open_manifest()
+        self.assertFalse(manifest.is_unchanged("a.txt", self.file_path.stat()))
+
+        manifest.record("a.txt", self.file_path.stat(), "md5", "etag")
+        self.assertTrue(manifest.is_unchanged("a.txt", self.file_path.stat()))
+
+        self.file_path.write_text("ab")
+        self.assertFalse(manifest.is_unchanged("a.txt", self.file_path.stat()))
+
+    def test_removed_entries_are_forgotten(self):
+        manifest = self.open_manifest()
+        manifest.record("a.txt", self.file_path.stat(), "md5", "etag")
+        manifest.save()
+        manifest.remove(["a.txt"])
+        manifest.save()
+
+        self.assertIsNone(manifest.get("a.txt"))
+        self.assertEqual(list(manifest.list_files()), [])
+
+    def test_list_files_under_prefix(self):
+        manifest = self.open_manifest()
+        for object_key in ("a/b.txt", "a/c.txt", "ab.txt", "b.txt"):
+            manifest.record(object_key, self.file_path.stat(), "md5", "etag")
+
+        self.assertEqual([object_key for object_key, _ in manifest.list_files("a/")], ["a/b.txt", "a/c.txt"])
+
+    def test_normalise_etag(self):
+        self.assertEqual(normalise_etag('"abc"'), "abc")
+        self.assertIsNone(normalise_etag(None))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,128 @@
+import tempfile
+import unittest
+from pathlib import Path
+
+from deploifai.cli.clouds.utilities.data_storage.packing import (
+    PackIndex,
+    PackWriter,
+    coalesce_ranges,
+    split_packed_ranges,
+)
+
+
+def member(object_key: str, offset: int, length: int = 10) -> dict:
+    return {"key": object_key, "offset": offset, "length": length, "md5": object_key}
+
+
+class PackIndexTest(unittest.TestCase):
+    def test_round_trip_drops_unreferenced_shards(self):
+        index = PackIndex()
+        index.add_shard("s1", 100, [member("a", 0)])
+        index.add_shard("s2", 100, [member("b", 0)])
+        index.remove("b")
+
+        loaded = PackIndex.from_bytes(index.to_bytes())
+        self.assertEqual(list(loaded.files), ["a"])
+        self.assertEqual(loaded.shards, {"s1": 100})
+        self.assertFalse(loaded.changed)
+
+    def test_missing_index_is_empty(self):
+        self.assertEqual(PackIndex.from_bytes(None).files, {})
+
+    def test_rebase_keeps_changes_of_other_pushes(self):
+        base = PackIndex()
+        base.add_shard("s0", 100, [member("a", 0), member("b", 20)])
+        data = base.to_bytes()
+
+        mine = PackIndex.from_bytes(data)
+        mine.add_shard("s1", 100, [member("c", 0)])
+        mine.remove("a")
+
+        theirs = PackIndex.from_bytes(data)
+        theirs.add_shard("s2", 100, [member("d", 0), member("b", 20)])
+        latest = PackIndex.from_bytes(theirs.to_bytes())
+
+        rebased = PackIndex.from_bytes(mine.rebase(latest).to_bytes())
+        self.assertEqual(sorted(rebased.files), ["b", "c", "d"])
+        self.assertEqual(rebased.files["b"]["shard"], "s2")
+        self.assertEqual(sorted(rebased.shards), ["s1", "s2"])
+
+    def test_rebase_can_be_repeated(self):
+        mine = PackIndex()
+        mine.add_shard("s1", 100, [member("a", 0)])
+        mine.rebase(PackIndex())
+
+        self.assertEqual(list(mine.rebase(PackIndex()).files), ["a"])
+
+
+class PackWriterTest(unittest.TestCase):
+    def setUp(self):
+        temporary_directory = tempfile.TemporaryDirectory()
+        self.addCleanup(temporary_directory.cleanup)
+        self.directory = Path(temporary_directory.name)
+
+    def test_members_are_at_their_offsets_in_shard(self):
+        shards = []
+
+        def upload_shard(shard_path: Path, shard_key: str, members: list):
+            shards.append((shard_path.read_bytes(), members))
+            return len(members)
+
+        writer = PackWriter(upload_shard, shard_size=3000)
+        files = {"a.txt": b"a" * 1000, "b/c.txt": b"c" * 700, "d.txt": b"d" * 10}
+        results = []
+        for object_key, data in files.items():
+            file_path = self.directory.joinpath(object_key.replace("/", "_"))
+            file_path.write_bytes(data)
+            results.append(writer.add(file_path, object_key, file_path.stat()))
+        results.append(writer.close())
+
+        # the second file fills the first shard
+        self.assertEqual(results, [None, 2, None, 1])
+        for shard, members in shards:
+            for m in members:
+                self.assertEqual(shard[m["offset"]:m["offset"] + m["length"]], files[m["key"]])
+
+    def test_discard_removes_unfinished_shard(self):
+        writer = PackWriter(lambda *shard: self.fail("a discarded shard is uploaded"))
+        file_path = self.directory.joinpath("a.txt")
+        file_path.write_bytes(b"a")
+        writer.add(file_path, "a.txt", file_path.stat())
+        writer.discard()
+
+        self.assertIsNone(writer.close())
+
+
+class PackedRangesTest(unittest.TestCase):
+    def test_split_packed_ranges_by_prefix_and_length(self):
+        index = PackIndex()
+        index.add_shard("s1", 100, [member("d1/a", 0), member("d1/b", 10), member("d1/c", 20), member("d10/a", 30)])
+        index.add_shard("s2", 100, [member("d1/d", 0)])
+
+        ranges = sorted(
+            (packed_range.shard_key, [entry["key"] for entry in packed_range.entries])
+            for packed_range in split_packed_ranges(index, "d1", 20)
+        )
+        # d10 is not in the directory d1
+        self.assertEqual(ranges, [("s1", ["d1/a", "d1/b"]), ("s1", ["d1/c"]), ("s2", ["d1/d"])])
+
+    def test_split_packed_ranges_with_key_filter(self):
+        index = PackIndex()
+        index.add_shard("s1", 100, [member("a", 0), member("b", 10)])
+
+        ranges = list(split_packed_ranges(index, None, 100, key_filter=lambda object_key: object_key == "b"))
+        self.assertEqual([[entry["key"] for entry in r.entries] for r in ranges], [["b"]])
+
+    def test_coalesce_ranges(self):
+        entries = [member("c", 100), member("a", 0), member("b", 15), member("d", 115)]
+
+        groups = coalesce_ranges(entries, max_length=100, max_gap=10)
+        # a big gap starts a new range, and so does a range that would get too long
+        self.assertEqual([[e["key"] for e in group] for group in groups], [["a", "b"], ["c", "d"]])
+
+        groups = coalesce_ranges(entries, max_length=20, max_gap=100)
+        self.assertEqual([[e["key"] for e in group] for group in groups], [["a"], ["b"], ["c"], ["d"]])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,217 @@
+import os
+import sys
+import unittest
+from unittest import mock
+
+from deploifai.cli.clouds.utilities.data_storage import handler as handler_module
+from deploifai.cli.clouds.utilities.data_storage.failures import load_failures
+from deploifai.cli.clouds.utilities.data_storage.journal import TransferJournal
+from deploifai.cli.clouds.utilities.data_storage.options import TransferOptions
+from deploifai.cli.clouds.utilities.data_storage.packing import PackIndex, index_key
+from deploifai.cli.clouds.utilities.data_storage.remote_file import RemoteFile
+from deploifai.cli.clouds.utilities.data_storage.remote_manifest import RemoteManifest, remote_manifest_key
+from deploifai.cli.clouds.utilities.data_storage.state_db import SyncStateDatabase
+from tests.storage import DatasetTestCase
+
+
+class PushTest(DatasetTestCase):
+    files = {"a.txt": b"a" * 10, "d/b.txt": b"b" * 20, "d/e/c.txt": b"c" * 30}
+
+    def setUp(self):
+        super().setUp()
+        # conflicting saves are retried after a random delay
+        sleep_patch = mock.patch.object(handler_module.time, "sleep")
+        sleep_patch.start()
+        self.addCleanup(sleep_patch.stop)
+        self.write_files(self.files)
+
+    def push(self, handler=None, **options):
+        handler = handler if handler is not None else self.create_handler()
+        return handler.push(self.dataset_directory, TransferOptions(**options))
+
+    def assert_pulled_by_new_machine(self, files: dict):
+        self.clear_dataset_directory()
+        self.create_handler().pull(self.dataset_directory, TransferOptions())
+        self.assertEqual(self.read_files(), files)
+
+    def hash_count(self) -> int:
+        database = SyncStateDatabase.open(self.dataset_directory)
+        try:
+            return database.query_one("SELECT count(*) FROM hashes")[0]
+        finally:
+            database.close()
+
+    def test_push_uploads_only_changed_files(self):
+        self.assertEqual(self.push().transferred, 3)
+
+        self.write_files({"d/b.txt": b"changed"})
+        summary = self.push()
+        self.assertEqual((summary.transferred, summary.skipped), (1, 2))
+
+        self.assert_pulled_by_new_machine(dict(self.files, **{"d/b.txt": b"changed"}))
+
+    def test_packed_files_are_pulled(self):
+        summary = self.push(pack=True)
+        self.assertEqual(summary.transferred, 3)
+        self.assertEqual(len(self.create_handler().load_pack_index().files), 3)
+
+        self.assert_pulled_by_new_machine(self.files)
+
+    def test_delete_mirrors_local_directory(self):
+        self.push()
+        os.remove(str(self.dataset_directory.joinpath("d/b.txt")))
+
+        summary = self.push(delete=True)
+        self.assertEqual(summary.deleted, 1)
+        files = dict(self.files)
+        del files["d/b.txt"]
+        self.assert_pulled_by_new_machine(files)
+
+    def test_save_remote_manifest_applies_changes_saved_by_another_push(self):
+        handler = self.create_handler()
+        other = self.create_handler()
+        manifest = RemoteManifest()
+        manifest.add(RemoteFile("mine", 1, None, "etag"))
+        put_object_bytes_if_unchanged = handler.put_object_bytes_if_unchanged
+
+        def save_other_manifest_first(object_key, data, version):
+            if not other_saved:
+                other_manifest = RemoteManifest()
+                other_manifest.add(RemoteFile("theirs", 1, None, "etag"))
+                other.save_remote_manifest(other_manifest)
+                other_saved.append(True)
+            return put_object_bytes_if_unchanged(object_key, data, version)
+
+        other_saved = []
+        with mock.patch.object(handler, "put_object_bytes_if_unchanged", side_effect=save_other_manifest_first) as put:
+            generation = handler.save_remote_manifest(manifest)
+
+        # the first conditional write fails, and the second one is applied to the manifest of the other push
+        self.assertEqual(put.call_count, 2)
+        self.assertEqual(generation, 2)
+        saved = RemoteManifest.from_bytes(handler.get_object_bytes(remote_manifest_key))
+        self.assertEqual(sorted(saved.files), ["mine", "theirs"])
+
+    def test_save_pack_index_applies_changes_saved_by_another_push(self):
+        handler = self.create_handler()
+        index = PackIndex()
+        index.add_shard("mine", 10, [{"key": "a", "offset": 0, "length": 1, "md5": "a"}])
+        put_object_bytes_if_unchanged = handler.put_object_bytes_if_unchanged
+        results = iter([False])
+
+        def fail_first_write(object_key, data, version):
+            if next(results, True):
+                return put_object_bytes_if_unchanged(object_key, data, version)
+            other_index = PackIndex()
+            other_index.add_shard("theirs", 10, [{"key": "b", "offset": 0, "length": 1, "md5": "b"}])
+            handler.put_object_bytes(index_key, other_index.to_bytes())
+            return False
+
+        with mock.patch.object(handler, "put_object_bytes_if_unchanged", side_effect=fail_first_write):
+            handler.save_pack_index(index)
+
+        saved = PackIndex.from_bytes(handler.get_object_bytes(index_key))
+        self.assertEqual(sorted(saved.files), ["a", "b"])
+        self.assertEqual(sorted(saved.shards), ["mine", "theirs"])
+
+    def test_files_are_pushed_again_after_failed_remote_manifest_save(self):
+        self.push()
+        self.write_files({"new.txt": b"new", "d/b.txt": b"changed"})
+        handler = self.create_handler()
+        with mock.patch.object(handler, "save_remote_manifest", side_effect=RuntimeError("save failed")):
+            with self.assertRaises(RuntimeError):
+                self.push(handler)
+
+        # no pull would find the files the failed push uploaded, so they are not skipped as synced
+        summary = self.push()
+        self.assertEqual(summary.transferred, 2)
+        self.assert_pulled_by_new_machine(dict(self.files, **{"new.txt": b"new", "d/b.txt": b"changed"}))
+
+    def test_files_are_packed_again_after_failed_pack_index_save(self):
+        handler = self.create_handler()
+        with mock.patch.object(handler, "save_pack_index", side_effect=RuntimeError("save failed")):
+            with self.assertRaises(RuntimeError):
+                self.push(handler, pack=True)
+
+        summary = self.push(pack=True)
+        self.assertEqual(summary.transferred, 3)
+        self.assert_pulled_by_new_machine(self.files)
+
+    def test_directories_are_not_skipped_after_failed_save(self):
+        self.push()
+        self.write_files({"d/new.txt": b"new"})
+        handler = self.create_handler()
+        with mock.patch.object(handler, "save_remote_manifest", side_effect=RuntimeError("save failed")):
+            with self.assertRaises(RuntimeError):
+                self.push(handler, skip_unchanged_directories=True)
+
+        summary = self.push(skip_unchanged_directories=True)
+        self.assertEqual(summary.transferred, 1)
+        self.assert_pulled_by_new_machine(dict(self.files, **{"d/new.txt": b"new"}))
+
+    def test_hash_cache_is_not_pruned_by_interrupted_push(self):
+        self.push()
+        self.assertEqual(self.hash_count(), 3)
+        self.write_files({object_key: data + b"changed" for object_key, data in self.files.items()})
+
+        handler = self.create_handler()
+        upload_file = handler.upload_file
+        uploads = []
+
+        def fail_after_first_upload(*args):
+            if len(uploads) > 0:
+                raise RuntimeError("interrupted")
+            uploads.append(args)
+            return upload_file(*args)
+
+        with mock.patch.object(handler, "upload_file", side_effect=fail_after_first_upload):
+            with self.assertRaises(RuntimeError):
+                self.push(handler, concurrency=1)
+
+        # the hashes of the unchanged files that the push never got to are kept, next to those of the changed files
+        self.assertEqual(self.hash_count(), 6)
+
+    def test_hash_cache_is_kept_by_push_with_processes(self):
+        self.push()
+        self.assertEqual(self.hash_count(), 3)
+
+        # the worker processes are spawned, and import the handler from the working directory of the test runner
+        with mock.patch.object(sys, "path", [os.path.abspath(p) for p in sys.path]):
+            summary = self.push(processes=2)
+        self.assertEqual(summary.skipped, 3)
+        self.assertEqual(self.hash_count(), 3)
+
+    def test_failures_of_interrupted_push_are_retried(self):
+        self.push()
+        self.write_files({"a.txt": b"changed", "d/b.txt": b"changed"})
+        # a push that died after d/b.txt failed, before it saved its failures
+        journal = TransferJournal.open(self.dataset_directory, "push")
+        journal.record_failure("d/b.txt", "error")
+        journal._file.close()
+
+        summary = self.push(retry_failed=True)
+        self.assertEqual(summary.transferred, 1)
+        self.assertEqual(load_failures(self.dataset_directory, "push"), {})
+        self.assertEqual(self.push().transferred, 1)
+
+    def test_continue_on_error_records_failures(self):
+        handler = self.create_handler()
+        upload_file = handler.upload_file
+
+        def fail_b(file_path, object_key, metadata=None):
+            if object_key == "d/b.txt":
+                raise RuntimeError("failed")
+            return upload_file(file_path, object_key, metadata)
+
+        with mock.patch.object(handler, "upload_file", side_effect=fail_b):
+            summary = self.push(handler, continue_on_error=True)
+        self.assertEqual(list(summary.failed), ["d/b.txt"])
+        self.assertEqual(list(load_failures(self.dataset_directory, "push")), ["d/b.txt"])
+
+        summary = self.push(retry_failed=True)
+        self.assertEqual(summary.transferred, 1)
+        self.assert_pulled_by_new_machine(self.files)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,24 @@
+import unittest
+
+from deploifai.cli.clouds.utilities.data_storage.remote_file import base64_md5_to_hex, is_under_prefix
+
+
+class RemoteFileTest(unittest.TestCase):
+    def test_is_under_prefix(self):
+        self.assertTrue(is_under_prefix("a/b.txt", None))
+        self.assertTrue(is_under_prefix("a/b.txt", "a"))
+        self.assertTrue(is_under_prefix("a/b.txt", "a/b.txt"))
+        # a prefix only matches whole names
+        self.assertFalse(is_under_prefix("ab/c.txt", "a"))
+        self.assertFalse(is_under_prefix("a/bc.txt", "a/b"))
+
+    def test_base64_md5_to_hex(self):
+        self.assertEqual(base64_md5_to_hex("1B2M2Y8AsgTpgAmY7PhCfg=="), "d41d8cd98f00b204e9800998ecf8427e")
+        self.assertEqual(base64_md5_to_hex(bytes.fromhex("d41d8cd98f00b204e9800998ecf8427e")),
+                         "d41d8cd98f00b204e9800998ecf8427e")
+        self.assertIsNone(base64_md5_to_hex(None))
+        self.assertIsNone(base64_md5_to_hex("not base64!"))
+
+
+if __name__ == "__main__":
+    unittest.main()
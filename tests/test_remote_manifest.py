@@ -0,0 +1,74 @@
+import unittest
+
+from deploifai.cli.clouds.utilities.data_storage.remote_file import RemoteFile
+from deploifai.cli.clouds.utilities.data_storage.remote_manifest import RemoteManifest
+
+
+def remote_file(object_key: str, etag: str = "etag") -> RemoteFile:
+    return RemoteFile(object_key, 1, "md5", etag, {})
+
+
+class RemoteManifestTest(unittest.TestCase):
+    def test_from_listing_leaves_out_internal_objects(self):
+        manifest = RemoteManifest.from_listing([remote_file("a"), remote_file(".deploifai/packs/index.json.gz")])
+        self.assertEqual(list(manifest.files), ["a"])
+        self.assertTrue(manifest.changed)
+
+    def test_round_trip(self):
+        manifest = RemoteManifest()
+        manifest.add(remote_file("a/b", "1"))
+        manifest.generation = 3
+
+        loaded = RemoteManifest.from_bytes(manifest.to_bytes())
+        self.assertEqual(loaded.generation, 3)
+        self.assertEqual(loaded.describe("a/b").etag, "1")
+        self.assertEqual([f.key for f in loaded.list_files("a/")], ["a/b"])
+        self.assertIsNone(RemoteManifest.from_bytes(None))
+
+    def test_rebase_onto_newer_manifest(self):
+        base = RemoteManifest()
+        for object_key in ("a", "b", "c"):
+            base.add(remote_file(object_key))
+        base.generation = 1
+        data = base.to_bytes()
+
+        mine = RemoteManifest.from_bytes(data)
+        mine.add(remote_file("d"))
+        mine.remove(["a"])
+
+        theirs = RemoteManifest.from_bytes(data)
+        theirs.add(remote_file("b", "new"))
+        theirs.remove(["c"])
+        latest = theirs.rebase(RemoteManifest.from_bytes(data))
+        self.assertEqual(latest.generation, 2)
+
+        rebased = mine.rebase(RemoteManifest.from_bytes(latest.to_bytes()))
+        self.assertEqual(sorted(rebased.files), ["b", "d"])
+        self.assertEqual(rebased.describe("b").etag, "new")
+        self.assertEqual(rebased.generation, 3)
+
+    def test_rebase_listing_onto_unchanged_manifest(self):
+        listing = RemoteManifest.from_listing([remote_file("a")], generation=4)
+        latest = RemoteManifest()
+        latest.generation = 4
+        latest.files = {"stale": [1, None, "etag"]}
+
+        rebased = listing.rebase(latest)
+        self.assertEqual(list(rebased.files), ["a"])
+        self.assertEqual(rebased.generation, 5)
+
+    def test_rebase_listing_onto_newer_manifest(self):
+        # a file found by the listing may have been deleted by the push that saved the newer manifest
+        listing = RemoteManifest.from_listing([remote_file("a"), remote_file("deleted")], generation=4)
+        listing.add(remote_file("b"))
+        latest = RemoteManifest()
+        latest.generation = 5
+        latest.files = {"a": [1, None, "etag"]}
+
+        rebased = listing.rebase(latest)
+        self.assertEqual(sorted(rebased.files), ["a", "b"])
+        self.assertEqual(rebased.generation, 6)
+
+
+if __name__ == "__main__":
+    unittest.main()
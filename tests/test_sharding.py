@@ -0,0 +1,41 @@
+import unittest
+
+from deploifai.cli.clouds.utilities.data_storage.sharding import Shard, state_filename, unshard_filename
+
+
+class ShardTest(unittest.TestCase):
+    def test_every_file_is_in_exactly_one_shard(self):
+        shards = [Shard(index, 4) for index in range(4)]
+        counts = [0] * 4
+        for i in range(4000):
+            object_key = "d{}/f{}.txt".format(i % 7, i)
+            containing = [shard.index for shard in shards if shard.contains(object_key)]
+            self.assertEqual(len(containing), 1)
+            counts[containing[0]] += 1
+
+        # md5 spreads the files evenly over the shards
+        for count in counts:
+            self.assertGreater(count, 800)
+
+    def test_assignment_depends_only_on_key(self):
+        self.assertEqual(
+            [Shard(index, 3).contains("a/b.txt") for index in range(3)],
+            [Shard(index, 3).contains("a/b.txt") for index in range(3)],
+        )
+
+    def test_parse(self):
+        shard = Shard.parse("1/4")
+        self.assertEqual((shard.index, shard.count), (1, 4))
+        self.assertEqual(str(shard), "1/4")
+        for value in ("1", "a/4", "4/4", "0/0", "-1/4"):
+            with self.assertRaises(ValueError):
+                Shard.parse(value)
+
+    def test_state_filenames(self):
+        self.assertEqual(state_filename("dataset.state.db", None), "dataset.state.db")
+        self.assertEqual(state_filename("dataset.state.db", Shard(0, 4)), "dataset.shard-0-of-4.state.db")
+        self.assertEqual(unshard_filename("dataset.shard-0-of-4.state.db"), "dataset.state.db")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,55 @@
+import unittest
+
+from deploifai.cli.clouds.utilities.data_storage.handler import DataStorageHandlerSnapshotNotFoundException
+from deploifai.cli.clouds.utilities.data_storage.options import TransferOptions
+from tests.storage import DatasetTestCase
+
+
+class SnapshotTest(DatasetTestCase):
+    files = {"a.txt": b"a", "d/b.txt": b"b", "d/c.txt": b"c", "p/e.txt": b"e"}
+
+    def setUp(self):
+        super().setUp()
+        self.write_files(self.files)
+        self.handler = self.create_handler()
+        self.handler.push(self.dataset_directory.joinpath("p"), TransferOptions(pack=True))
+        self.handler.push(self.dataset_directory, TransferOptions())
+
+    def test_checkout_restores_snapshot(self):
+        info, created, _ = self.handler.snapshot("v1")
+        self.assertTrue(created)
+        self.write_files({"a.txt": b"changed"})
+        self.handler.push(self.dataset_directory, TransferOptions())
+
+        self.clear_dataset_directory()
+        _, summary = self.handler.checkout("v1")
+        self.assertEqual(summary.transferred, 4)
+        self.assertEqual(self.read_files(), self.files)
+
+        self.assertEqual([snapshot["id"] for snapshot in self.handler.list_snapshots()], [info["id"]])
+
+    def test_unchanged_snapshot_is_not_created_again(self):
+        info, _, _ = self.handler.snapshot("v1")
+
+        same_info, created, _ = self.handler.snapshot("v2")
+        self.assertFalse(created)
+        self.assertEqual(same_info["id"], info["id"])
+
+    def test_checkout_applies_include_and_exclude_rules(self):
+        self.handler.snapshot("v1")
+        self.clear_dataset_directory()
+
+        self.handler.checkout("v1", TransferOptions(exclude=["d/", "p/e.txt"]))
+        self.assertEqual(self.read_files(), {"a.txt": b"a"})
+
+        self.handler.checkout("v1", TransferOptions(include=["d/**"], delete=True))
+        # excluded files are not deleted, because they are not part of the checkout
+        self.assertEqual(self.read_files(), {"a.txt": b"a", "d/b.txt": b"b", "d/c.txt": b"c"})
+
+    def test_unknown_snapshot(self):
+        with self.assertRaises(DataStorageHandlerSnapshotNotFoundException):
+            self.handler.checkout("missing")
+
+
+if __name__ == "__main__":
+    unittest.main()